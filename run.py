@@ -59,6 +59,17 @@ def run_backend():
     except FileNotFoundError:
         print("❌ Arquivo app_consolidado.py não encontrado")
 
+def run_http_server():
+    """Executa o backend em modo servidor (HTTP + WebSocket na porta 8000)"""
+    print("🌐 Iniciando servidor HTTP...")
+    server_script = Path(__file__).resolve().parent / "server" / "http_server.py"
+    try:
+        subprocess.run([sys.executable, str(server_script), "--port", "8000"], check=True)
+    except KeyboardInterrupt:
+        print("\n🛑 Servidor interrompido pelo usuário")
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Erro no servidor: {e}")
+
 def run_electron():
     """Executa o frontend Electron (se disponível)"""
     print("⚡ Tentando iniciar Electron...")
@@ -109,7 +120,7 @@ def main():
     print("✅ Todos os arquivos necessários encontrados")
     print("\n🎯 Escolha o modo de execução:")
     print("1. Backend + Frontend (Electron) - Recomendado")
-    print("2. Apenas Backend (Abrir http://localhost:8000 no navegador)")
+    print("2. Apenas Backend (servidor HTTP/WebSocket em http://localhost:8000)")
     print("3. Sair")
     
     try:
@@ -124,8 +135,8 @@ def main():
         
         elif choice == "2":
             print("\n🚀 Executando apenas backend...")
-            print("📖 Após iniciar, abra http://localhost:8000 no seu navegador")
-            run_backend()
+            print("📖 Após iniciar, o backend responde em http://localhost:8000 (POST /acao, WebSocket /ws)")
+            run_http_server()
         
         elif choice == "3":
             print("👋 Até logo!")
@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Cache de respostas por similaridade semântica da pergunta.
+
+    Cada resposta fica associada ao embedding da pergunta e à versão do corpus
+    (hash dos documentos indexados). Perguntas com similaridade de cosseno acima
+    de `threshold` reaproveitam a resposta. Quando o corpus muda, o cache inteiro
+    é invalidado. A evicção é LRU (`max_entries`) com expiração por `ttl_seconds`.
+    """
+
+    def __init__(self, db_path, threshold=0.95, max_entries=1000, ttl_seconds=7 * 24 * 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.corpus_version = None
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self._lock = threading.Lock()
+        self._ids = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY, corpus_version TEXT NOT NULL, question TEXT NOT NULL,"
+            " vector BLOB NOT NULL, answer TEXT NOT NULL, sources TEXT NOT NULL,"
+            " latency REAL NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def set_corpus_version(self, version):
+        """
+        Define a versão do corpus indexado; respostas de outras versões são apagadas.
+        """
+        with self._lock:
+            if version == self.corpus_version:
+                return
+            self.corpus_version = version
+            removed = self._conn.execute("DELETE FROM answers WHERE corpus_version != ?", (version,)).rowcount
+            self._conn.commit()
+            if removed:
+                sys.stderr.write(f"[CORE_LOGIC] Corpus alterado: {removed} resposta(s) removida(s) do cache.\n")
+            self._reload()
+
+    def _reload(self):
+        self._conn.execute("DELETE FROM answers WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT id, vector FROM answers WHERE corpus_version = ?", (self.corpus_version,)
+        ).fetchall()
+        self._ids = [row[0] for row in rows]
+        if rows:
+            self._matrix = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        else:
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, vector):
+        """
+        Devolve a resposta mais parecida acima do limiar (ou None).
+        """
+        query = self._normalize(vector)
+        with self._lock:
+            if self.corpus_version is None or not self._ids:
+                self.misses += 1
+                return None
+            scores = self._matrix @ query
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            row = self._conn.execute(
+                "SELECT answer, sources, latency, created_at FROM answers WHERE id = ?", (self._ids[best],)
+            ).fetchone()
+            if row is None or row[3] < time.time() - self.ttl_seconds:
+                self._reload()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), self._ids[best]))
+            self._conn.commit()
+            self.hits += 1
+            self.seconds_saved += row[2]
+            return {
+                "answer": row[0],
+                "sources": json.loads(row[1]),
+                "similarity": round(similarity, 4),
+                "original_latency": row[2],
+            }
+
+    def store(self, question, vector, answer, sources, latency):
+        with self._lock:
+            if self.corpus_version is None:
+                return
+            now = time.time()
+            vector = self._normalize(vector)
+            self._conn.execute(
+                "INSERT INTO answers (corpus_version, question, vector, answer, sources, latency, created_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.corpus_version, question, vector.tobytes(), answer, json.dumps(sources), latency, now, now),
+            )
+            excess = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)", (excess,)
+                )
+            self._conn.commit()
+            self._reload()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "seconds_saved": round(self.seconds_saved, 2),
+                "entries": len(self._ids),
+            }
+
+    def resident_bytes(self):
+        return self._matrix.nbytes
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
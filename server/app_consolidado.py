@@ -1,24 +1,73 @@
+import re
 import sys
 import traceback
 import os
 import json
-import tkinter as tk
-from tkinter import filedialog
 import shutil
 import time
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
+import metrics
 from core_logic import AgentManager, check_openai_api_key
 
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("IL_MAX_CONCURRENT_REQUESTS", "8"))
+
+# Formato das chaves da OpenAI ("sk-..." / "sk-proj-..."): nada de espaços, aspas ou quebras de linha no .env.
+_API_KEY_RE = re.compile(r"^sk-[A-Za-z0-9_-]{8,256}$")
+
 # --- Funções Auxiliares de Comunicação ---
 
+# Cada requisição roda numa thread do pool; o contexto guarda o ID enviado pelo
+# cliente, o sinal de cancelamento e, no servidor HTTP, a sessão e o destino das
+# respostas, para que send_response marque e entregue cada resposta.
+_contexto = threading.local()
+_stdout_lock = threading.Lock()
+_em_andamento = {}          # request_id -> (future, evento de cancelamento, ação)
+_em_andamento_lock = threading.Lock()
+# Uma indexação por vez: a pasta de documentos é a fonte da indexação em andamento.
+_indexacao_lock = threading.Lock()
+_indexacao_sessao = None    # sessão HTTP que iniciou a indexação em andamento (None no modo stdin/stdout)
+
 def log_message(message):
     sys.stderr.write(f"[PYTHON_LOG] {message}\n")
     sys.stderr.flush()
 
 def send_response(data):
+    request_id = getattr(_contexto, "request_id", None)
+    if request_id is not None and "request_id" not in data:
+        data = {**data, "request_id": request_id}
+    destino = getattr(_contexto, "destino", None)
+    if destino is not None:
+        return destino(data)
     response_json = json.dumps(data)
-    sys.stdout.write(response_json + '\n')
-    sys.stdout.flush()
+    with _stdout_lock:
+        sys.stdout.write(response_json + '\n')
+        sys.stdout.flush()
+
+def cancelamento_solicitado():
+    evento = getattr(_contexto, "cancelado", None)
+    return evento is not None and evento.is_set()
+
+def get_env_path():
+    config_dir = os.path.join(os.path.expanduser("~"), ".IntelligentLibrary")
+    return os.path.join(config_dir, ".env")
+
+def load_saved_api_key():
+    try:
+        with open(get_env_path(), "r") as f:
+            for line in f:
+                if line.startswith("OPENAI_API_KEY="):
+                    return line.split("=", 1)[1].strip().strip('"')
+    except OSError:
+        pass
+    return os.environ.get("OPENAI_API_KEY", "")
+
+def restaurar_indice():
+    # Roda em segundo plano na inicialização: reabre o índice salvo sem reindexar.
+    resultado = agent_manager.restore_agent(load_saved_api_key())
+    log_message(f"Restauracao do indice: {resultado['message']}")
 
 # --- Funções de Ação ---
 
@@ -28,23 +77,26 @@ def verificar_estado_inicial(payload):
     try:
         log_message("Verificando estado inicial...")
         global agent_manager
-        if agent_manager and agent_manager.is_initialized():
-            send_response({"status": "success", "action": "verificar_estado_inicial", "result": {"status": "READY"}})
+        if agent_manager:
+            biblioteca = (payload.get('data') or {}).get('biblioteca')
+            send_response({"status": "success", "action": "verificar_estado_inicial", "result": agent_manager.status(biblioteca)})
         else:
-            send_response({"status": "success", "action": "verificar_estado_inicial", "result": {"status": "NOT_READY"}})
+            send_response({"status": "success", "action": "verificar_estado_inicial", "result": {"status": "NOT_READY", "model_status": "NOT_LOADED"}})
     except Exception as e:
         send_response({"status": "error", "message": f"Erro em verificar_estado_inicial: {e}\n{traceback.format_exc()}"})
 
 # A CORREÇÃO ESTÁ AQUI: Ação única para salvar e validar
 def salvar_e_validar_chave(payload):
     try:
-        api_key = payload.get('data', '').strip()
+        api_key = payload.get('data', '')
+        api_key = api_key.strip() if isinstance(api_key, str) else ''
+        if not _API_KEY_RE.match(api_key):
+            return send_response({"status": "success", "action": "salvar_e_validar_chave", "result": {"success": False, "message": "Formato de chave da API invalido."}})
         log_message("Salvando e validando a chave da API...")
 
         # 1. Salva a chave no arquivo .env
-        config_dir = os.path.join(os.path.expanduser("~"), ".IntelligentLibrary")
-        os.makedirs(config_dir, exist_ok=True)
-        env_path = os.path.join(config_dir, ".env")
+        env_path = get_env_path()
+        os.makedirs(os.path.dirname(env_path), exist_ok=True)
         with open(env_path, "w") as f:
             f.write(f'OPENAI_API_KEY="{api_key}"\n')
         log_message("API key salva no arquivo .env.")
@@ -65,6 +117,8 @@ def salvar_e_validar_chave(payload):
 def select_pdf_files(payload):
     try:
         log_message("Abrindo dialogo de selecao de arquivos...")
+        import tkinter as tk
+        from tkinter import filedialog
         root = tk.Tk()
         root.withdraw()
         root.attributes("-topmost", True)
@@ -82,59 +136,182 @@ def select_pdf_files(payload):
         send_response({"status": "error", "message": f"Erro ao abrir dialogo: {e}"})
 
 def carregar_documentos(payload):
-    global agent_manager
+    global agent_manager, _indexacao_sessao
     try:
         data = payload.get('data', {})
         file_paths = data.get('filePaths', [])
         api_key = data.get('apiKey', '').strip()
+        # Sem "biblioteca", os documentos vão para a biblioteca "default" (pastas de sempre).
+        biblioteca = data.get('biblioteca')
+        substituir = data.get('substituir', True)
 
         if not file_paths:
             return send_response({"status": "success", "action": "carregar_documentos", "result": {"success": False, "message": "Nenhum caminho de arquivo foi fornecido."}})
 
-        log_message(f"Carregando {len(file_paths)} documentos...")
-        
-        docs_dir = os.path.join(os.path.dirname(__file__), "documents")
-        os.makedirs(docs_dir, exist_ok=True)
-        
+        if not _indexacao_lock.acquire(blocking=False):
+            return send_response({"status": "success", "action": "carregar_documentos", "result": {"success": False, "message": "Ja existe uma indexacao em andamento. Aguarde ou cancele antes de carregar novos documentos."}})
+        _indexacao_sessao = getattr(_contexto, "sessao", None)
+        try:
+            _carregar_documentos(file_paths, api_key, biblioteca, substituir)
+        finally:
+            _indexacao_sessao = None
+            _indexacao_lock.release()
+
+    except Exception as e:
+        error_message = f"Erro ao carregar documentos: {e}\n{traceback.format_exc()}"
+        log_message(error_message)
+        send_response({"status": "error", "message": error_message})
+
+def _carregar_documentos(file_paths, api_key, biblioteca=None, substituir=True):
+    global agent_manager
+    agent_manager = AgentManager()
+    try:
+        library = agent_manager.libraries.get(biblioteca)
+    except ValueError as e:
+        return send_response({"status": "success", "action": "carregar_documentos", "result": {"success": False, "message": str(e)}})
+    log_message(f"Carregando {len(file_paths)} documentos na biblioteca '{library.name}'...")
+
+    docs_dir = library.docs_path
+    os.makedirs(docs_dir, exist_ok=True)
+
+    # Substituir troca o conteúdo só desta biblioteca; sem substituir, os arquivos são acrescentados.
+    if substituir:
         for item in os.listdir(docs_dir):
             item_path = os.path.join(docs_dir, item)
             if os.path.isfile(item_path):
                 os.unlink(item_path)
 
-        copied_count = 0
-        for src_path in file_paths:
-            if os.path.exists(src_path):
-                filename = os.path.basename(src_path)
-                dest_path = os.path.join(docs_dir, filename)
-                shutil.copy2(src_path, dest_path)
-                copied_count += 1
-        
-        log_message(f"Copiados {copied_count} arquivos PDF.")
-        time.sleep(1)
+    copied_count = 0
+    for src_path in file_paths:
+        # Só PDFs entram na pasta da biblioteca; outros caminhos são ignorados.
+        if src_path.lower().endswith(".pdf") and os.path.isfile(src_path):
+            filename = os.path.basename(src_path)
+            dest_path = os.path.join(docs_dir, filename)
+            shutil.copy2(src_path, dest_path)
+            copied_count += 1
+    
+    log_message(f"Copiados {copied_count} arquivos PDF.")
+    time.sleep(1)
 
-        agent_manager = AgentManager()
-        success, message = agent_manager.initialize_agent(api_key)
+    def on_progress(progress):
+        # Eventos intermediários em ação própria: a resposta final de carregar_documentos continua única.
+        progress["queryable"] = agent_manager.is_initialized()
+        progress["biblioteca"] = library.name
+        send_response({"status": "success", "action": "progresso_indexacao", "progress": progress})
 
-        if success:
-            log_message("Documentos processados e agente inicializado com sucesso!")
-        else:
-            log_message(f"Falha ao inicializar o agente: {message}")
+    result = agent_manager.initialize_agent(api_key, should_cancel=cancelamento_solicitado, on_progress=on_progress, library=library.name)
+    success, message = result["success"], result["message"]
+    report = result.get("report", [])
 
-        send_response({"status": "success", "action": "carregar_documentos", "result": {"success": success, "message": message}})
+    if success:
+        log_message("Documentos processados e agente inicializado com sucesso!")
+    else:
+        log_message(f"Falha ao inicializar o agente: {message}")
 
-    except Exception as e:
-        error_message = f"Erro ao carregar documentos: {e}\n{traceback.format_exc()}"
-        log_message(error_message)
-        send_response({"status": "error", "message": error_message})
+    send_response({"status": "success", "action": "carregar_documentos", "result": {"success": success, "message": message, "report": report, "cancelled": result.get("cancelled", False), "biblioteca": library.name}})
 
 def processar_pergunta(payload):
     if agent_manager and agent_manager.is_initialized():
-        pergunta = payload.get('data', {}).get('pergunta')
-        resposta = agent_manager.ask_question(pergunta)
+        data = payload.get('data', {})
+        pergunta = data.get('pergunta')
+        on_token = None
+        if data.get('stream'):
+            # Modo streaming: cada pedaço da resposta sai numa linha própria; a última
+            # mensagem (com "result") é a mesma do modo normal e traz as fontes.
+            def on_token(token):
+                send_response({"status": "success", "action": "processar_pergunta", "delta": token})
+        resposta = agent_manager.ask_question(
+            pergunta, should_cancel=cancelamento_solicitado, on_token=on_token,
+            mode=data.get('mode'), library=data.get('biblioteca'), session=getattr(_contexto, "sessao", None),
+        )
         send_response({"status": "success", "action": "processar_pergunta", "result": resposta})
     else:
         send_response({"status": "success", "action": "processar_pergunta", "result": {"error": "O agente não está pronto. Por favor, carregue os documentos primeiro."}})
 
+def processar_perguntas_lote(payload):
+    # Perguntas independentes (auditorias, avaliações): um embedding em lote, busca em lote
+    # e chamadas ao LLM em paralelo, sem passar pela memória da conversa.
+    if not (agent_manager and agent_manager.is_initialized()):
+        return send_response({"status": "success", "action": "processar_perguntas_lote", "result": {"error": "O agente não está pronto. Por favor, carregue os documentos primeiro."}})
+    data = payload.get('data', {})
+    perguntas = data.get('perguntas')
+    if not isinstance(perguntas, list) or not perguntas or not all(isinstance(p, str) and p.strip() for p in perguntas):
+        return send_response({"status": "success", "action": "processar_perguntas_lote", "result": {"error": "Envie 'perguntas' como uma lista de textos nao vazios."}})
+    on_result = None
+    if data.get('stream'):
+        # Cada resposta sai numa linha própria ("item", com "index") assim que fica pronta,
+        # fora da ordem; a mensagem final traz só os totais do lote.
+        def on_result(item):
+            send_response({"status": "success", "action": "processar_perguntas_lote", "item": item})
+    try:
+        concorrencia = int(data.get('concorrencia') or 0) or None
+    except (TypeError, ValueError):
+        concorrencia = None
+    resultado = agent_manager.ask_batch(
+        perguntas, should_cancel=cancelamento_solicitado, on_result=on_result,
+        library=data.get('biblioteca'), concurrency=concorrencia,
+    )
+    if on_result is not None:
+        resultado.pop("results", None)
+    send_response({"status": "success", "action": "processar_perguntas_lote", "result": resultado})
+
+def buscar_trechos(payload):
+    # Só a recuperação (sem LLM): usada pelos benchmarks e para inspecionar o contexto de uma pergunta.
+    data = payload.get('data', {})
+    if agent_manager:
+        try:
+            result = agent_manager.search_documents(data.get('consulta', ''), library=data.get('biblioteca'))
+        except ValueError as e:
+            result = {"error": str(e)}
+        send_response({"status": "success", "action": "buscar_trechos", "result": result})
+    else:
+        send_response({"status": "success", "action": "buscar_trechos", "result": {"error": "Nenhum indice carregado."}})
+
+def metricas(payload):
+    # Fotografia das latências por etapa (histogramas), contadores e caches; "reset" zera depois de ler.
+    reset = bool(payload.get('data', {}).get('reset', False))
+    if agent_manager:
+        result = agent_manager.metrics_snapshot(reset=reset)
+    else:
+        result = metrics.snapshot(reset=reset)
+    send_response({"status": "success", "action": "metricas", "result": result})
+
+def listar_bibliotecas(payload):
+    # Bibliotecas em disco e em memória, com estado do índice e memória ocupada pelas abertas.
+    if agent_manager:
+        send_response({"status": "success", "action": "listar_bibliotecas", "result": agent_manager.list_libraries()})
+    else:
+        send_response({"status": "success", "action": "listar_bibliotecas", "result": {"libraries": []}})
+
+def cancelar_requisicao(payload):
+    alvo = payload.get('data', {}).get('request_id')
+    with _em_andamento_lock:
+        em_andamento = _em_andamento.get(alvo)
+    if em_andamento is None:
+        return send_response({"status": "success", "action": "cancelar_requisicao", "result": {"success": False, "message": f"Requisicao {alvo} nao encontrada ou ja concluida."}})
+    future, evento, action = em_andamento
+    evento.set()
+    # Se ainda estava na fila, nem chega a rodar; se já está rodando, para no próximo ponto de verificação.
+    if future.cancel():
+        with _em_andamento_lock:
+            _em_andamento.pop(alvo, None)
+        send_response({"status": "cancelled", "action": action, "request_id": alvo})
+    log_message(f"Cancelamento solicitado para a requisicao {alvo}.")
+    send_response({"status": "success", "action": "cancelar_requisicao", "result": {"success": True, "message": f"Cancelamento da requisicao {alvo} solicitado."}})
+
+def cancelar_indexacao(payload):
+    # Não depende do request_id de carregar_documentos: cancela a indexação que estiver rodando.
+    # No servidor HTTP, só a sessão que iniciou a indexação pode cancelá-la.
+    sessao = getattr(_contexto, "sessao", None)
+    if sessao is not None and _indexacao_sessao != sessao:
+        mensagem = "Nenhuma indexacao em andamento." if _indexacao_sessao is None else "A indexacao em andamento foi iniciada por outra sessao."
+        return send_response({"status": "success", "action": "cancelar_indexacao", "result": {"success": False, "message": mensagem}})
+    if agent_manager and agent_manager.cancel_ingestion():
+        log_message("Cancelamento da indexacao solicitado.")
+        send_response({"status": "success", "action": "cancelar_indexacao", "result": {"success": True, "message": "Cancelamento da indexacao solicitado."}})
+    else:
+        send_response({"status": "success", "action": "cancelar_indexacao", "result": {"success": False, "message": "Nenhuma indexacao em andamento."}})
+
 # --- Mapeamento de Ações e Loop Principal ---
 
 ACTION_MAP = {
@@ -143,22 +320,88 @@ ACTION_MAP = {
     "select_pdf_files": select_pdf_files,
     "carregar_documentos": carregar_documentos,
     "processar_pergunta": processar_pergunta,
+    "processar_perguntas_lote": processar_perguntas_lote,
+    "buscar_trechos": buscar_trechos,
+    "metricas": metricas,
+    "listar_bibliotecas": listar_bibliotecas,
+    "cancelar_requisicao": cancelar_requisicao,
+    "cancelar_indexacao": cancelar_indexacao,
 }
 
+# Ações rápidas que respondem direto no loop de leitura, sem esperar vaga no pool.
+INLINE_ACTIONS = {"verificar_estado_inicial", "cancelar_requisicao", "cancelar_indexacao", "metricas", "listar_bibliotecas"}
+
+def executar_acao(action, request, request_id, evento, destino=None, sessao=None):
+    _contexto.request_id = request_id
+    _contexto.cancelado = evento
+    _contexto.destino = destino
+    _contexto.sessao = sessao
+    metrics.set_trace_id(request_id)
+    try:
+        with metrics.span(f"acao.{action}"):
+            ACTION_MAP[action](request)
+    except Exception as e:
+        send_response({"status": "error", "action": action, "message": f"Erro inesperado em {action}: {e}\n{traceback.format_exc()}"})
+    finally:
+        _contexto.request_id = None
+        _contexto.cancelado = None
+        _contexto.destino = None
+        _contexto.sessao = None
+        metrics.set_trace_id(None)
+        if request_id is not None:
+            with _em_andamento_lock:
+                _em_andamento.pop(request_id, None)
+
+def despachar(executor, request, destino=None, sessao=None):
+    """
+    Executa a ação na hora (INLINE_ACTIONS) ou a coloca no pool. Devolve o future
+    da ação enfileirada, ou None se ela já foi respondida.
+    """
+    action = request.get("action")
+    request_id = request.get("request_id", request.get("requestId"))
+    if action not in ACTION_MAP:
+        return _responder(destino, {"status": "error", "message": f"Acao desconhecida: {action}", "request_id": request_id})
+    if action in INLINE_ACTIONS:
+        return executar_acao(action, request, request_id, None, destino, sessao)
+
+    evento = threading.Event()
+    with _em_andamento_lock:
+        if request_id is not None and request_id in _em_andamento:
+            return _responder(destino, {"status": "error", "action": action, "message": f"request_id duplicado: {request_id}", "request_id": request_id})
+        future = executor.submit(executar_acao, action, request, request_id, evento, destino, sessao)
+        if request_id is not None:
+            _em_andamento[request_id] = (future, evento, action)
+    return future
+
+def _responder(destino, data):
+    if destino is not None:
+        destino(data)
+    else:
+        send_response(data)
+
+def iniciar_backend():
+    global agent_manager
+    # Criar o AgentManager é barato; o modelo de embeddings aquece em segundo plano.
+    agent_manager = AgentManager()
+    agent_manager.start_warm_up()
+    threading.Thread(target=restaurar_indice, name="restaurar-indice", daemon=True).start()
+    return agent_manager
+
 def main():
-    for line in sys.stdin:
-        try:
-            request = json.loads(line)
-            action = request.get("action")
-            
-            if action in ACTION_MAP:
-                ACTION_MAP[action](request)
-            else:
-                send_response({"status": "error", "message": f"Acao desconhecida: {action}"})
-        except json.JSONDecodeError:
-            send_response({"status": "error", "message": f"Erro ao decodificar JSON: {line.strip()}"})
-        except Exception as e:
-            send_response({"status": "error", "message": f"Erro inesperado no loop principal: {e}\n{traceback.format_exc()}"})
+    iniciar_backend()
+
+    # As ações rodam em paralelo; cada resposta sai com o request_id da requisição
+    # (quando o cliente envia um), podendo chegar fora da ordem de envio.
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS, thread_name_prefix="acao") as executor:
+        for line in sys.stdin:
+            try:
+                despachar(executor, json.loads(line))
+            except json.JSONDecodeError:
+                send_response({"status": "error", "message": f"Erro ao decodificar JSON: {line.strip()}"})
+            except Exception as e:
+                send_response({"status": "error", "message": f"Erro inesperado no loop principal: {e}\n{traceback.format_exc()}"})
 
 if __name__ == '__main__':
+    # Necessário para o pool de processos de extração no executável do PyInstaller (Windows).
+    multiprocessing.freeze_support()
     main()
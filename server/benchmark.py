@@ -0,0 +1,364 @@
+"""
+Benchmark offline do backend: gera corpora sintéticos em PDF, sobe o backend real
+(app_consolidado.py) com o LLM simulado (IL_FAKE_LLM=1) e fala com ele pelo mesmo
+protocolo JSON-lines de stdin/stdout usado pelo Electron.
+
+Mede, para cada tamanho de corpus:
+- inicialização a frio (primeira resposta e modelo de embeddings pronto) e a
+  restauração do índice salvo num segundo processo;
+- indexação: páginas/s, trechos/s e pico de memória (RSS);
+- recuperação (buscar_trechos): latência p50/p95/p99 medida no backend;
+- ponta a ponta (processar_pergunta): latência p50/p95/p99 medida no cliente.
+
+Uso:
+    python benchmark.py --sizes 20,100,500 --queries 50 --output resultados.json
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import textwrap
+import threading
+import subprocess
+
+import metrics
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_WORDS = (
+    "biblioteca relatorio documento analise processo contrato cliente sistema servidor rede "
+    "seguranca acesso usuario registro auditoria incidente risco controle politica norma "
+    "procedimento equipe projeto prazo entrega custo orcamento fornecedor qualidade indicador "
+    "resultado meta revisao aprovacao responsavel departamento diretoria conselho reuniao ata "
+    "decisao recomendacao evidencia falha correcao melhoria monitoramento alerta evento periodo "
+    "mensal anual trimestre regiao unidade filial operacao manutencao equipamento inventario"
+).split()
+
+
+# --- Corpus sintético ---
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages):
+    """
+    PDF mínimo (texto Helvetica, só ASCII) com uma lista de linhas por página,
+    sem dependências além da biblioteca padrão.
+    """
+    objects = []  # conteúdo de cada objeto, numerados a partir de 1
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages_obj = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    kids = []
+    for lines in pages:
+        ops = ["BT", "/F1 10 Tf", "12 TL", "50 790 Td"]
+        ops.extend(f"({_pdf_escape(line)}) Tj T*" for line in lines)
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (pages_obj, font, content)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj
+    objects[pages_obj - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids)
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def synthetic_sentence(rng):
+    """Frase aleatória do vocabulário do corpus sintético (também usada por chunking.py)."""
+    words = rng.sample(_WORDS, rng.randint(8, 14))
+    return " ".join(words).capitalize() + "."
+
+
+def generate_corpus(target_dir, total_pages, pages_per_file=20, lines_per_page=45, seed=42):
+    """
+    Gera `total_pages` páginas em PDFs de `pages_per_file` páginas. Cada página começa
+    com um identificador único ("Relatorio Sentinela N"), um artigo e uma data, para
+    exercitar buscas exatas. Devolve a lista de páginas (texto) para montar consultas.
+    """
+    rng = random.Random(seed)
+    os.makedirs(target_dir, exist_ok=True)
+    corpus = []
+    for file_index in range(0, total_pages, pages_per_file):
+        pages = []
+        for page_index in range(file_index, min(total_pages, file_index + pages_per_file)):
+            header = (
+                f"Relatorio Sentinela {1000 + page_index} - artigo {rng.randint(1, 300)} - "
+                f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2015, 2025)}"
+            )
+            text = " ".join(synthetic_sentence(rng) for _ in range(lines_per_page))
+            lines = [header] + textwrap.wrap(text, 95)[:lines_per_page - 1]
+            pages.append(lines)
+            corpus.append({"page": page_index, "header": header, "text": " ".join(lines[1:])})
+        write_pdf(os.path.join(target_dir, f"relatorio_{file_index // pages_per_file:04d}.pdf"), pages)
+    return corpus
+
+
+def build_queries(corpus, count, seed=7):
+    """
+    Metade busca exata (número do relatório), metade semântica (trecho reescrito de uma página).
+    """
+    rng = random.Random(seed)
+    queries = []
+    for i in range(count):
+        page = rng.choice(corpus)
+        if i % 2 == 0:
+            queries.append({"kind": "exact", "text": f"O que diz o {page['header'].split(' - ')[0]}?"})
+        else:
+            words = page["text"].split()
+            start = rng.randrange(max(1, len(words) - 12))
+            fragment = words[start:start + 12]
+            rng.shuffle(fragment)
+            queries.append({"kind": "semantic", "text": " ".join(fragment)})
+    return queries
+
+
+# --- Cliente do protocolo JSON-lines ---
+
+class BackendProcess:
+    """
+    Sobe app_consolidado.py como o Electron faz e troca mensagens com request_id.
+    """
+
+    def __init__(self, env, log_path):
+        self.started_at = time.perf_counter()
+        self._log = open(log_path, "ab")
+        self.process = subprocess.Popen(
+            [sys.executable, "-u", os.path.join(SERVER_DIR, "app_consolidado.py")],
+            cwd=SERVER_DIR, env=env,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self._log,
+            text=True, encoding="utf-8", bufsize=1,
+        )
+        self._responses = {}
+        self._cond = threading.Condition()
+        self._next_id = 0
+        self.events = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # Eventos intermediários (streaming, progresso) não encerram a requisição.
+            if "delta" in message or message.get("action") == "progresso_indexacao":
+                self.events.put(message)
+                continue
+            with self._cond:
+                self._responses[message.get("request_id")] = message
+                self._cond.notify_all()
+        with self._cond:
+            self._cond.notify_all()
+
+    def request(self, action, data=None, timeout=3600):
+        with self._cond:
+            self._next_id += 1
+            request_id = f"bench-{self._next_id}"
+        payload = {"action": action, "request_id": request_id}
+        if data is not None:
+            payload["data"] = data
+        start = time.perf_counter()
+        self.process.stdin.write(json.dumps(payload) + "\n")
+        self.process.stdin.flush()
+        deadline = start + timeout
+        with self._cond:
+            while request_id not in self._responses:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or self.process.poll() is not None:
+                    raise RuntimeError(f"Sem resposta para {action} (codigo de saida: {self.process.poll()}).")
+                self._cond.wait(min(remaining, 1.0))
+            response = self._responses.pop(request_id)
+        return response, time.perf_counter() - start
+
+    def wait_status(self, predicate, timeout=600, interval=0.1):
+        """
+        Consulta verificar_estado_inicial até `predicate(result)`; devolve o tempo desde o início do processo.
+        """
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            response, _ = self.request("verificar_estado_inicial", timeout=timeout)
+            if predicate(response["result"]):
+                return time.perf_counter() - self.started_at, response["result"]
+            time.sleep(interval)
+        raise RuntimeError("Tempo esgotado esperando o estado do backend.")
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=60)
+        except Exception:
+            self.process.kill()
+        self._log.close()
+
+
+# --- Medições ---
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(metrics.percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(metrics.percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(metrics.percentile(ordered, 99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def measure_startup(backend):
+    backend.request("verificar_estado_inicial")
+    first_response = time.perf_counter() - backend.started_at
+    model_ready, _ = backend.wait_status(lambda r: r.get("model_status") in ("READY", "ERROR"))
+    return {"first_response_s": round(first_response, 3), "model_ready_s": round(model_ready, 3)}
+
+
+def run_size(total_pages, args, work_dir):
+    corpus_dir = os.path.join(work_dir, f"corpus_{total_pages}")
+    data_dir = os.path.join(work_dir, f"dados_{total_pages}")
+    corpus = generate_corpus(corpus_dir, total_pages, args.pages_per_file)
+    queries = build_queries(corpus, args.queries)
+    files = sorted(os.path.join(corpus_dir, name) for name in os.listdir(corpus_dir))
+
+    # HOME isolado e chave fictícia: a restauração não depende do ~/.IntelligentLibrary/.env do usuário.
+    home_dir = os.path.join(work_dir, f"home_{total_pages}")
+    os.makedirs(home_dir, exist_ok=True)
+    env = dict(os.environ, IL_FAKE_LLM="1", IL_DATA_DIR=data_dir, IL_FAKE_LLM_LATENCY_MS=str(args.llm_latency_ms),
+               OPENAI_API_KEY="sk-benchmark", HOME=home_dir, USERPROFILE=home_dir)
+    if not args.answer_cache:
+        env["IL_ANSWER_CACHE"] = "0"
+    log_path = os.path.join(work_dir, f"backend_{total_pages}.log")
+    result = {"pages": total_pages, "files": len(files)}
+
+    backend = BackendProcess(env, log_path)
+    try:
+        result["startup_cold"] = measure_startup(backend)
+
+        events_before = backend.events.qsize()
+        response, seconds = backend.request("carregar_documentos", {"filePaths": files, "apiKey": "sk-benchmark"})
+        load = response["result"]
+        if not load.get("success"):
+            raise RuntimeError(f"Falha na indexacao: {load.get('message')}")
+        pages = sum(item.get("pages", 0) for item in load["report"])
+        chunks = sum(item.get("chunks", 0) for item in load["report"])
+        status, _ = backend.request("verificar_estado_inicial")
+        result["ingest"] = {
+            "seconds": round(seconds, 2),
+            "pages": pages,
+            "chunks": chunks,
+            "pages_per_second": round(pages / seconds, 1),
+            "chunks_per_second": round(chunks / seconds, 1),
+            "progress_events": backend.events.qsize() - events_before,
+            "peak_rss_mb": status["result"].get("peak_rss_mb"),
+            "embedding": status["result"].get("ingestion"),
+        }
+        # Latência por etapa (leitura, divisão, embedding, upsert); zera para separar das consultas.
+        response, _ = backend.request("metricas", {"reset": True})
+        result["ingest"]["stages"] = response["result"]["histograms"]
+
+        retrieval, methods = [], {}
+        for query in queries:
+            response, _ = backend.request("buscar_trechos", {"consulta": query["text"]})
+            found = response["result"]
+            retrieval.append(found["seconds"])
+            methods[found["method"]] = methods.get(found["method"], 0) + 1
+        result["retrieval"] = {**percentiles(retrieval), "methods": methods}
+
+        end_to_end, errors = [], 0
+        for query in queries:
+            data = {"pergunta": query["text"], "stream": args.stream}
+            if args.mode:
+                data["mode"] = args.mode
+            response, seconds = backend.request("processar_pergunta", data)
+            if response["result"].get("error"):
+                errors += 1
+            end_to_end.append(seconds)
+        result["end_to_end"] = {**percentiles(end_to_end), "errors": errors, "mode": args.mode or "padrao"}
+        response, _ = backend.request("metricas")
+        result["query_stages"] = response["result"]["histograms"]
+        result["query_counters"] = response["result"]["counters"]
+    finally:
+        backend.close()
+
+    # Segundo processo com o mesmo diretório de dados: mede a restauração do índice salvo.
+    backend = BackendProcess(env, log_path)
+    try:
+        restart = measure_startup(backend)
+        ready, _ = backend.wait_status(lambda r: r.get("status") == "READY" or r.get("index_status") in ("STALE", "ERROR"))
+        restart["index_ready_s"] = round(ready, 3)
+        result["startup_restore"] = restart
+    finally:
+        backend.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline de indexacao e consulta (LLM simulado).")
+    parser.add_argument("--sizes", default="20,100", help="Tamanhos de corpus em paginas, separados por virgula.")
+    parser.add_argument("--pages-per-file", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=40)
+    parser.add_argument("--mode", choices=("agent", "direct"), default=None, help="Modo de resposta (padrao: IL_ANSWER_MODE).")
+    parser.add_argument("--stream", action="store_true", help="Pede respostas em streaming.")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Latencia simulada por chamada ao LLM.")
+    parser.add_argument("--answer-cache", action="store_true", help="Mantem o cache de respostas ligado.")
+    parser.add_argument("--work-dir", default=None, help="Pasta de trabalho (padrao: temporaria, apagada no fim).")
+    parser.add_argument("--output", default=None, help="Arquivo JSON de saida (padrao: stdout).")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="il_benchmark_")
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {key: value for key, value in sorted(os.environ.items()) if key.startswith("IL_")},
+        "options": vars(args),
+        "runs": [],
+    }
+    try:
+        for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+            sys.stderr.write(f"[BENCHMARK] Corpus de {size} pagina(s)...\n")
+            report["runs"].append(run_size(size, args, work_dir))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
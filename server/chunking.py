@@ -0,0 +1,294 @@
+import os
+import re
+import sys
+import zlib
+import time
+import random
+import argparse
+import textwrap
+
+# Janela do paraphrase-multilingual-MiniLM-L12-v2: 128 tokens, contando <s> e </s>.
+# Texto além disso é truncado em silêncio pelo modelo.
+MODEL_MAX_TOKENS = 128
+DEFAULT_MAX_TOKENS = 120   # folga para os tokens especiais e para a junção das frases
+DEFAULT_MIN_TOKENS = 48
+ANCHOR_EVERY = 2           # em média um fim de frase em cada ANCHOR_EVERY é âncora de corte
+
+# Splitter antigo (modo "chars").
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# Fim de frase (pontuação seguida de espaço) ou parágrafo (linha em branco).
+_BOUNDARY_RE = re.compile(r"(?<=[.!?;…])\s+|\n\s*\n")
+_APPROX_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+class ApproxTokenCounter:
+    """
+    Contagem aproximada (palavras longas valem mais de um token), usada só quando
+    o tokenizador do modelo não está disponível.
+    """
+
+    name = "approx"
+
+    @staticmethod
+    def _pieces(text, offset=0):
+        for match in _APPROX_TOKEN_RE.finditer(text):
+            word = match.group()
+            yield match.start() + offset, match.end() + offset, 1 + (len(word) - 1) // 6
+
+    def counts(self, texts):
+        return [sum(n for _, _, n in self._pieces(text)) for text in texts]
+
+    def offsets(self, text):
+        result = []
+        for start, end, n in self._pieces(text):
+            result.extend([(start, end)] * n)
+        return result
+
+
+class ModelTokenCounter:
+    """
+    Tokenizador rápido (Rust) do próprio modelo de embeddings: os tamanhos batem
+    com o que o modelo realmente vê.
+    """
+
+    name = "model"
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def counts(self, texts):
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+    def offsets(self, text):
+        return self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+
+
+def load_token_counter(model_name, cache_folder=None):
+    """
+    Carrega só o tokenizador do modelo (sem os pesos), da mesma pasta de cache do
+    SentenceTransformer. Sem ele, volta à contagem aproximada.
+    """
+    try:
+        from transformers import AutoTokenizer
+
+        repo = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        # sentence-transformers < 2.3 guardava o modelo numa pasta própria dentro do cache.
+        legacy = os.path.join(cache_folder, repo.replace("/", "_")) if cache_folder else None
+        if legacy and os.path.isdir(legacy):
+            tokenizer = AutoTokenizer.from_pretrained(legacy)
+        else:
+            try:
+                # O SentenceTransformer já baixou o modelo: evita ir à rede em cada processo de extração.
+                tokenizer = AutoTokenizer.from_pretrained(repo, cache_dir=cache_folder, local_files_only=True)
+            except OSError:
+                tokenizer = AutoTokenizer.from_pretrained(repo, cache_dir=cache_folder)
+        return ModelTokenCounter(tokenizer)
+    except Exception as e:
+        sys.stderr.write(f"[CORE_LOGIC] Tokenizador de {model_name} indisponivel ({e}); usando contagem aproximada.\n")
+        return ApproxTokenCounter()
+
+
+def _is_anchor(sentence, anchor_every):
+    # Hash do texto normalizado: quebras de linha diferentes não mudam a âncora.
+    return zlib.crc32(" ".join(sentence.split()).encode("utf-8")) % anchor_every == 0
+
+
+class TokenChunker:
+    """
+    Divide o texto em trechos de no máximo `max_tokens` tokens do modelo, sem sobreposição.
+    Os cortes caem em fins de frase escolhidos pelo conteúdo (hash da frase): uma edição
+    só muda os trechos até a próxima âncora, e o resto da página gera os mesmos trechos,
+    que o cache de embeddings reaproveita. Frases maiores que a janela são quebradas por tokens.
+    """
+
+    def __init__(self, counter, max_tokens=DEFAULT_MAX_TOKENS, min_tokens=DEFAULT_MIN_TOKENS, anchor_every=ANCHOR_EVERY):
+        self.counter = counter
+        self.max_tokens = max_tokens
+        self.min_tokens = min(min_tokens, max_tokens)
+        self.anchor_every = max(1, anchor_every)
+
+    @property
+    def signature(self):
+        return f"tokens:{self.counter.name}:{self.max_tokens}:{self.min_tokens}:{self.anchor_every}"
+
+    def _sentences(self, text):
+        start = 0
+        for match in _BOUNDARY_RE.finditer(text):
+            if match.start() > start:
+                yield start, match.start()
+            start = match.end()
+        end = len(text.rstrip())
+        if end > start:
+            yield start, end
+
+    def _units(self, text):
+        """
+        Frases como (início, fim, tokens, é_âncora); as maiores que a janela viram janelas de tokens.
+        """
+        spans = [(s, e) for s, e in self._sentences(text) if text[s:e].strip()]
+        counts = self.counter.counts([text[s:e] for s, e in spans])
+        for (start, end), tokens in zip(spans, counts):
+            if tokens <= self.max_tokens:
+                yield start, end, tokens, _is_anchor(text[start:end], self.anchor_every)
+                continue
+            offsets = self.counter.offsets(text[start:end])
+            for i in range(0, len(offsets), self.max_tokens):
+                window = offsets[i:i + self.max_tokens]
+                # Cortes em posições fixas a partir do início da frase: estáveis como as âncoras.
+                yield start + window[0][0], start + window[-1][1], len(window), True
+
+    def split_spans(self, text):
+        """
+        Devolve [(início, fim, tokens)] dos trechos de `text`.
+        """
+        chunks = []
+        current_start = current_end = None
+        current_tokens = 0
+        for start, end, tokens, anchor in self._units(text):
+            if current_start is not None and current_tokens + tokens > self.max_tokens:
+                chunks.append((current_start, current_end, current_tokens))
+                current_start, current_tokens = None, 0
+            if current_start is None:
+                current_start = start
+            current_end = end
+            current_tokens += tokens
+            if anchor and current_tokens >= self.min_tokens:
+                chunks.append((current_start, current_end, current_tokens))
+                current_start, current_tokens = None, 0
+        if current_start is not None:
+            chunks.append((current_start, current_end, current_tokens))
+        return chunks
+
+    def split_text(self, text):
+        return [text[start:end] for start, end, _ in self.split_spans(text)]
+
+    def split_documents(self, documents):
+        # Mesmo formato do RecursiveCharacterTextSplitter com add_start_index=True.
+        from langchain_core.documents import Document
+
+        chunks = []
+        for document in documents:
+            text = document.page_content
+            for start, end, _ in self.split_spans(text):
+                chunks.append(Document(page_content=text[start:end], metadata={**document.metadata, "start_index": start}))
+        return chunks
+
+
+def _character_splitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    try:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+    except ImportError:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    # start_index (posição na página) permite juntar trechos vizinhos na hora da consulta.
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    splitter.signature = f"chars:{chunk_size}:{chunk_overlap}"
+    return splitter
+
+
+_chunkers = {}
+
+
+def get_chunker(mode="tokens", model_name=None, cache_folder=None, max_tokens=DEFAULT_MAX_TOKENS, min_tokens=DEFAULT_MIN_TOKENS):
+    """
+    Splitter do processo atual (criado uma vez por processo do pool de extração).
+    mode="tokens": TokenChunker com o tokenizador de `model_name`; mode="chars": o splitter antigo.
+    """
+    key = (mode, model_name, cache_folder, max_tokens, min_tokens)
+    chunker = _chunkers.get(key)
+    if chunker is None:
+        if mode == "chars":
+            chunker = _character_splitter()
+        elif mode == "tokens":
+            counter = load_token_counter(model_name, cache_folder) if model_name else ApproxTokenCounter()
+            chunker = TokenChunker(counter, max_tokens=max_tokens, min_tokens=min_tokens)
+        else:
+            raise ValueError(f"Modo de divisao desconhecido: {mode}. Use 'tokens' ou 'chars'.")
+        _chunkers[key] = chunker
+    return chunker
+
+
+# --- Benchmark: splitter antigo x TokenChunker ---
+
+def _edit_page(text, rng):
+    # Simula uma nova versão do PDF: uma frase inserida no primeiro terço da página.
+    sentences = list(_BOUNDARY_RE.finditer(text))
+    if not sentences:
+        return "Trecho inserido na revisao. " + text
+    cut = sentences[rng.randrange(max(1, len(sentences) // 3))].end()
+    return text[:cut] + "Paragrafo inserido na revisao do documento com novas informacoes. " + text[cut:]
+
+
+def _measure(split_text, pages, edited_pages, counter):
+    start = time.perf_counter()
+    chunks = [chunk for page in pages for chunk in split_text(page)]
+    seconds = time.perf_counter() - start
+    tokens = counter.counts(chunks)
+    window = MODEL_MAX_TOKENS - 2
+    original = set(chunks)
+    edited = [chunk for page in edited_pages for chunk in split_text(page)]
+    reused = sum(1 for chunk in edited if chunk in original)
+    total_chars = sum(len(page) for page in pages)
+    return {
+        "pages_per_second": round(len(pages) / seconds, 1) if seconds else None,
+        "mb_per_second": round(total_chars / 2 ** 20 / seconds, 2) if seconds else None,
+        "chunks": len(chunks),
+        "tokens_avg": round(sum(tokens) / len(tokens), 1) if tokens else 0,
+        "tokens_max": max(tokens, default=0),
+        "truncated_chunks_pct": round(100 * sum(1 for n in tokens if n > window) / len(tokens), 1) if tokens else 0,
+        "truncated_tokens_pct": round(100 * sum(max(0, n - window) for n in tokens) / max(1, sum(tokens)), 1),
+        "window_fill_pct": round(100 * sum(min(n, window) for n in tokens) / (window * len(tokens)), 1) if tokens else 0,
+        # Trechos da versão editada idênticos a algum da versão original (acertos no cache de embeddings).
+        "unchanged_after_edit_pct": round(100 * reused / len(edited), 1) if edited else 0,
+    }
+
+
+def _load_pages(folder):
+    from pypdf import PdfReader
+
+    pages = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(".pdf"):
+            pages.extend(page.extract_text() or "" for page in PdfReader(os.path.join(folder, name)).pages)
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara o splitter por caracteres com o TokenChunker.")
+    parser.add_argument("pdf_dir", nargs="?", help="Pasta com PDFs (padrão: corpus sintético do benchmark)")
+    parser.add_argument("--pages", type=int, default=500, help="Páginas do corpus sintético")
+    parser.add_argument("--model", default="paraphrase-multilingual-MiniLM-L12-v2")
+    parser.add_argument("--cache-folder", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache"))
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument("--min-tokens", type=int, default=DEFAULT_MIN_TOKENS)
+    args = parser.parse_args()
+
+    if args.pdf_dir:
+        pages = _load_pages(args.pdf_dir)
+    else:
+        from benchmark import synthetic_sentence
+
+        # Páginas no formato do pypdf: linhas de ~95 caracteres separadas por "\n".
+        rng = random.Random(42)
+        pages = ["\n".join(textwrap.wrap(" ".join(synthetic_sentence(rng) for _ in range(45)), 95)) for _ in range(args.pages)]
+    rng = random.Random(7)
+    edited_pages = [_edit_page(page, rng) for page in pages]
+
+    counter = load_token_counter(args.model, args.cache_folder)
+    token_chunker = TokenChunker(counter, max_tokens=args.max_tokens, min_tokens=args.min_tokens)
+    report = {"pages": len(pages), "token_counter": counter.name, "tokens": _measure(token_chunker.split_text, pages, edited_pages, counter)}
+    try:
+        report["chars"] = _measure(_character_splitter().split_text, pages, edited_pages, counter)
+    except ImportError as e:
+        report["chars"] = {"error": f"splitter por caracteres indisponivel: {e}"}
+
+    import json
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import re
+
+from langchain_core.documents import Document
+
+# Tamanho máximo de sobreposição procurado quando o trecho não tem `start_index`
+# (índices antigos); o splitter usa chunk_overlap=200.
+MAX_TEXT_OVERLAP = 400
+# Trechos separados por até esse número de caracteres na página contam como vizinhos.
+ADJACENT_GAP = 5
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def approx_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _text_overlap(left, right):
+    """
+    Maior sufixo de `left` que é prefixo de `right`.
+    """
+    limit = min(len(left), len(right), MAX_TEXT_OVERLAP)
+    for size in range(limit, 20, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _merge_pair(left, right):
+    """
+    Junta dois trechos da mesma página se forem vizinhos ou sobrepostos.
+    Devolve o texto combinado ou None.
+    """
+    a_start = left.metadata.get("start_index")
+    b_start = right.metadata.get("start_index")
+    if a_start is not None and b_start is not None:
+        a_end = a_start + len(left.page_content)
+        if b_start < a_start:
+            return None
+        if b_start <= a_end:
+            return left.page_content + right.page_content[a_end - b_start:]
+        if b_start - a_end <= ADJACENT_GAP:
+            return left.page_content + " " + right.page_content
+        return None
+    overlap = _text_overlap(left.page_content, right.page_content)
+    if overlap:
+        return left.page_content + right.page_content[overlap:]
+    return None
+
+
+def _shingles(text, size=3):
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _is_near_duplicate(shingles, kept, threshold):
+    for other in kept:
+        smaller = min(len(shingles), len(other)) or 1
+        # Contenção em vez de Jaccard: um trecho totalmente contido em outro também é duplicado.
+        if len(shingles & other) / smaller >= threshold:
+            return True
+    return False
+
+
+def compact_documents(docs, token_budget=1500, count_tokens=approx_tokens, duplicate_threshold=0.85):
+    """
+    Compacta os trechos recuperados antes de enviá-los ao LLM:
+    1. junta trechos vizinhos/sobrepostos da mesma fonte e página;
+    2. remove passagens quase duplicadas;
+    3. corta o resultado no orçamento de tokens, mantendo a ordem de relevância.
+    `token_budget` <= 0 desliga o corte.
+    """
+    # Agrupa por (fonte, página), mantendo a ordem do melhor trecho de cada grupo.
+    groups = {}
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        groups.setdefault(key, []).append((rank, doc))
+
+    passages = []
+    for members in groups.values():
+        best_rank = members[0][0]
+        members.sort(key=lambda item: (item[1].metadata.get("start_index", item[0]), item[0]))
+        current = members[0][1]
+        for _, doc in members[1:]:
+            merged = _merge_pair(current, doc)
+            if merged is None:
+                passages.append((best_rank, current))
+                current = doc
+            else:
+                current = Document(page_content=merged, metadata=dict(current.metadata))
+        passages.append((best_rank, current))
+    passages.sort(key=lambda item: item[0])
+
+    result, kept_shingles, used = [], [], 0
+    for _, doc in passages:
+        shingles = _shingles(doc.page_content)
+        if _is_near_duplicate(shingles, kept_shingles, duplicate_threshold):
+            continue
+        tokens = count_tokens(doc.page_content)
+        if token_budget > 0 and used + tokens > token_budget:
+            remaining = token_budget - used
+            if remaining < 50:
+                break
+            # Corta proporcionalmente o último trecho que cabe em parte.
+            cut = int(len(doc.page_content) * remaining / tokens)
+            doc = Document(page_content=doc.page_content[:cut].rstrip() + " [...]", metadata=dict(doc.metadata))
+            tokens = remaining
+        kept_shingles.append(shingles)
+        result.append(doc)
+        used += tokens
+        if token_budget > 0 and used >= token_budget:
+            break
+    return result
@@ -1,19 +1,89 @@
 import sys
 import os
-import shutil
+import time
 import traceback
 import logging
-from tqdm import tqdm
-
-from langchain.agents import AgentExecutor, create_openai_tools_agent
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.memory import ConversationBufferMemory
-from langchain.tools import Tool
-from langchain_openai import ChatOpenAI
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Qdrant
-from langchain_community.embeddings import SentenceTransformerEmbeddings
+import threading
+from collections import OrderedDict
+
+# As dependências pesadas (langchain, qdrant, sentence-transformers, tqdm) são
+# importadas dentro das funções que as usam: o backend responde às ações
+# simples logo após iniciar, enquanto o modelo de embeddings carrega em segundo plano.
+import metrics
+from index_manifest import IndexManifest, content_chunk_id, payload_digest
+from libraries import (
+    LibraryRegistry,
+    INDEX_NONE, INDEX_RESTORING, INDEX_BUILDING, INDEX_STALE, INDEX_READY, INDEX_ERROR,
+)
+from pdf_ingest import iter_extracted
+from chunking import get_chunker
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+EMBEDDING_MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+COLLECTION_NAME = "manus_biblioteca_vetorial"
+EMBEDDING_CACHE_MAX_ENTRIES = _env_int("IL_EMBEDDING_CACHE_MAX_ENTRIES", 200_000)
+INGEST_WORKERS = _env_int("IL_INGEST_WORKERS", 0)  # 0 = um processo por núcleo
+INGEST_BATCH_SIZE = _env_int("IL_INGEST_BATCH_SIZE", 256)  # trechos por lote de embedding/upsert
+# "tokens": trechos medidos pelo tokenizador do modelo, com cortes estáveis entre versões do PDF;
+# "chars": o splitter antigo de 1000 caracteres (trechos acima de 128 tokens são truncados pelo modelo).
+CHUNKER = os.environ.get("IL_CHUNKER", "tokens")
+CHUNK_MAX_TOKENS = _env_int("IL_CHUNK_MAX_TOKENS", 120)
+CHUNK_MIN_TOKENS = _env_int("IL_CHUNK_MIN_TOKENS", 48)
+# Pool de processos para os embeddings da indexação; cada processo carrega sua cópia do modelo (~0,5 GB).
+EMBED_WORKERS = _env_int("IL_EMBED_WORKERS", 1)  # 1 = no próprio processo, 0 = automático
+EMBED_BATCH_SIZE = _env_int("IL_EMBED_BATCH_SIZE", 64)  # trechos por tarefa enviada a um processo
+EMBED_THREADS = _env_int("IL_EMBED_THREADS", 0)  # threads do torch por processo (0 = núcleos / processos)
+RETRIEVER_K = 5
+# Bibliotecas abertas ao mesmo tempo; as menos usadas recentemente são fechadas acima dos limites (0 = sem limite).
+LIBRARY_MEMORY_MB = _env_int("IL_LIBRARY_MEMORY_MB", 2048)
+MAX_OPEN_LIBRARIES = _env_int("IL_MAX_OPEN_LIBRARIES", 16)
+VECTOR_ENGINE = os.environ.get("IL_VECTOR_ENGINE", "qdrant")  # "qdrant", "mmap" (exato) ou "hnsw" (aproximado)
+HNSW_EF_SEARCH = _env_int("IL_HNSW_EF", 64)  # maior = mais recall, mais latência
+# Só para o motor "mmap": "int8" (~4x menor) ou "binary" (~32x menor); vazio = float32 puro.
+VECTOR_QUANTIZATION = os.environ.get("IL_VECTOR_QUANTIZATION", "").strip().lower() or None
+RESCORE_OVERSAMPLE = _env_int("IL_RESCORE_OVERSAMPLE", 0)  # candidatos por resultado reordenados em float32; 0 = padrão do modo
+HYBRID_SEARCH = _env_int("IL_HYBRID_SEARCH", 1) == 1  # BM25 (SQLite FTS5) + vetores, combinados por RRF
+LEXICAL_FAST_PATH = _env_int("IL_LEXICAL_FAST_PATH", 1) == 1  # buscas exatas respondidas só pelo BM25, sem embedding
+RRF_K = _env_int("IL_RRF_K", 60)
+RERANK_ENABLED = _env_int("IL_RERANK", 0) == 1  # cross-encoder depois da busca (CPU)
+RERANK_MODEL_NAME = os.environ.get("IL_RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_CANDIDATES = _env_int("IL_RERANK_CANDIDATES", 20)  # N buscados para reordenar; mais = mais recall e mais latência
+RERANK_MIN_SCORE = _env_float("IL_RERANK_MIN_SCORE", 0.3)  # trechos abaixo disso não vão para o LLM
+RERANK_MAX_K = _env_int("IL_RERANK_MAX_K", 8)
+ANSWER_MODE = os.environ.get("IL_ANSWER_MODE", "agent")  # "agent" (ferramentas) ou "direct" (RAG em uma chamada)
+ROUTER_MIN_SCORE = _env_float("IL_ROUTER_MIN_SCORE", 0.25)  # abaixo disso a mensagem é tratada como conversa
+CONTEXT_TOKEN_BUDGET = _env_int("IL_CONTEXT_TOKEN_BUDGET", 1500)  # tokens de trechos enviados ao LLM (0 = sem limite)
+CONTEXT_DUPLICATE_THRESHOLD = _env_float("IL_CONTEXT_DUPLICATE_THRESHOLD", 0.85)
+MEMORY_MODE = os.environ.get("IL_MEMORY_MODE", "summary")  # "summary" (limitada por tokens) ou "buffer" (tudo)
+MEMORY_TOKEN_BUDGET = _env_int("IL_MEMORY_TOKEN_BUDGET", 2000)  # tokens do histórico enviados a cada pergunta
+SUMMARY_MODEL_NAME = os.environ.get("IL_SUMMARY_MODEL", "gpt-4o-mini")
+# Cada sessão (janela do Electron ou cliente do servidor HTTP) tem a própria memória de conversa.
+MAX_SESSIONS = _env_int("IL_MAX_SESSIONS", 256)  # sessões guardadas; a menos usada recentemente é descartada
+LOCAL_SESSION = "local"  # sessão única do modo stdin/stdout
+# Cliente HTTP único (keep-alive) para a OpenAI ou um servidor compatível/mock em IL_OPENAI_BASE_URL.
+LLM_BASE_URL = os.environ.get("IL_OPENAI_BASE_URL") or None
+LLM_MAX_CONNECTIONS = _env_int("IL_LLM_MAX_CONNECTIONS", 10)
+LLM_MAX_CONCURRENCY = _env_int("IL_LLM_MAX_CONCURRENCY", 4)  # requisições simultâneas ao LLM
+LLM_MAX_RETRIES = _env_int("IL_LLM_MAX_RETRIES", 4)  # novas tentativas em 429/5xx, guiadas pelos cabeçalhos de rate limit
+BATCH_CONCURRENCY = _env_int("IL_BATCH_CONCURRENCY", LLM_MAX_CONCURRENCY)  # perguntas de um lote respondidas ao mesmo tempo
+KEY_VALIDATION_TTL_HOURS = _env_float("IL_KEY_VALIDATION_TTL_HOURS", 24)
+FAKE_LLM = _env_int("IL_FAKE_LLM", 0) == 1  # benchmarks: LLM local determinístico, sem chamadas à OpenAI
+FAKE_LLM_LATENCY_MS = _env_float("IL_FAKE_LLM_LATENCY_MS", 0.0)
+ANSWER_CACHE_ENABLED = _env_int("IL_ANSWER_CACHE", 1) == 1
+ANSWER_CACHE_THRESHOLD = _env_float("IL_ANSWER_CACHE_THRESHOLD", 0.95)  # similaridade de cosseno mínima
+ANSWER_CACHE_MAX_ENTRIES = _env_int("IL_ANSWER_CACHE_MAX_ENTRIES", 1000)
+ANSWER_CACHE_TTL_HOURS = _env_float("IL_ANSWER_CACHE_TTL_HOURS", 7 * 24)
 
 def setup_logging():
     logging.basicConfig(level=logging.ERROR)
@@ -31,38 +101,334 @@ def check_openai_api_key(api_key: str) -> tuple[bool, str]:
         return False, "Chave da API não fornecida ou em formato inválido."
     if not api_key.startswith('sk-'):
         return False, "Formato de chave inválido. Deve começar com 'sk-'."
+    if FAKE_LLM:
+        return True, "LLM simulado (IL_FAKE_LLM=1): chave nao verificada."
     try:
-        ChatOpenAI(openai_api_key=api_key).invoke("test")
-        return True, "Chave da API válida."
+        # Validação em cache pelo hash da chave: salvar a chave e depois indexar custa uma única ida à API.
+        return llm_clients().validate_key(api_key)
     except Exception as e:
-        if "authentication" in str(e).lower():
-            return False, "Chave da API da OpenAI inválida ou expirada."
         return False, f"Erro ao validar a chave: {e}"
 
+_llm_clients = None
+_llm_clients_lock = threading.Lock()
+
+def llm_clients():
+    """
+    Pool de conexões com o LLM, compartilhado por todo o processo (criado no primeiro uso).
+    """
+    global _llm_clients
+    with _llm_clients_lock:
+        if _llm_clients is None:
+            from llm_client import LLMClientPool
+            _llm_clients = LLMClientPool(
+                base_url=LLM_BASE_URL, max_connections=LLM_MAX_CONNECTIONS,
+                max_concurrency=LLM_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES,
+                valid_key_ttl=KEY_VALIDATION_TTL_HOURS * 3600,
+            )
+        return _llm_clients
+
+class OperationCancelled(Exception):
+    """Levantada quando o cliente cancela uma operação longa (indexação ou pergunta)."""
+
+def _raise_if_cancelled(should_cancel):
+    if should_cancel is not None and should_cancel():
+        raise OperationCancelled("Operacao cancelada pelo cliente.")
+
+def _request_callback(should_cancel=None, on_token=None):
+    # Interrompe o agente entre etapas (antes de cada chamada ao LLM ou ferramenta) e
+    # durante a geração (a cada token), e repassa os tokens, um a um, para quem pediu streaming.
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class RequestCallback(BaseCallbackHandler):
+        raise_error = True
+
+        def on_llm_start(self, *args, **kwargs):
+            _raise_if_cancelled(should_cancel)
+
+        def on_chat_model_start(self, *args, **kwargs):
+            _raise_if_cancelled(should_cancel)
+
+        def on_tool_start(self, *args, **kwargs):
+            _raise_if_cancelled(should_cancel)
+
+        def on_llm_new_token(self, token, **kwargs):
+            _raise_if_cancelled(should_cancel)
+            # A rodada que decide chamar a ferramenta gera tokens vazios; só o texto da resposta interessa.
+            if on_token is not None and token:
+                on_token(token)
+
+    return RequestCallback()
+
+SYSTEM_PROMPT = "Você é Manus, um assistente de pesquisa. Sua missão é ser útil, usando EXCLUSIVAMENTE os documentos fornecidos. Se a pergunta não for sobre os documentos (ex: 'olá'), responda de forma breve e educada sem usar ferramentas. Para perguntas sobre o conteúdo, use a ferramenta `busca_semantica_documentos`. Se a ferramenta não retornar nada relevante, sua única resposta permitida é: 'Após uma busca nos documentos, não encontrei uma resposta direta.' Nunca use conhecimento geral. Ao final da resposta, liste as fontes usadas."
+
+DIRECT_RAG_PROMPT = "Você é Manus, um assistente de pesquisa. Responda usando EXCLUSIVAMENTE os trechos dos documentos abaixo. Se eles não contiverem a resposta, sua única resposta permitida é: 'Após uma busca nos documentos, não encontrei uma resposta direta.' Nunca use conhecimento geral. Ao final da resposta, liste as fontes usadas.\n\nTrechos dos documentos:\n{context}"
+
+SMALL_TALK_PROMPT = "Você é Manus, um assistente de pesquisa sobre os documentos carregados pelo usuário. A mensagem a seguir não é sobre o conteúdo dos documentos (ex: 'olá'): responda de forma breve e educada, sem usar conhecimento geral, e convide o usuário a perguntar sobre os documentos."
+
+def _chat_model(model_name, api_key, streaming=False):
+    if FAKE_LLM:
+        from fake_llm import FakeChatModel
+        return FakeChatModel(latency_ms=FAKE_LLM_LATENCY_MS)
+    return llm_clients().chat_model(model_name, api_key, streaming=streaming)
+
+def _peak_rss_mb():
+    # Pico de memória do processo e dos filhos já encerrados (pools de extração/embeddings).
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss vem em KB no Linux e em bytes no macOS.
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit, 1),
+    }
+
+def _format_docs(docs):
+    return "\n\n---\n\n".join([f"Fonte: {d.metadata.get('source', 'N/A')}, Pagina: {d.metadata.get('page', -1) + 1}\nConteudo: {d.page_content}" for d in docs])
+
+def _count_message_tokens(llm, messages):
+    try:
+        return llm.get_num_tokens_from_messages(messages)
+    except Exception:
+        # Mensagens que o contador do tiktoken não conhece: estimativa de ~4 caracteres por token.
+        return sum(len(str(m.content)) for m in messages) // 4
+
+def _usage_callback(llm):
+    # Conta localmente os tokens de entrada/saída de cada chamada ao LLM; com streaming
+    # a API não devolve o uso, e assim a economia da memória limitada fica mensurável.
+    # Também mede cada chamada: as que decidem chamar a ferramenta e as que escrevem a resposta.
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class UsageCallback(BaseCallbackHandler):
+        def __init__(self):
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.llm_calls = 0
+            self._started = {}  # run_id -> [início, primeiro token já visto]
+
+        def on_chat_model_start(self, serialized, messages, **kwargs):
+            self.llm_calls += 1
+            tokens = sum(_count_message_tokens(llm, batch) for batch in messages)
+            self.prompt_tokens += tokens
+            metrics.incr("llm.calls")
+            metrics.incr("llm.prompt_tokens", tokens)
+            self._started[kwargs.get("run_id")] = [time.perf_counter(), False]
+
+        def on_llm_new_token(self, token, **kwargs):
+            started = self._started.get(kwargs.get("run_id"))
+            if started is not None and not started[1]:
+                started[1] = True
+                metrics.observe("llm.first_token", time.perf_counter() - started[0])
+
+        def on_llm_end(self, response, **kwargs):
+            tokens, tool_call = 0, False
+            for generations in response.generations:
+                for generation in generations:
+                    if generation.text:
+                        tokens += llm.get_num_tokens(generation.text)
+                    message = getattr(generation, "message", None)
+                    if message is not None and message.additional_kwargs.get("tool_calls"):
+                        tool_call = True
+            self.completion_tokens += tokens
+            metrics.incr("llm.completion_tokens", tokens)
+            started = self._started.pop(kwargs.get("run_id"), None)
+            if started is not None:
+                name = "llm.call.tool_decision" if tool_call else "llm.call.answer"
+                metrics.observe(name, time.perf_counter() - started[0], completion_tokens=tokens)
+
+        def on_llm_error(self, error, **kwargs):
+            self._started.pop(kwargs.get("run_id"), None)
+            metrics.incr("llm.errors")
+
+        def report(self):
+            return {
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "llm_calls": self.llm_calls,
+            }
+
+    return UsageCallback()
+
+# Estado da pergunta em andamento na thread atual (fontes consultadas pela ferramenta de busca).
+_request_state = threading.local()
+
+def _record_sources(docs):
+    sources = getattr(_request_state, "sources", None)
+    if sources is None:
+        return
+    for d in docs:
+        item = {"source": d.metadata.get('source', 'N/A'), "page": d.metadata.get('page', -1) + 1}
+        if item not in sources:
+            sources.append(item)
+
+MODEL_NOT_LOADED = "NOT_LOADED"
+MODEL_LOADING = "LOADING"
+MODEL_READY = "READY"
+MODEL_ERROR = "ERROR"
+
 class AgentManager:
     _instance = None
+    _instance_lock = threading.Lock()
 
     def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(AgentManager, cls).__new__(cls)
-            cls._instance.agent_executor = None
-            cls._instance.base_dir = os.path.dirname(os.path.abspath(__file__))
-            cls._instance.docs_path = os.path.join(cls._instance.base_dir, "documents")
-            cls._instance.db_path = os.path.join(cls._instance.base_dir, "db_storage")
-            cache_dir = os.path.join(cls._instance.base_dir, 'embedding_cache')
+        # Criado a partir de várias threads (aquecimento, restauração, pool de ações).
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = super(AgentManager, cls).__new__(cls)
+                cls._instance.agent_executor = None
+                cls._instance.base_dir = os.path.dirname(os.path.abspath(__file__))
+                # IL_DATA_DIR separa documentos e índices do código (benchmarks, instalações com pasta de dados própria).
+                cls._instance.data_dir = os.environ.get("IL_DATA_DIR") or cls._instance.base_dir
+                # Cada biblioteca tem pasta de documentos, coleção, manifesto e cache de respostas próprios.
+                cls._instance.libraries = LibraryRegistry(
+                    cls._instance.data_dir, COLLECTION_NAME,
+                    memory_limit_bytes=LIBRARY_MEMORY_MB * 2 ** 20, max_open=MAX_OPEN_LIBRARIES,
+                )
+                cls._instance.model_status = MODEL_NOT_LOADED
+                cls._instance.model_error = None
+                cls._instance._embeddings = None
+                cls._instance._model_ready = threading.Event()
+                cls._instance._warm_up_thread = None
+                cls._instance._warm_up_lock = threading.Lock()
+                cls._instance.reranker = None
+                cls._instance._sessions = OrderedDict()  # id da sessão -> memória da conversa, em ordem LRU
+                cls._instance._sessions_lock = threading.Lock()
+                cls._instance._ingest_cancel = threading.Event()
+                cls._instance._api_key = None
+                cls._instance._lock = threading.RLock()
+                sys.stderr.write("[CORE_LOGIC] Nova instancia do AgentManager criada.\n")
+                sys.stderr.flush()
+            return cls._instance
+
+    def start_warm_up(self):
+        """
+        Carrega o modelo de embeddings numa thread em segundo plano (uma única vez).
+        """
+        with self._warm_up_lock:
+            if self._warm_up_thread is None:
+                self.model_status = MODEL_LOADING
+                self._warm_up_thread = threading.Thread(target=self._warm_up, name="embedding-warm-up", daemon=True)
+                self._warm_up_thread.start()
+            return self._warm_up_thread
+
+    def _warm_up(self):
+        start = time.perf_counter()
+        try:
+            from langchain_community.embeddings import SentenceTransformerEmbeddings
+            from embedding_cache import CachedEmbeddings
+
+            cache_dir = os.path.join(self.base_dir, 'embedding_cache')
             os.makedirs(cache_dir, exist_ok=True)
-            cls._instance.embeddings = SentenceTransformerEmbeddings(
-                model_name="paraphrase-multilingual-MiniLM-L12-v2",
+            underlying = SentenceTransformerEmbeddings(
+                model_name=EMBEDDING_MODEL_NAME,
                 cache_folder=cache_dir
             )
-            sys.stderr.write("[CORE_LOGIC] Nova instancia do AgentManager criada.\n")
+            if EMBED_WORKERS != 1:
+                from embedding_pool import PooledEmbeddings
+                underlying = PooledEmbeddings(
+                    underlying, EMBEDDING_MODEL_NAME, cache_folder=cache_dir,
+                    workers=EMBED_WORKERS, batch_size=EMBED_BATCH_SIZE, threads=EMBED_THREADS,
+                )
+            embeddings = CachedEmbeddings(
+                underlying,
+                model_name=EMBEDDING_MODEL_NAME,
+                db_path=os.path.join(self.data_dir, "embedding_cache", "vetores.sqlite"),
+                max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+            )
+            # Uma codificação de teste inicializa os pesos e threads do modelo.
+            embeddings.underlying.embed_query("aquecimento")
+            self._embeddings = embeddings
+            self.model_status = MODEL_READY
+            sys.stderr.write(f"[CORE_LOGIC] Modelo de embeddings pronto em {time.perf_counter() - start:.1f}s.\n")
+            if RERANK_ENABLED:
+                self._load_reranker(cache_dir)
+        except Exception as e:
+            self.model_error = str(e)
+            self.model_status = MODEL_ERROR
+            sys.stderr.write(f"[CORE_LOGIC_ERROR] Falha ao carregar o modelo de embeddings: {e}\n{traceback.format_exc()}\n")
+        finally:
+            self._model_ready.set()
             sys.stderr.flush()
-        return cls._instance
+
+    def _load_reranker(self, cache_dir):
+        try:
+            from reranker import CrossEncoderReranker
+            reranker = CrossEncoderReranker(RERANK_MODEL_NAME, cache_folder=cache_dir)
+            reranker.load()
+            self.reranker = reranker
+        except Exception as e:
+            # O reranking é opcional: sem ele a busca volta ao k fixo.
+            sys.stderr.write(f"[CORE_LOGIC_ERROR] Cross-encoder indisponivel, reranking desativado: {e}\n")
+
+    @property
+    def embeddings(self):
+        # Quem precisa do modelo espera o aquecimento terminar (ou o dispara, se ainda não começou).
+        self.start_warm_up()
+        self._model_ready.wait()
+        if self._embeddings is None:
+            raise RuntimeError(f"Modelo de embeddings indisponivel: {self.model_error}")
+        return self._embeddings
+
+    def status(self, library=None):
+        # Os campos do índice descrevem uma biblioteca ("default" se não for indicada).
+        library = self.libraries.get(library)
+        status = {
+            "status": "READY" if self.is_initialized() else "NOT_READY",
+            "model_status": self.model_status,
+            "index_status": library.index_status,
+            "library": library.name,
+        }
+        if library.answer_cache is not None:
+            status["answer_cache"] = library.answer_cache.stats()
+        if self.reranker is not None:
+            status["reranker"] = self.reranker.stats()
+        if library.ingest_stats is not None:
+            status["ingestion"] = library.ingest_stats
+        memory = _peak_rss_mb()
+        if memory is not None:
+            status["peak_rss_mb"] = memory
+        if library.index_status == INDEX_BUILDING and library.ingest_progress is not None:
+            status["progress"] = library.ingest_progress
+        status["libraries"] = self.libraries.stats()
+        status["sessions"] = len(self._sessions)
+        return status
+
+    def list_libraries(self):
+        result = []
+        for name in self.libraries.names():
+            library = self.libraries.get(name)
+            summary = library.summary()
+            summary["saved_index"] = library.has_saved_index()
+            result.append(summary)
+        return {"libraries": result, **self.libraries.stats()}
 
     def is_initialized(self):
         return self.agent_executor is not None
 
-    def initialize_agent(self, api_key: str):
+    def is_ingesting(self):
+        return any(library.index_status == INDEX_BUILDING for library in self.libraries.loaded())
+
+    def cancel_ingestion(self):
+        """
+        Pede o cancelamento da indexação em andamento; devolve False se não houver nenhuma.
+        """
+        if not self.is_ingesting():
+            return False
+        self._ingest_cancel.set()
+        return True
+
+    def initialize_agent(self, api_key: str, should_cancel=None, on_progress=None, library=None):
+        """
+        Sincroniza o índice da biblioteca com sua pasta de documentos. O agente é montado
+        antes da indexação, então as perguntas já são respondidas com o que estiver
+        indexado (marcadas com partial_index). `on_progress` recebe o andamento a cada lote.
+        """
+        self._ingest_cancel.clear()
+
+        def cancelled():
+            return self._ingest_cancel.is_set() or (should_cancel is not None and should_cancel())
+
         try:
             # --- Início do Bloco de Confiança ---
 
@@ -73,74 +439,833 @@ class AgentManager:
             sys.stderr.write("[CORE_LOGIC] Chave da API é válida.\n")
 
             sys.stderr.write("[CORE_LOGIC] Verificando documentos...\n")
-            os.makedirs(self.docs_path, exist_ok=True)
-            pdf_files = [f for f in os.listdir(self.docs_path) if f.lower().endswith(".pdf")]
-            if not pdf_files:
-                raise FileNotFoundError("Nenhum arquivo PDF encontrado na pasta de documentos internos.")
-
-            all_docs = []
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-            for pdf_file in tqdm(pdf_files, desc="[CORE_LOGIC] Processando PDFs", file=sys.stderr):
-                loader = PyPDFLoader(os.path.join(self.docs_path, pdf_file))
-                docs = loader.load()
-                for doc in docs:
-                    doc.metadata["source"] = os.path.basename(pdf_file)
-                all_docs.extend(text_splitter.split_documents(docs))
-
-            # --- A CORREÇÃO INTELIGENTE ---
-            if os.path.exists(self.db_path):
-                sys.stderr.write(f"[CORE_LOGIC] Limpando banco de dados antigo em {self.db_path}\n")
-                if os.path.isdir(self.db_path):
-                    shutil.rmtree(self.db_path)  # Se for um diretório
-                else:
-                    os.remove(self.db_path)      # Se for um arquivo
-            # --------------------------------
-
-            vector_store = Qdrant.from_documents(
-                all_docs, self.embeddings,
-                path=self.db_path, collection_name="manus_biblioteca_vetorial"
-            )
-            retriever = vector_store.as_retriever(search_kwargs={'k': 5})
+            with self.libraries.use(library) as library, library.lock:
+                pdf_files = library.list_pdf_files()
+                if not pdf_files:
+                    raise FileNotFoundError("Nenhum arquivo PDF encontrado na pasta de documentos internos.")
 
-            def semantic_search_func(query: str) -> str:
-                docs = retriever.invoke(query)
-                if not docs: return "Nenhum documento relevante encontrado."
-                return "\n\n---\n\n".join([f"Fonte: {d.metadata.get('source', 'N/A')}, Pagina: {d.metadata.get('page', -1) + 1}\nConteudo: {d.page_content}" for d in docs])
-
-            tools = [Tool(name="busca_semantica_documentos", func=semantic_search_func, description="Use para buscar significado ou contexto nos documentos.")]
-            
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", "Você é Manus, um assistente de pesquisa. Sua missão é ser útil, usando EXCLUSIVAMENTE os documentos fornecidos. Se a pergunta não for sobre os documentos (ex: 'olá'), responda de forma breve e educada sem usar ferramentas. Para perguntas sobre o conteúdo, use a ferramenta `busca_semantica_documentos`. Se a ferramenta não retornar nada relevante, sua única resposta permitida é: 'Após uma busca nos documentos, não encontrei uma resposta direta.' Nunca use conhecimento geral. Ao final da resposta, liste as fontes usadas."),
-                MessagesPlaceholder(variable_name="chat_history"),
-                ("user", "{input}"),
-                MessagesPlaceholder(variable_name="agent_scratchpad"),
-            ])
-
-            llm = ChatOpenAI(model_name="gpt-4o", openai_api_key=api_key, temperature=0)
-            agent = create_openai_tools_agent(llm, tools, prompt)
-            memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-            self.agent_executor = AgentExecutor(agent=agent, tools=tools, memory=memory, verbose=True, handle_parsing_errors=True, max_iterations=5)
-            
-            log_message("Documentos processados e agente inicializado com sucesso!")
-            return {"success": True, "message": f"[OK] {len(pdf_files)} documento(s) processado(s) e biblioteca criada!"}
+                self._open_vector_index(library)
+                with self._lock:
+                    if not self.is_initialized() or api_key != self._api_key:
+                        self._build_agent(api_key)
+                library.index_status = INDEX_BUILDING
+                try:
+                    plan = self._sync_documents(library, pdf_files, cancelled, on_progress)
+                except Exception:
+                    # O que já foi gravado continua consultável, mas não cobre toda a pasta.
+                    library.index_status = INDEX_STALE
+                    raise
+                finally:
+                    library.ingest_progress = None
+                # Conjunto de documentos novo: invalida o cache de respostas sem apagar a memória da conversa.
+                self._open_answer_cache(library)
+                library.index_status = INDEX_READY
+
+            log_message(f"Documentos da biblioteca '{library.name}' processados e agente inicializado com sucesso!")
+            failed = [r["source"] for r in plan.report if r["error"]]
+            message = (
+                f"[OK] {len(pdf_files)} documento(s) na biblioteca: {len(plan.new)} novo(s), "
+                f"{len(plan.changed)} alterado(s), {len(plan.removed)} removido(s)."
+            )
+            if failed:
+                message += f" {len(failed)} arquivo(s) com erro: {', '.join(failed)}."
+            return {"success": True, "message": message, "report": plan.report}
 
+        except OperationCancelled:
+            log_message("Indexacao cancelada; os lotes ja gravados foram mantidos.")
+            return {"success": False, "cancelled": True, "message": "Indexacao cancelada. Os documentos ja processados foram mantidos e continuam disponiveis para consulta."}
         except Exception as e:
             # --- O Ponto de Falha Seguro ---
             error_message = f"Falha ao inicializar o agente: {e}"
             sys.stderr.write(f"[CORE_LOGIC_ERROR] {error_message}\n{traceback.format_exc()}\n")
             return {"success": False, "message": str(e)}
 
-    def ask_question(self, question: str) -> dict:
+    def restore_agent(self, api_key: str):
+        """
+        Reabre a coleção persistida da biblioteca "default" e reconstrói o agente, sem
+        reindexar. As outras bibliotecas são abertas no primeiro uso (ver _open_library);
+        se só elas tiverem índice salvo, o agente é montado do mesmo jeito.
+        """
+        if not api_key or not api_key.startswith('sk-'):
+            return {"success": False, "message": "Nenhuma chave da API salva."}
+        with self._lock:
+            if self.is_initialized():
+                return {"success": True, "message": "Agente ja inicializado."}
+        start = time.perf_counter()
+        with self.libraries.use() as library:
+            restored = self._restore_library(library)
+            message = restored["message"]
+            if not restored["success"]:
+                others = [name for name in self.libraries.names() if name != library.name and self.libraries.get(name).has_saved_index()]
+                if not others:
+                    return restored
+                message += f" {len(others)} outra(s) biblioteca(s) disponivel(is) sob demanda."
+            with self._lock:
+                if not self.is_initialized():
+                    self._build_agent(api_key)
+        log_message(f"Restauracao concluida em {time.perf_counter() - start:.1f}s: {message}")
+        return {"success": True, "message": message}
+
+    def _restore_library(self, library):
+        """
+        Reabre o índice salvo da biblioteca sem reindexar. Só o marca como pronto se
+        o manifesto bater com a pasta de documentos.
+        """
+        with library.lock:
+            if library.index_status == INDEX_READY and library.is_open:
+                return {"success": True, "message": f"Biblioteca '{library.name}' ja aberta."}
+            try:
+                library.index_status = INDEX_RESTORING
+                pdf_files = library.list_pdf_files()
+                vector_index = self._open_vector_index(library, create=False) if pdf_files else None
+                if vector_index is None:
+                    library.index_status = INDEX_NONE
+                    return {"success": False, "message": "Nenhum indice salvo encontrado."}
+
+                plan = library.manifest.plan(library.docs_path, pdf_files)
+                if plan.has_changes():
+                    library.index_status = INDEX_STALE
+                    sys.stderr.write(
+                        f"[CORE_LOGIC] Indice salvo da biblioteca '{library.name}' desatualizado: {len(plan.new)} novo(s), "
+                        f"{len(plan.changed)} alterado(s), {len(plan.removed)} removido(s). Recarregue os documentos.\n"
+                    )
+                    return {"success": False, "message": "O indice salvo nao corresponde aos documentos. Recarregue os documentos."}
+                if plan.outdated:
+                    # O índice continua válido; a nova divisão em trechos fica para o próximo carregamento.
+                    sys.stderr.write(
+                        f"[CORE_LOGIC] Biblioteca '{library.name}': {len(plan.outdated)} documento(s) divididos por outro "
+                        f"chunker serao redivididos no proximo carregamento dos documentos.\n"
+                    )
+                library.manifest.save()
+                self._open_answer_cache(library)
+                library.index_status = INDEX_READY
+                sys.stderr.write(f"[CORE_LOGIC] Biblioteca '{library.name}' aberta com {len(pdf_files)} documento(s).\n")
+                return {"success": True, "message": f"[OK] Biblioteca com {len(pdf_files)} documento(s) restaurada."}
+            except Exception as e:
+                library.index_status = INDEX_ERROR
+                sys.stderr.write(f"[CORE_LOGIC_ERROR] Falha ao restaurar o indice da biblioteca '{library.name}': {e}\n{traceback.format_exc()}\n")
+                return {"success": False, "message": str(e)}
+
+    def _open_library(self, library):
+        """
+        Abertura sob demanda antes de uma busca. Uma biblioteca em indexação (ou com o
+        índice desatualizado) já está aberta e responde com o que estiver gravado.
+        """
+        if not library.is_open and library.index_status != INDEX_ERROR:
+            self._restore_library(library)
+        return library.is_open
+
+    def _build_agent(self, api_key):
+        from langchain.agents import AgentExecutor, create_openai_tools_agent
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        from langchain.memory import ConversationBufferMemory, ConversationSummaryBufferMemory
+        from langchain.tools import Tool
+
+        self._api_key = api_key
+
+        def semantic_search_func(query: str) -> str:
+            # A ferramenta roda na thread da pergunta: a biblioteca vem do estado da requisição.
+            with metrics.span("agent.tool_call"):
+                # Se o agente busca a própria pergunta, reaproveita o embedding do cache de respostas.
+                asked = getattr(_request_state, "question_vector", None)
+                vector = asked[1] if asked is not None and asked[0] == query.strip() else None
+                docs, _, _ = self._retrieve_context(_request_state.library, query, vector)
+                _record_sources(docs)
+                if not docs: return "Nenhum documento relevante encontrado."
+                return _format_docs(self._compact_context(docs))
+
+        tools = [Tool(name="busca_semantica_documentos", func=semantic_search_func, description="Use para buscar significado ou contexto nos documentos.")]
+
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", SYSTEM_PROMPT),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("user", "{input}"),
+            MessagesPlaceholder(variable_name="agent_scratchpad"),
+        ])
+
+        # streaming=True faz o LLM emitir on_llm_new_token; sem ouvinte, a resposta é só agregada.
+        llm = _chat_model("gpt-4o", api_key, streaming=True)
+        agent = create_openai_tools_agent(llm, tools, prompt)
+        summary_llm = _chat_model(SUMMARY_MODEL_NAME, api_key) if MEMORY_MODE == "summary" else None
+
+        def new_memory():
+            if summary_llm is not None:
+                # Janela de turnos recentes dentro do orçamento de tokens; os mais antigos viram um resumo.
+                return ConversationSummaryBufferMemory(
+                    llm=summary_llm, max_token_limit=MEMORY_TOKEN_BUDGET,
+                    memory_key="chat_history", return_messages=True,
+                )
+            return ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+
+        # Sem memória própria: o histórico de cada sessão entra em chat_history a cada pergunta.
+        agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True, handle_parsing_errors=True, max_iterations=5)
+        self._new_memory = new_memory
+        with self._sessions_lock:
+            # Troca de chave: as conversas de todas as sessões continuam; só as memórias
+            # com resumo passam a usar o LLM da chave nova.
+            if summary_llm is not None:
+                for memory in self._sessions.values():
+                    memory.llm = summary_llm
+
+        # Modo "direct": as mesmas memórias e o mesmo LLM, sem o laço de ferramentas do agente.
+        self.llm = llm
+        self._direct_prompt = ChatPromptTemplate.from_messages([
+            ("system", DIRECT_RAG_PROMPT),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("user", "{input}"),
+        ])
+        self._small_talk_prompt = ChatPromptTemplate.from_messages([
+            ("system", SMALL_TALK_PROMPT),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("user", "{input}"),
+        ])
+        # Por último: is_initialized() olha o executor, e as perguntas só podem entrar com o resto pronto.
+        self.agent_executor = agent_executor
+
+    def _context_k(self):
+        return RETRIEVER_K if self.reranker is None else RERANK_CANDIDATES
+
+    def _retrieve_context(self, library, query, vector=None, vector_hits=None):
+        """
+        Trechos que vão para o LLM. Com o reranking ligado, busca RERANK_CANDIDATES
+        candidatos e fica só com os que o cross-encoder aprova; sem ele, os RETRIEVER_K primeiros.
+        `vector_hits` são os resultados de uma busca vetorial já feita em lote.
+        """
+        with metrics.span("retrieval", library=library.name) as attrs:
+            docs, best_score, method = self._retrieve(library, query, self._context_k(), vector, vector_hits=vector_hits)
+            if self.reranker is not None:
+                # O próprio reranker mede a chamada (span "retrieval.rerank").
+                ranked = self.reranker.rerank(query, docs, min_score=RERANK_MIN_SCORE, max_k=RERANK_MAX_K)
+                docs = [doc for doc, _ in ranked]
+            attrs.update(method=method, chunks=len(docs))
+        metrics.incr(f"retrieval.method.{method}")
+        return docs, best_score, method
+
+    def metrics_snapshot(self, reset=False):
+        """
+        Histogramas e contadores do módulo metrics mais o estado dos caches.
+        """
+        snapshot = metrics.snapshot(reset=reset)
+        caches = {}
+        if self._embeddings is not None:
+            caches["embeddings"] = self._embeddings.stats()
+        answers = {library.name: library.answer_cache.stats() for library in self.libraries.loaded() if library.answer_cache is not None}
+        if answers:
+            caches["answers"] = answers
+        snapshot["caches"] = caches
+        snapshot["libraries"] = self.libraries.stats()
+        if self.reranker is not None:
+            snapshot["reranker"] = self.reranker.stats()
+        return snapshot
+
+    def search_documents(self, query, library=None):
+        """
+        Só a etapa de recuperação, sem LLM: os trechos que iriam para o contexto da pergunta.
+        """
+        with self.libraries.use(library) as library:
+            if not self._open_library(library):
+                return {"error": "Nenhum indice carregado."}
+            start = time.perf_counter()
+            docs, best_score, method = self._retrieve_context(library, query)
+        return {
+            "method": method,
+            "best_score": best_score,
+            "seconds": round(time.perf_counter() - start, 4),
+            "chunks": [
+                {"source": d.metadata.get("source", "N/A"), "page": d.metadata.get("page", -1) + 1, "content": d.page_content}
+                for d in docs
+            ],
+        }
+
+    def _compact_context(self, docs):
+        # Junta trechos sobrepostos da mesma página, tira duplicados e respeita o orçamento de tokens.
+        from context_compaction import compact_documents
+        with metrics.span("retrieval.compact", chunks=len(docs)):
+            compacted = compact_documents(
+                docs, token_budget=CONTEXT_TOKEN_BUDGET, count_tokens=self.llm.get_num_tokens,
+                duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD,
+            )
+        sys.stderr.write(f"[CORE_LOGIC] Contexto compactado: {len(docs)} trecho(s) -> {len(compacted)} passagem(ns).\n")
+        return compacted
+
+    def _session_memory(self, session):
+        session = session or LOCAL_SESSION
+        with self._sessions_lock:
+            memory = self._sessions.get(session)
+            if memory is None:
+                memory = self._sessions[session] = self._new_memory()
+                while len(self._sessions) > MAX_SESSIONS:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session)
+            return memory
+
+    def end_session(self, session):
+        with self._sessions_lock:
+            return self._sessions.pop(session, None) is not None
+
+    def _history_tokens(self, memory):
+        # Tamanho atual do histórico (resumo + turnos recentes) que vai em cada prompt.
+        history = memory.load_memory_variables({})["chat_history"]
+        return _count_message_tokens(self.llm, history) if history else 0
+
+    def _answer_direct(self, library, memory, question, question_vector, callbacks):
+        """
+        RAG em uma única chamada ao LLM. A busca local também serve de roteador:
+        se nenhum trecho passa de ROUTER_MIN_SCORE (e não houve acerto exato no
+        BM25), a mensagem é tratada como conversa e respondida sem contexto.
+        """
+        docs, best_score, method = self._retrieve_context(library, question, question_vector)
+        history = memory.load_memory_variables({})["chat_history"]
+        messages, route = self._direct_messages(history, question, docs, best_score, method)
+        answer = self.llm.invoke(messages, config={"callbacks": callbacks}).content.strip()
+        memory.save_context({"input": question}, {"output": answer})
+        return answer, route
+
+    def _direct_messages(self, history, question, docs, best_score, method):
+        if method != "lexical" and best_score < ROUTER_MIN_SCORE:
+            return self._small_talk_prompt.format_messages(chat_history=history, input=question), "small_talk"
+        _record_sources(docs)
+        context = _format_docs(self._compact_context(docs))
+        return self._direct_prompt.format_messages(context=context, chat_history=history, input=question), "retrieval"
+
+    def _open_answer_cache(self, library):
+        if not ANSWER_CACHE_ENABLED:
+            return
+        if library.answer_cache is None:
+            from answer_cache import SemanticAnswerCache
+            library.answer_cache = SemanticAnswerCache(
+                os.path.join(library.db_path, "respostas.sqlite"),
+                threshold=ANSWER_CACHE_THRESHOLD,
+                max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                ttl_seconds=ANSWER_CACHE_TTL_HOURS * 3600,
+            )
+        # Qualquer mudança no conjunto de documentos invalida as respostas guardadas.
+        library.answer_cache.set_corpus_version(library.manifest.version())
+
+    def _open_vector_index(self, library, create=True):
+        from vector_engines import open_engine
+
+        # O cliente local do Qdrant trava a pasta: mantemos uma única instância aberta por biblioteca.
+        if library.vector_index is not None:
+            return library.vector_index
+        if not create and not os.path.isdir(library.db_path):
+            return None
+        engine = open_engine(
+            VECTOR_ENGINE, library.db_path, library.collection_name, ef_search=HNSW_EF_SEARCH,
+            quantization=VECTOR_QUANTIZATION, oversample=RESCORE_OVERSAMPLE or None,
+        )
+        manifest = IndexManifest(
+            library.db_path, EMBEDDING_MODEL_NAME, filename=engine.manifest_filename,
+            chunker=get_chunker(**self._chunking()).signature,
+        )
+        if not create and (not engine.exists() or not manifest.exists):
+            # Só reabre um índice que já existe e tem manifesto compatível; nunca cria nem apaga.
+            engine.close()
+            return None
+        created = False
+        if engine.exists() and not manifest.exists:
+            # Índice criado por uma versão antiga (IDs aleatórios, sem manifesto): recria uma única vez.
+            sys.stderr.write("[CORE_LOGIC] Indice sem manifesto encontrado. Recriando indice vetorial...\n")
+            created = True
+        elif not engine.exists():
+            created = True
+        if created:
+            engine.create(len(self.embeddings.embed_query("dimensao")))
+            manifest.clear()
+            manifest.save()
+        sys.stderr.write(
+            f"[CORE_LOGIC] Motor de busca vetorial da biblioteca '{library.name}': {engine.name} ({engine.count()} trecho(s)).\n"
+        )
+        library.manifest = manifest
+        library.lexical_index = self._open_lexical_index(library, engine, created)
+        # Por último: uma biblioteca com vector_index já tem manifesto e índice lexical prontos.
+        library.vector_index = engine
+        return engine
+
+    def _chunking(self):
+        # Argumentos de chunking.get_chunker, repassados aos processos de extração.
+        return {
+            "mode": CHUNKER, "model_name": EMBEDDING_MODEL_NAME,
+            "cache_folder": os.path.join(self.base_dir, 'embedding_cache'),
+            "max_tokens": CHUNK_MAX_TOKENS, "min_tokens": CHUNK_MIN_TOKENS,
+        }
+
+    def _open_lexical_index(self, library, engine, created):
+        if not HYBRID_SEARCH:
+            return None
+        from lexical_index import LexicalIndex, fts5_available
+
+        if not fts5_available():
+            sys.stderr.write("[CORE_LOGIC] SQLite sem FTS5: busca hibrida desativada, usando so vetores.\n")
+            return None
+        # Um arquivo por motor: cada motor tem seu próprio manifesto e conjunto de trechos.
+        lexical = LexicalIndex(os.path.join(library.db_path, f"lexico_{engine.name}.sqlite"))
+        if created:
+            lexical.clear()
+        elif lexical.count() != engine.count():
+            # Índice anterior à busca híbrida (ou interrompido no meio): refaz a partir dos vetores gravados.
+            lexical.rebuild(engine)
+        return lexical
+
+    @staticmethod
+    def _to_document(payload):
+        from langchain_core.documents import Document
+        return Document(page_content=payload.get("page_content", ""), metadata=payload.get("metadata") or {})
+
+    def _retrieve(self, library, query, k, vector=None, source=None, vector_hits=None):
+        """
+        Busca híbrida. Devolve (documentos, melhor score vetorial, método):
+        - "lexical": consulta exata (números, datas, "aspas") com acerto de todos os termos-chave no BM25;
+          nenhum embedding é calculado;
+        - "hybrid": vetores e BM25 combinados por reciprocal rank fusion;
+        - "vector": só vetores (busca híbrida desligada ou sem FTS5).
+        """
+        from lexical_index import is_exact_lookup, reciprocal_rank_fusion
+
+        lexical = library.lexical_index
+        if lexical is not None and LEXICAL_FAST_PATH and is_exact_lookup(query):
+            with metrics.span("retrieval.lexical_search", exact=True):
+                hits = lexical.search(query, k, source, exact=True)
+            if hits:
+                sys.stderr.write(f"[CORE_LOGIC] Busca exata resolvida pelo BM25: {len(hits)} trecho(s).\n")
+                return [self._to_document(payload) for _, _, payload in hits], None, "lexical"
+
+        if vector_hits is None:
+            if vector is None:
+                with metrics.span("retrieval.embed_query"):
+                    vector = self.embeddings.embed_query(query)
+            with metrics.span("retrieval.vector_search", engine=library.vector_index.name):
+                vector_hits = library.vector_index.search(vector, self._vector_k(library, k), source)
+        best_score = max((score for _, score, _ in vector_hits), default=0.0)
+        if lexical is None:
+            return [self._to_document(payload) for _, _, payload in vector_hits], best_score, "vector"
+        with metrics.span("retrieval.lexical_search", exact=False):
+            lexical_hits = lexical.search(query, k * 2, source)
+        fused = reciprocal_rank_fusion(
+            [[(cid, payload) for cid, _, payload in vector_hits], [(cid, payload) for cid, _, payload in lexical_hits]],
+            k=RRF_K, limit=k,
+        )
+        return [self._to_document(payload) for _, payload, _ in fused], best_score, "hybrid"
+
+    @staticmethod
+    def _vector_k(library, k):
+        # Com o BM25, cada lista traz o dobro de candidatos para a fusão ter o que reordenar.
+        return k * 2 if library.lexical_index is not None else k
+
+    def _sync_documents(self, library, pdf_files, should_cancel=None, on_progress=None):
+        from tqdm import tqdm
+
+        vector_index, lexical_index, manifest = library.vector_index, library.lexical_index, library.manifest
+        plan = manifest.plan(library.docs_path, pdf_files, rechunk=True)
+        sys.stderr.write(
+            f"[CORE_LOGIC] Sincronizando indice: {len(plan.new)} novo(s), {len(plan.changed)} alterado(s), "
+            f"{len(plan.removed)} removido(s), {len(plan.unchanged)} inalterado(s).\n"
+        )
+
+        def delete(ids):
+            if ids:
+                vector_index.delete(ids)
+                if lexical_index is not None:
+                    lexical_index.delete(ids)
+
+        delete(manifest.chunk_ids_of(plan.removed))
+        for source in plan.removed:
+            manifest.remove(source)
+        # Documentos alterados ficam no índice até serem refeitos: os trechos que não mudaram
+        # (mesmo ID de conteúdo) não passam de novo pelo embedding nem pelo upsert.
+        previous = {}
+        for source, sha256, mtime, size in plan.changed:
+            previous[source] = manifest.chunk_ids_of([source])
+            manifest.begin(source, sha256, mtime, size, previous[source], manifest.payload_digests_of(source))
+        manifest.save()
+
+        pending = {source: (sha256, mtime, size) for source, sha256, mtime, size in plan.to_index}
+        extracted = iter_extracted(
+            library.docs_path, [source for source, _, _, _ in plan.to_index], INGEST_WORKERS, chunking=self._chunking(),
+        )
+        batch = []      # [(source, chunk_id, documento)] aguardando embedding + upsert
+        moved = []      # [(chunk_id, documento)] reaproveitados cujo payload (ex: start_index) mudou
+        current = {}    # source -> {chunk_id: payload_digest} dos trechos da nova versão
+        finished = []   # documentos totalmente extraídos cujos trechos estão em `batch` ou já gravados
+        throughput = {"chunks": 0, "seconds": 0.0, "reused": 0}
+        progress = {
+            "files_done": 0, "files_total": len(pending), "files_failed": 0, "chunks_done": 0,
+            "bytes_done": 0, "bytes_total": sum(size for _, _, size in pending.values()),
+            "current_file": None, "elapsed_seconds": 0.0, "eta_seconds": None,
+        }
+        started = time.perf_counter()
+        last_report = [0.0]
+
+        def report(force=False):
+            # No máximo duas atualizações por segundo para não inundar o canal com a UI.
+            now = time.perf_counter()
+            if not force and now - last_report[0] < 0.5:
+                return
+            last_report[0] = now
+            elapsed = now - started
+            progress["elapsed_seconds"] = round(elapsed, 1)
+            # ETA pelo volume em bytes já concluído: arquivos grandes pesam mais que pequenos.
+            if progress["bytes_done"]:
+                remaining = progress["bytes_total"] - progress["bytes_done"]
+                progress["eta_seconds"] = round(elapsed * remaining / progress["bytes_done"], 1)
+            library.ingest_progress = dict(progress)
+            if on_progress is not None:
+                on_progress(dict(progress))
+
+        def flush():
+            if moved:
+                ids = [cid for cid, _ in moved]
+                payloads = [{"page_content": doc.page_content, "metadata": doc.metadata} for _, doc in moved]
+                vector_index.set_payloads(ids, payloads)
+                if lexical_index is not None:
+                    lexical_index.set_payloads(ids, payloads)
+                moved.clear()
+            if batch:
+                embed_start = time.perf_counter()
+                with metrics.span("ingest.embed", chunks=len(batch)):
+                    vectors = self.embeddings.embed_documents([doc.page_content for _, _, doc in batch])
+                throughput["seconds"] += time.perf_counter() - embed_start
+                throughput["chunks"] += len(batch)
+                progress["chunks_done"] += len(batch)
+                metrics.incr("ingest.chunks", len(batch))
+                ids = [cid for _, cid, _ in batch]
+                payloads = [{"page_content": doc.page_content, "metadata": doc.metadata} for _, _, doc in batch]
+                with metrics.span("ingest.upsert", chunks=len(batch), engine=vector_index.name):
+                    vector_index.upsert(ids, vectors, payloads)
+                if lexical_index is not None:
+                    with metrics.span("ingest.lexical", chunks=len(batch)):
+                        lexical_index.add(ids, payloads)
+                written = {}
+                for source, cid, _ in batch:
+                    written.setdefault(source, []).append(cid)
+                for source, ids in written.items():
+                    manifest.add_chunk_ids(source, ids)
+                batch.clear()
+            for source in finished:
+                # Trechos da versão anterior que não existem mais.
+                kept = current.pop(source)
+                delete([cid for cid in previous.pop(source, ()) if cid not in kept])
+                manifest.set_chunk_ids(source, list(kept), kept)
+                manifest.mark_complete(source)
+                progress["files_done"] += 1
+                progress["bytes_done"] += pending[source][2]
+            finished.clear()
+            # Cada lote gravado fica registrado: uma falha no meio preserva o que já foi indexado.
+            manifest.save()
+            report()
+
+        report(force=True)
+        try:
+            for result in tqdm(extracted, total=len(pending), desc="[CORE_LOGIC] Processando PDFs", file=sys.stderr):
+                _raise_if_cancelled(should_cancel)
+                source, chunks = result["source"], result.pop("chunks")
+                result["chunks"] = len(chunks)
+                plan.report.append(result)
+                progress["current_file"] = source
+                if result["error"]:
+                    # PDF corrompido: não entra no manifesto e será tentado de novo no próximo carregamento.
+                    sys.stderr.write(f"[CORE_LOGIC_ERROR] Falha ao processar {source}: {result['error']}\n")
+                    metrics.incr("ingest.files_failed")
+                    progress["files_failed"] += 1
+                    progress["bytes_done"] += pending[source][2]
+                    delete(manifest.chunk_ids_of([source]))
+                    manifest.remove(source)
+                    continue
+                sys.stderr.write(
+                    f"[CORE_LOGIC] {source}: {result['pages']} pagina(s), {len(chunks)} trecho(s) em {result['seconds']}s.\n"
+                )
+                # Leitura e divisão rodam nos processos de extração: as durações vêm no resultado.
+                metrics.observe("ingest.pdf_load", result["load_seconds"], source=source, pages=result["pages"])
+                metrics.observe("ingest.split", result["split_seconds"], source=source, chunks=len(chunks))
+                metrics.incr("ingest.files")
+                metrics.incr("ingest.pages", result["pages"])
+                if source not in previous:
+                    manifest.begin(source, *pending[source])
+                stored = set(manifest.chunk_ids_of([source]))
+                digests = manifest.payload_digests_of(source)
+                current[source], occurrences = {}, {}
+                for chunk in chunks:
+                    key = (chunk.metadata.get("page"), chunk.page_content)
+                    occurrences[key] = occurrences.get(key, -1) + 1
+                    cid = content_chunk_id(source, chunk, occurrences[key])
+                    digest = current[source][cid] = payload_digest(chunk)
+                    if cid in stored:
+                        # Mesmo texto na mesma página: sem embedding nem upsert, no máximo o payload.
+                        throughput["reused"] += 1
+                        metrics.incr("ingest.chunks_reused")
+                        if digests.get(cid) != digest:
+                            moved.append((cid, chunk))
+                        continue
+                    batch.append((source, cid, chunk))
+                    if len(batch) >= INGEST_BATCH_SIZE:
+                        flush()
+                        _raise_if_cancelled(should_cancel)
+                finished.append(source)
+                del chunks
+            flush()
+            progress["current_file"] = None
+            report(force=True)
+        finally:
+            # Os processos do pool de embeddings só existem durante a indexação (também se cancelada).
+            # Sem esperar o aquecimento: se o modelo ainda não carregou, não há pool a liberar,
+            # e uma falha de carga não encobre o erro da própria indexação.
+            embeddings = self._embeddings
+            pool = embeddings.underlying if embeddings is not None else None
+            if hasattr(pool, "release"):
+                pool.release()
+        if plan.to_index:
+            stats = self.embeddings.stats()
+            sys.stderr.write(
+                f"[CORE_LOGIC] Cache de embeddings: {stats['hits']} acerto(s), {stats['misses']} falha(s), "
+                f"{stats['entries']} vetor(es) armazenado(s).\n"
+            )
+            # Vazão de ponta a ponta do embedding (inclui acertos do cache); a do pool conta só o que foi codificado.
+            chunks, seconds = throughput["chunks"], throughput["seconds"]
+            library.ingest_stats = {
+                "chunks": chunks,
+                "embed_seconds": round(seconds, 2),
+                "chunks_per_second": round(chunks / seconds, 1) if seconds else 0.0,
+                "chunks_reused": throughput["reused"],  # trechos de documentos alterados mantidos no índice
+            }
+            if hasattr(pool, "stats"):
+                library.ingest_stats["pool"] = pool.stats()
+            sys.stderr.write(
+                f"[CORE_LOGIC] Embeddings: {chunks} trecho(s) em {seconds:.1f}s "
+                f"({library.ingest_stats['chunks_per_second']} trechos/s).\n"
+            )
+        return plan
+
+    def ask_question(self, question: str, should_cancel=None, on_token=None, mode=None, library=None, session=None) -> dict:
+        """
+        Responde uma pergunta com o agente (mode="agent") ou com RAG direto (mode="direct").
+        Com `on_token`, cada pedaço da resposta é entregue assim que o LLM o gera;
+        o retorno final traz o texto completo e as fontes. `library` escolhe a
+        biblioteca consultada (None = "default"), aberta sob demanda; `session`, a
+        memória da conversa (None = a sessão local do Electron).
+        """
         if not self.is_initialized():
             log_message("ERRO: Tentativa de pergunta com agente nao inicializado.")
             return {"error": "O agente nao esta pronto. Por favor, carregue os documentos primeiro."}
         try:
-            response = self.agent_executor.invoke({"input": question})
-            return {"answer": response.get("output", "").strip()}
+            with self.libraries.use(library) as library:
+                if not self._open_library(library):
+                    return {"error": f"A biblioteca '{library.name}' nao tem documentos indexados. Carregue os documentos primeiro."}
+                return self._ask_library(library, self._session_memory(session), question, should_cancel, on_token, mode)
+        except ValueError as e:
+            # Nome de biblioteca inválido.
+            return {"error": str(e)}
+
+    def _ask_library(self, library, memory, question, should_cancel, on_token, mode):
+        _request_state.sources = []
+        _request_state.library = library
+        try:
+            start = time.perf_counter()
+            mode = mode or ANSWER_MODE
+            # Índice em construção (ou interrompido): a resposta sai do que já foi indexado e
+            # não passa pelo cache, cuja versão do corpus só vale para o índice completo.
+            partial = library.index_status != INDEX_READY
+            answer_cache = None if partial else library.answer_cache
+            # O cache é chaveado só pela pergunta: com histórico, a mesma frase ("e o segundo?")
+            # depende da conversa, então a pergunta não é consultada nem gravada no cache.
+            if answer_cache is not None and memory.load_memory_variables({})["chat_history"]:
+                answer_cache = None
+            question_vector = None
+            # Sem cache de respostas, o modo direto só calcula o embedding se a busca exata (BM25) não resolver.
+            if answer_cache is not None:
+                with metrics.span("question.embed_query"):
+                    question_vector = self.embeddings.embed_query(question)
+                _request_state.question_vector = (question.strip(), question_vector)
+                with metrics.span("answer_cache.lookup"):
+                    cached = answer_cache.lookup(question_vector)
+                metrics.incr("answer_cache.hits" if cached is not None else "answer_cache.misses")
+                if cached is not None:
+                    # Mantém a conversa coerente: a troca entra na memória como se o agente tivesse respondido.
+                    memory.save_context({"input": question}, {"output": cached["answer"]})
+                    if on_token is not None:
+                        on_token(cached["answer"])
+                    latency = time.perf_counter() - start
+                    metrics.observe("question", latency, mode=mode, cached=True)
+                    return {
+                        "answer": cached["answer"],
+                        "sources": cached["sources"],
+                        "cached": True,
+                        "partial_index": False,
+                        "library": library.name,
+                        "similarity": cached["similarity"],
+                        "latency_saved": round(max(cached["original_latency"] - latency, 0.0), 3),
+                    }
+
+            usage = _usage_callback(self.llm)
+            callbacks = [usage]
+            if should_cancel or on_token:
+                callbacks.append(_request_callback(should_cancel, on_token))
+            result = {"mode": mode, "partial_index": partial, "library": library.name}
+            if mode == "direct":
+                answer, result["route"] = self._answer_direct(library, memory, question, question_vector, callbacks)
+            else:
+                history = memory.load_memory_variables({})["chat_history"]
+                response = self.agent_executor.invoke({"input": question, "chat_history": history}, config={"callbacks": callbacks})
+                answer = response.get("output", "").strip()
+                memory.save_context({"input": question}, {"output": answer})
+            if answer_cache is not None and answer:
+                answer_cache.store(question, question_vector, answer, _request_state.sources, time.perf_counter() - start)
+            result.update({"answer": answer, "sources": _request_state.sources, "cached": False})
+            result["usage"] = usage.report()
+            result["usage"]["history_tokens"] = self._history_tokens(memory)
+            metrics.observe("question", time.perf_counter() - start, mode=mode, cached=False)
+            sys.stderr.write(
+                f"[CORE_LOGIC] Tokens: {result['usage']['prompt_tokens']} de entrada, "
+                f"{result['usage']['completion_tokens']} de saida em {result['usage']['llm_calls']} chamada(s).\n"
+            )
+            return result
+        except OperationCancelled:
+            metrics.incr("question.cancelled")
+            return {"error": "Pergunta cancelada.", "cancelled": True}
         except Exception as e:
-            sys.stderr.write(f"[CORE_LOGIC_ERROR] Erro ao invocar o agente: {e}\n{traceback.format_exc()}\n")
-            if "authentication" in str(e).lower():
-                return {"error": "Chave da API da OpenAI inválida ou expirada."}
-            return {"error": "Ocorreu um erro ao processar sua pergunta."}
+            return self._question_error(e)
+        finally:
+            _request_state.sources = None
+            _request_state.library = None
+            _request_state.question_vector = None
+
+    def _question_error(self, e):
+        metrics.incr("question.errors")
+        sys.stderr.write(f"[CORE_LOGIC_ERROR] Erro ao invocar o agente: {e}\n{traceback.format_exc()}\n")
+        if "authentication" in str(e).lower():
+            # Chave revogada depois de validada: a próxima validação volta a consultar a API.
+            if self._api_key and not FAKE_LLM:
+                llm_clients().forget_key(self._api_key)
+            return {"error": "Chave da API da OpenAI inválida ou expirada."}
+        return {"error": "Ocorreu um erro ao processar sua pergunta."}
+
+    def ask_batch(self, questions, should_cancel=None, on_result=None, library=None, concurrency=None) -> dict:
+        """
+        Responde uma lista de perguntas independentes (sem memória de conversa), em RAG direto:
+        os embeddings de todas saem de uma única codificação, a busca vetorial é feita em lote
+        e as chamadas ao LLM rodam em paralelo, no máximo `concurrency` (padrão IL_BATCH_CONCURRENCY)
+        de cada vez. `on_result` recebe cada resposta, com latência e tokens, assim que fica pronta;
+        o retorno traz todas, na ordem das perguntas, e os totais do lote.
+        """
+        if not self.is_initialized():
+            return {"error": "O agente nao esta pronto. Por favor, carregue os documentos primeiro."}
+        try:
+            with self.libraries.use(library) as library:
+                if not self._open_library(library):
+                    return {"error": f"A biblioteca '{library.name}' nao tem documentos indexados. Carregue os documentos primeiro."}
+                return self._ask_batch(library, questions, should_cancel, on_result, max(1, concurrency or BATCH_CONCURRENCY))
+        except ValueError as e:
+            return {"error": str(e)}
+
+    def _ask_batch(self, library, questions, should_cancel, on_result, concurrency):
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        start = time.perf_counter()
+        partial = library.index_status != INDEX_READY
+        answer_cache = None if partial else library.answer_cache
+        results = [None] * len(questions)
+
+        def finish(index, item):
+            item.update({"index": index, "question": questions[index]})
+            item["completed_at_seconds"] = round(time.perf_counter() - start, 3)
+            results[index] = item
+            if on_result is not None:
+                on_result(item)
+
+        with metrics.span("batch.embed_queries", questions=len(questions)):
+            vectors = self.embeddings.embed_documents(questions) if questions else []
+        embed_seconds = time.perf_counter() - start
+        pending = []
+        for i, vector in enumerate(vectors):
+            cached = answer_cache.lookup(vector) if answer_cache is not None else None
+            if cached is None:
+                pending.append(i)
+                continue
+            metrics.incr("answer_cache.hits")
+            finish(i, {
+                "answer": cached["answer"], "sources": cached["sources"], "cached": True,
+                "similarity": cached["similarity"], "latency_seconds": 0.0,
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "llm_calls": 0},
+            })
+        if answer_cache is not None:
+            metrics.incr("answer_cache.misses", len(pending))
+
+        search_start = time.perf_counter()
+        with metrics.span("batch.vector_search", questions=len(pending), engine=library.vector_index.name):
+            hits = library.vector_index.search_batch(
+                [vectors[i] for i in pending], self._vector_k(library, self._context_k()),
+            )
+        search_seconds = time.perf_counter() - search_start
+        # A codificação e a busca em lote entram na latência de cada pergunta pela sua parte.
+        shared_seconds = (embed_seconds + search_seconds) / len(pending) if pending else 0.0
+
+        def answer(i, vector_hits):
+            item_start = time.perf_counter()
+            _request_state.sources = []
+            _request_state.library = library
+            usage = _usage_callback(self.llm)
+            callbacks = [usage]
+            if should_cancel:
+                callbacks.append(_request_callback(should_cancel))
+            try:
+                _raise_if_cancelled(should_cancel)
+                docs, best_score, method = self._retrieve_context(library, questions[i], vectors[i], vector_hits=vector_hits)
+                messages, route = self._direct_messages([], questions[i], docs, best_score, method)
+                text = self.llm.invoke(messages, config={"callbacks": callbacks}).content.strip()
+                item = {"answer": text, "sources": _request_state.sources, "cached": False, "route": route, "method": method}
+            except OperationCancelled:
+                item = {"error": "Pergunta cancelada.", "cancelled": True}
+            except Exception as e:
+                item = self._question_error(e)
+            finally:
+                _request_state.sources = None
+                _request_state.library = None
+            latency = time.perf_counter() - item_start + shared_seconds
+            item["latency_seconds"] = round(latency, 3)
+            item["usage"] = usage.report()
+            if "error" not in item:
+                metrics.observe("question", latency, mode="batch", cached=False)
+            return item
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="lote") as executor:
+            futures = {executor.submit(answer, i, vector_hits): i for i, vector_hits in zip(pending, hits)}
+            for future in as_completed(futures):
+                i, item = futures[future], future.result()
+                if answer_cache is not None and item.get("answer"):
+                    answer_cache.store(questions[i], vectors[i], item["answer"], item["sources"], item["latency_seconds"])
+                finish(i, item)
+
+        seconds = time.perf_counter() - start
+        usage = {
+            key: sum(item["usage"][key] for item in results)
+            for key in ("prompt_tokens", "completion_tokens", "llm_calls")
+        }
+        latencies = [item["latency_seconds"] for item in results if not item.get("cached") and "error" not in item]
+        metrics.observe("batch", seconds, questions=len(questions))
+        sys.stderr.write(
+            f"[CORE_LOGIC] Lote de {len(questions)} pergunta(s) em {seconds:.1f}s: "
+            f"{usage['prompt_tokens']} tokens de entrada, {usage['completion_tokens']} de saida.\n"
+        )
+        return {
+            "library": library.name,
+            "partial_index": partial,
+            "questions": len(questions),
+            "answered": sum(1 for item in results if "error" not in item),
+            "cached": sum(1 for item in results if item.get("cached")),
+            "errors": sum(1 for item in results if "error" in item),
+            "cancelled": any(item.get("cancelled") for item in results),
+            "concurrency": concurrency,
+            "seconds": round(seconds, 3),
+            "questions_per_second": round(len(questions) / seconds, 2) if seconds else None,
+            "embed_seconds": round(embed_seconds, 4),
+            "search_seconds": round(search_seconds, 4),
+            "latency_seconds": {
+                "avg": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                "max": max(latencies, default=None),
+            },
+            "usage": usage,
+            "results": results,
+        }
 
 setup_logging()
+metrics.configure_trace(os.environ.get("IL_TRACE_FILE"))
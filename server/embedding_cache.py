@@ -0,0 +1,126 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+# Limite de variáveis por consulta do SQLite (o padrão antigo é 999).
+_SQL_BATCH = 500
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Cache persistente de embeddings por trecho, chaveado por (modelo, hash do texto).
+    Os vetores ficam em SQLite como float32 compacto; ao passar de `max_entries`
+    os registros menos usados recentemente são descartados.
+    """
+
+    def __init__(self, underlying, model_name, db_path, max_entries=200_000):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, key BLOB NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, key)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _lookup(self, keys):
+        found = {}
+        now = time.time()
+        for start in range(0, len(keys), _SQL_BATCH):
+            batch = keys[start:start + _SQL_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({placeholders})",
+                [self.model_name, *batch],
+            ).fetchall()
+            for key, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[key] = vector.tolist()
+            if rows:
+                self._conn.execute(
+                    f"UPDATE embeddings SET last_used = ? WHERE model = ? AND key IN ({','.join('?' * len(rows))})",
+                    [now, self.model_name, *[key for key, _ in rows]],
+                )
+        return found
+
+    def _store(self, items):
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, key, vector, last_used) VALUES (?, ?, ?, ?)",
+            [(self.model_name, key, array("f", vector).tobytes(), now) for key, vector in items],
+        )
+        self._count += len(items)
+        if self._count > self.max_entries:
+            self._evict()
+
+    def _evict(self):
+        # Remove 10% além do limite para não despejar a cada inserção.
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._count - int(self.max_entries * 0.9)
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE (model, key) IN "
+                "(SELECT model, key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self._count -= excess
+
+    def embed_documents(self, texts):
+        keys = [text_key(text) for text in texts]
+        with self._lock:
+            cached = self._lookup(list(set(keys)))
+            self._conn.commit()
+
+        # Textos repetidos dentro do mesmo lote são codificados uma única vez.
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            with self._lock:
+                self._store(list(computed.items()))
+                self._conn.commit()
+            cached.update(computed)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": self._count,
+                "max_entries": self.max_entries,
+            }
@@ -0,0 +1,125 @@
+import os
+import sys
+import math
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+# Modelo carregado uma única vez em cada processo do pool (pelo initializer).
+_worker_model = None
+
+
+def _init_worker(model_name, cache_folder, threads):
+    global _worker_model
+    # Limita as threads de cada processo antes de importar o torch: sem isso,
+    # N processos x N threads disputam os mesmos núcleos.
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, cache_folder=cache_folder, device="cpu")
+
+
+def _encode_batch(texts, batch_size):
+    # Mesmo pré-processamento do SentenceTransformerEmbeddings (quebras de linha viram espaço),
+    # para que os vetores do pool sejam idênticos aos da codificação local.
+    texts = [text.replace("\n", " ") for text in texts]
+    return _worker_model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True).tolist()
+
+
+def resolve_pool_size(workers, threads):
+    """
+    workers <= 0: um processo para cada `threads` núcleos. threads <= 0: núcleos divididos entre os processos.
+    """
+    cores = os.cpu_count() or 1
+    if workers <= 0:
+        workers = max(1, cores // max(1, threads)) if threads > 0 else max(1, cores // 2)
+    if threads <= 0:
+        threads = max(1, cores // workers)
+    return workers, threads
+
+
+class PooledEmbeddings(Embeddings):
+    """
+    Embeddings de documentos num pool de processos, cada um com sua cópia do modelo.
+    Consultas (um texto) continuam no modelo local, que já está carregado e responde sem ida e volta.
+    O pool só sobe na primeira indexação e é liberado com `release()` ao fim dela.
+    """
+
+    def __init__(self, local, model_name, cache_folder=None, workers=0, batch_size=64, threads=0):
+        self.local = local
+        self.model_name = model_name
+        self.cache_folder = cache_folder
+        self.workers, self.threads = resolve_pool_size(workers, threads)
+        self.batch_size = batch_size
+        self._executor = None
+        self._lock = threading.Lock()
+        self.chunks = 0
+        self.seconds = 0.0
+        self.startup_seconds = 0.0
+
+    def _pool(self):
+        if self._executor is None:
+            start = time.perf_counter()
+            # spawn: um fork de um processo com torch já carregado pode travar nas threads do OpenMP.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_name, self.cache_folder, self.threads),
+            )
+            # Força o carregamento do modelo em todos os processos antes de medir a vazão.
+            list(self._executor.map(_encode_batch, [["aquecimento"]] * self.workers, [1] * self.workers))
+            self.startup_seconds = time.perf_counter() - start
+            sys.stderr.write(
+                f"[CORE_LOGIC] Pool de embeddings: {self.workers} processo(s) x {self.threads} thread(s), "
+                f"pronto em {self.startup_seconds:.1f}s.\n"
+            )
+        return self._executor
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        if self.workers == 1 or len(texts) <= self.batch_size // 2:
+            # Lotes pequenos não compensam a serialização entre processos.
+            return self.local.embed_documents(texts)
+        with self._lock:
+            executor = self._pool()
+            start = time.perf_counter()
+            # Divide igualmente entre os processos, sem passar de batch_size por tarefa.
+            size = min(self.batch_size, math.ceil(len(texts) / self.workers))
+            parts = [texts[i:i + size] for i in range(0, len(texts), size)]
+            vectors = []
+            for part in executor.map(_encode_batch, parts, [self.batch_size] * len(parts)):
+                vectors.extend(part)
+            self.seconds += time.perf_counter() - start
+            self.chunks += len(texts)
+        return vectors
+
+    def embed_query(self, text):
+        return self.local.embed_query(text)
+
+    def release(self):
+        """
+        Encerra os processos (e a memória dos modelos) quando a indexação termina.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "threads_per_worker": self.threads,
+            "batch_size": self.batch_size,
+            "chunks": self.chunks,
+            "seconds": round(self.seconds, 2),
+            "chunks_per_second": round(self.chunks / self.seconds, 1) if self.seconds else 0.0,
+            "startup_seconds": round(self.startup_seconds, 2),
+        }
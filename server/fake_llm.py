@@ -0,0 +1,66 @@
+import re
+import json
+import time
+import hashlib
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_PIECE_RE = re.compile(r"\S+\s*")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    LLM local e determinístico para benchmarks (IL_FAKE_LLM=1): nenhuma chamada à OpenAI.
+    Com ferramentas (modo agente), a primeira chamada pede a busca nos documentos com
+    a pergunta do usuário; as demais respondem com o começo do contexto recebido.
+    `latency_ms` simula o tempo de resposta da API.
+    """
+
+    latency_ms: float = 0.0
+    answer_chars: int = 400
+
+    @property
+    def _llm_type(self):
+        return "fake-intelligent-library"
+
+    def get_num_tokens(self, text):
+        return max(1, len(text) // 4)
+
+    def get_num_tokens_from_messages(self, messages, *args, **kwargs):
+        return sum(self.get_num_tokens(str(m.content)) for m in messages)
+
+    def _answer(self, messages):
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            context = last.content
+        else:
+            # Modo direto: o contexto vem no prompt de sistema; conversa/resumo: a própria mensagem.
+            system = [m.content for m in messages if isinstance(m, SystemMessage)]
+            context = system[0] if system else last.content
+        context = _WHITESPACE_RE.sub(" ", str(context)).strip()
+        return f"Resposta simulada ({len(context)} caracteres de contexto): {context[:self.answer_chars]}"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        tools = kwargs.get("tools") or []
+        last = messages[-1]
+        if tools and isinstance(last, HumanMessage):
+            query = str(last.content)
+            call = {
+                "id": "call_" + hashlib.sha1(query.encode("utf-8")).hexdigest()[:12],
+                "type": "function",
+                "function": {"name": tools[0]["function"]["name"], "arguments": json.dumps({"__arg1": query})},
+            }
+            message = AIMessage(content="", additional_kwargs={"tool_calls": [call]})
+        else:
+            text = self._answer(messages)
+            if run_manager is not None:
+                # Entrega a resposta em pedaços, como o streaming da API, para exercitar o caminho de tokens.
+                for piece in _PIECE_RE.findall(text):
+                    run_manager.on_llm_new_token(piece)
+            message = AIMessage(content=text)
+        return ChatResult(generations=[ChatGeneration(message=message)])
@@ -0,0 +1,362 @@
+import os
+import re
+import sys
+import json
+import uuid
+import asyncio
+import secrets
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web, WSMsgType
+
+import app_consolidado as app
+
+# Servidor de longa duração: as mesmas ações do ACTION_MAP do modo stdin/stdout,
+# por HTTP (POST /acao) e WebSocket (/ws), com um único modelo de embeddings e os
+# mesmos índices para todos os clientes. Cada cliente tem sua sessão (memória de conversa).
+HTTP_HOST = os.environ.get("IL_HTTP_HOST", "127.0.0.1")
+HTTP_PORT = int(os.environ.get("IL_HTTP_PORT", "8000"))
+HTTP_WORKERS = int(os.environ.get("IL_HTTP_WORKERS", "8"))  # ações executando ao mesmo tempo
+HTTP_MAX_QUEUE = int(os.environ.get("IL_HTTP_MAX_QUEUE", "32"))  # ações aguardando vaga; acima disso, 503
+HTTP_MAX_PER_SESSION = int(os.environ.get("IL_HTTP_MAX_PER_SESSION", "4"))  # ações simultâneas por sessão
+HTTP_TOKEN = os.environ.get("IL_HTTP_TOKEN") or None  # se definido, exigido em Authorization: Bearer
+# Pasta do servidor de onde carregar_documentos copia PDFs; sem ela, a ação fica indisponível.
+HTTP_IMPORT_DIR = os.environ.get("IL_HTTP_IMPORT_DIR") or None
+HTTP_ALLOW_REPLACE = os.environ.get("IL_HTTP_ALLOW_REPLACE", "0") == "1"  # permite substituir=true
+
+# Só fazem sentido com o Electron local: o diálogo de arquivos abre na máquina do backend,
+# e a chave salva em ~/.IntelligentLibrary/.env é a do servidor, não a de um cliente remoto.
+ACOES_BLOQUEADAS = {"select_pdf_files", "salvar_e_validar_chave"}
+
+_SESSAO_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_FIM = object()
+
+
+def log_message(message):
+    sys.stderr.write(f"[HTTP_SERVER] {message}\n")
+    sys.stderr.flush()
+
+
+class Ocupado(Exception):
+    """O servidor (ou a sessão) já está com todas as vagas ocupadas."""
+
+
+class Despachante:
+    """
+    Pool de ações com controle de carga. Até `workers` ações rodam ao mesmo tempo
+    e até `max_queue` esperam vaga; além disso a requisição é recusada na hora
+    (HTTP 503 / mensagem "busy"), em vez de acumular uma fila sem fim.
+    """
+
+    def __init__(self, workers, max_queue, max_per_session):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http-acao")
+        self.capacity = workers + max_queue
+        self.max_per_session = max_per_session
+        self.pending = 0
+        self.rejected = 0
+        self._por_sessao = {}  # sessão -> ações pendentes; só alterado na thread do event loop
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "capacity": self.capacity,
+            "rejected": self.rejected,
+            "sessions_active": len(self._por_sessao),
+        }
+
+    async def executar(self, request, sessao, destino):
+        """
+        Executa a ação e espera seu fim. As respostas (deltas, progresso e a final)
+        vão para `destino`, chamado a partir de qualquer thread.
+        """
+        loop = asyncio.get_running_loop()
+        if request.get("action") in app.INLINE_ACTIONS:
+            # Ações rápidas não disputam vaga, mas também não rodam na thread do event loop.
+            await loop.run_in_executor(None, app.despachar, self.executor, request, destino, sessao)
+            return
+        if self.pending >= self.capacity or self._por_sessao.get(sessao, 0) >= self.max_per_session:
+            self.rejected += 1
+            raise Ocupado()
+        self.pending += 1
+        self._por_sessao[sessao] = self._por_sessao.get(sessao, 0) + 1
+        try:
+            future = app.despachar(self.executor, request, destino, sessao)
+            if future is not None:
+                try:
+                    await asyncio.wrap_future(future)
+                except asyncio.CancelledError:
+                    if future.cancelled():
+                        destino({"status": "cancelled", "action": request.get("action"), "request_id": request.get("request_id")})
+                    else:
+                        raise
+        finally:
+            self.pending -= 1
+            restantes = self._por_sessao[sessao] - 1
+            if restantes:
+                self._por_sessao[sessao] = restantes
+            else:
+                del self._por_sessao[sessao]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _cancelar(request_ids):
+    # Cliente desconectado: as ações dele param no próximo ponto de verificação.
+    for request_id in request_ids:
+        with app._em_andamento_lock:
+            em_andamento = app._em_andamento.get(request_id)
+        if em_andamento is not None:
+            future, evento, _ = em_andamento
+            evento.set()
+            future.cancel()
+
+
+def _validar_importacao(data):
+    """
+    carregar_documentos vindo de um cliente remoto: só PDFs dentro de IL_HTTP_IMPORT_DIR
+    (caminhos relativos partem dela) e, sem IL_HTTP_ALLOW_REPLACE, sem apagar a biblioteca.
+    A chave da API é sempre a do servidor: um cliente não troca o LLM (nem a cobrança)
+    de todos os outros.
+    """
+    if HTTP_IMPORT_DIR is None:
+        raise ValueError("carregar_documentos indisponivel no modo servidor: defina IL_HTTP_IMPORT_DIR.")
+    chave = app.load_saved_api_key()
+    if not chave:
+        raise ValueError("O servidor nao tem chave da API configurada (OPENAI_API_KEY).")
+    enviada = data.get("apiKey")
+    if enviada and (not isinstance(enviada, str) or enviada.strip() != chave):
+        raise ValueError("apiKey diferente da chave configurada no servidor; omita o campo.")
+    raiz = os.path.realpath(HTTP_IMPORT_DIR)
+    caminhos = data.get("filePaths") or []
+    if not isinstance(caminhos, list) or not all(isinstance(caminho, str) for caminho in caminhos):
+        raise ValueError("Envie 'filePaths' como uma lista de caminhos.")
+    permitidos = []
+    for caminho in caminhos:
+        real = os.path.realpath(os.path.join(raiz, caminho))
+        if os.path.commonpath([raiz, real]) != raiz or not real.lower().endswith(".pdf"):
+            raise ValueError(f"Arquivo fora de IL_HTTP_IMPORT_DIR ou que nao e PDF: {caminho}")
+        permitidos.append(real)
+    substituir = bool(data.get("substituir", False))
+    if substituir and not HTTP_ALLOW_REPLACE:
+        raise ValueError("substituir=true desativado no modo servidor (IL_HTTP_ALLOW_REPLACE=1 para permitir).")
+    return {**data, "filePaths": permitidos, "substituir": substituir, "apiKey": chave}
+
+
+def _preparar(mensagem, sessao):
+    """
+    Valida a mensagem do cliente e troca o request_id por um interno com o prefixo
+    da sessão: IDs de clientes diferentes não colidem e cada sessão só cancela
+    as próprias requisições. Devolve (requisição, request_id do cliente).
+    """
+    if not isinstance(mensagem, dict):
+        raise ValueError("A requisicao deve ser um objeto JSON.")
+    action = mensagem.get("action")
+    if action in ACOES_BLOQUEADAS:
+        raise ValueError(f"Acao indisponivel no modo servidor: {action}")
+    request_id = mensagem.get("request_id", mensagem.get("requestId"))
+    if request_id is None:
+        request_id = uuid.uuid4().hex
+    request = {**mensagem, "request_id": f"{sessao}:{request_id}"}
+    request.pop("requestId", None)
+    if action == "cancelar_requisicao":
+        data = dict(request.get("data") or {})
+        data["request_id"] = f"{sessao}:{data.get('request_id')}"
+        request["data"] = data
+    elif action == "carregar_documentos":
+        request["data"] = _validar_importacao(dict(request.get("data") or {}))
+    return request, request_id
+
+
+def _destino(loop, fila, sessao):
+    prefixo = f"{sessao}:"
+
+    def enviar(data):
+        request_id = data.get("request_id")
+        if isinstance(request_id, str) and request_id.startswith(prefixo):
+            data = {**data, "request_id": request_id[len(prefixo):]}
+        loop.call_soon_threadsafe(fila.put_nowait, data)
+
+    return enviar
+
+
+def _resposta_ocupado(request_id):
+    return {
+        "status": "error", "busy": True, "request_id": request_id,
+        "message": "Servidor ocupado: todas as vagas de processamento estao em uso. Tente novamente em instantes.",
+    }
+
+
+def _sessao(request):
+    sessao = request.headers.get("X-Session-Id") or request.query.get("sessao")
+    if sessao is None:
+        return uuid.uuid4().hex
+    if not _SESSAO_RE.match(sessao):
+        raise web.HTTPBadRequest(text="Identificador de sessao invalido.")
+    return sessao
+
+
+@web.middleware
+async def autenticacao(request, handler):
+    if HTTP_TOKEN is not None:
+        # Navegadores não enviam cabeçalhos no handshake do WebSocket: aceita também ?token=.
+        enviado = request.headers.get("Authorization", "").removeprefix("Bearer ").strip() or request.query.get("token", "")
+        if not secrets.compare_digest(enviado, HTTP_TOKEN):
+            raise web.HTTPUnauthorized(text="Token de acesso invalido.")
+    return await handler(request)
+
+
+async def saude(request):
+    manager = app.agent_manager
+    resultado = {"despachante": request.app["despachante"].stats()}
+    if manager is not None:
+        # status() percorre as pastas das bibliotecas e lê manifestos: fora do event loop.
+        resultado.update(await asyncio.get_running_loop().run_in_executor(None, manager.status))
+    return web.json_response(resultado)
+
+
+async def acao(request):
+    """
+    POST /acao com a mesma mensagem do modo stdin/stdout ({"action", "data", "request_id"}).
+    Sem streaming, devolve a resposta final em JSON; com data.stream (ou ?stream=1),
+    devolve NDJSON com os deltas e eventos de progresso seguidos da resposta final.
+    """
+    sessao = _sessao(request)
+    try:
+        mensagem = await request.json()
+        pedido, request_id = _preparar(mensagem, sessao)
+    except (json.JSONDecodeError, ValueError) as e:
+        return web.json_response({"status": "error", "message": str(e)}, status=400)
+    cabecalhos = {"X-Session-Id": sessao}
+    streaming = request.query.get("stream") == "1" or bool((pedido.get("data") or {}).get("stream"))
+
+    loop = asyncio.get_running_loop()
+    fila = asyncio.Queue()
+    despachante = request.app["despachante"]
+    tarefa = asyncio.ensure_future(despachante.executar(pedido, sessao, _destino(loop, fila, sessao)))
+    # O fim da ação entra na fila depois de todas as respostas que ela já enviou.
+    tarefa.add_done_callback(lambda _: loop.call_soon(fila.put_nowait, _FIM))
+
+    resposta = None
+    try:
+        if streaming:
+            primeira = await fila.get()
+            if primeira is _FIM:
+                tarefa.result()  # propaga Ocupado
+                return web.json_response({"status": "error", "message": "Acao sem resposta.", "request_id": request_id}, status=500, headers=cabecalhos)
+            resposta = web.StreamResponse(headers={**cabecalhos, "Content-Type": "application/x-ndjson"})
+            await resposta.prepare(request)
+            data = primeira
+            while data is not _FIM:
+                await resposta.write((json.dumps(data) + "\n").encode("utf-8"))
+                data = await fila.get()
+            await resposta.write_eof()
+            return resposta
+        final = None
+        while (data := await fila.get()) is not _FIM:
+            # Deltas, itens de lote e eventos de progresso só interessam no streaming.
+            if "delta" not in data and "item" not in data and data.get("action") != "progresso_indexacao":
+                final = data
+        tarefa.result()
+        if final is None:
+            final = {"status": "error", "message": "Acao sem resposta.", "request_id": request_id}
+        return web.json_response(final, headers=cabecalhos)
+    except Ocupado:
+        return web.json_response(_resposta_ocupado(request_id), status=503, headers={**cabecalhos, "Retry-After": "1"})
+    except (asyncio.CancelledError, ConnectionResetError):
+        _cancelar([pedido["request_id"]])
+        raise
+
+
+async def websocket(request):
+    """
+    /ws: uma sessão por conexão (ou a indicada em ?sessao=, para retomar a conversa).
+    Cada mensagem de texto é uma requisição do protocolo; as respostas, inclusive
+    deltas de streaming e progresso da indexação, chegam como mensagens JSON.
+    """
+    sessao = _sessao(request)
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    despachante = request.app["despachante"]
+    loop = asyncio.get_running_loop()
+    fila = asyncio.Queue()
+    enviar = _destino(loop, fila, sessao)
+    tarefas = {}  # request_id interno -> tarefa
+
+    async def escritor():
+        while (data := await fila.get()) is not _FIM:
+            if ws.closed:
+                continue
+            try:
+                await ws.send_json(data)
+            except ConnectionResetError:
+                pass  # o cliente caiu; as ações dele são canceladas ao sair do laço de leitura
+
+    async def executar(pedido, request_id):
+        try:
+            await despachante.executar(pedido, sessao, enviar)
+        except Ocupado:
+            enviar(_resposta_ocupado(request_id))
+        finally:
+            tarefas.pop(pedido["request_id"], None)
+
+    escrita = asyncio.ensure_future(escritor())
+    enviar({"status": "success", "action": "sessao", "result": {"sessao": sessao}})
+    try:
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            try:
+                mensagem = json.loads(msg.data)
+                if isinstance(mensagem, dict) and mensagem.get("action") == "encerrar_sessao":
+                    # Descarta a memória da conversa desta sessão.
+                    encerrada = app.agent_manager.end_session(sessao) if app.agent_manager else False
+                    enviar({"status": "success", "action": "encerrar_sessao", "result": {"success": encerrada}})
+                    continue
+                pedido, request_id = _preparar(mensagem, sessao)
+            except (json.JSONDecodeError, ValueError) as e:
+                enviar({"status": "error", "message": str(e)})
+                continue
+            tarefas[pedido["request_id"]] = asyncio.ensure_future(executar(pedido, request_id))
+    finally:
+        _cancelar(list(tarefas))
+        fila.put_nowait(_FIM)
+        await escrita
+    return ws
+
+
+def criar_app(workers=HTTP_WORKERS, max_queue=HTTP_MAX_QUEUE, max_per_session=HTTP_MAX_PER_SESSION):
+    aplicacao = web.Application(middlewares=[autenticacao])
+    aplicacao["despachante"] = Despachante(workers, max_queue, max_per_session)
+    aplicacao.router.add_get("/saude", saude)
+    aplicacao.router.add_post("/acao", acao)
+    aplicacao.router.add_get("/ws", websocket)
+
+    async def encerrar(aplicacao):
+        aplicacao["despachante"].shutdown()
+
+    aplicacao.on_shutdown.append(encerrar)
+    return aplicacao
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Intelligent Library em modo servidor (HTTP + WebSocket).")
+    parser.add_argument("--host", default=HTTP_HOST)
+    parser.add_argument("--port", type=int, default=HTTP_PORT)
+    parser.add_argument("--workers", type=int, default=HTTP_WORKERS)
+    parser.add_argument("--max-queue", type=int, default=HTTP_MAX_QUEUE)
+    args = parser.parse_args()
+
+    # Modelo e índices carregados uma única vez, compartilhados por todas as sessões.
+    app.iniciar_backend()
+    log_message(f"Servindo em http://{args.host}:{args.port} ({args.workers} worker(s), fila de {args.max_queue}).")
+    if HTTP_TOKEN is None and args.host not in ("127.0.0.1", "localhost", "::1"):
+        log_message("AVISO: servidor exposto na rede sem IL_HTTP_TOKEN.")
+    web.run_app(criar_app(args.workers, args.max_queue), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
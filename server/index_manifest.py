@@ -0,0 +1,217 @@
+import os
+import json
+import uuid
+import hashlib
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+# Manifestos sem o campo "chunker" vieram do splitter por caracteres.
+LEGACY_CHUNKER = "chars:1000:200"
+
+# Namespace fixo: o mesmo documento/trecho gera sempre o mesmo ID de ponto no Qdrant.
+CHUNK_ID_NAMESPACE = uuid.UUID("5b1f6d1e-8c7a-4f8e-9a51-0c2d6e9b7a11")
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    """
+    Calcula o hash SHA-256 do conteúdo de um arquivo, lendo em blocos.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(source, content_hash, index):
+    """
+    Gera um ID determinístico (UUID) para o trecho `index` de um documento.
+    """
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{source}:{content_hash}:{index}"))
+
+
+def content_chunk_id(source, document, occurrence=0):
+    """
+    ID determinado pela página e pelo texto do trecho, e não pela sua ordem no arquivo:
+    numa nova versão do PDF, os trechos que não mudaram mantêm o ID e o ponto já gravado
+    no índice é reaproveitado. `occurrence` separa textos repetidos na mesma página.
+    A posição (start_index) fica de fora: um trecho deslocado por uma edição anterior
+    na página continua com o mesmo ID e só tem o payload atualizado (ver payload_digest).
+    """
+    digest = hashlib.sha256(f"{document.metadata.get('page')}\0{document.page_content}".encode("utf-8"))
+    return chunk_id(source, digest.hexdigest(), occurrence)
+
+
+def payload_digest(document):
+    """
+    Hash curto dos metadados gravados no payload (página, start_index...).
+    """
+    metadata = json.dumps(document.metadata, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(metadata.encode("utf-8")).hexdigest()[:16]
+
+
+class SyncPlan:
+    """
+    Resultado da comparação entre a pasta de documentos e o manifesto.
+    """
+
+    def __init__(self):
+        self.new = []          # [(source, sha256, mtime, size)]
+        self.changed = []      # [(source, sha256, mtime, size)]
+        self.removed = []      # [source]
+        self.unchanged = []    # [source]
+        self.outdated = []     # [source] divididos por outro chunker, ainda não redivididos
+        self.report = []       # tempos e erros por arquivo processado
+
+    @property
+    def to_index(self):
+        return self.new + self.changed
+
+    def has_changes(self):
+        return bool(self.new or self.changed or self.removed)
+
+
+class IndexManifest:
+    """
+    Manifesto por documento da coleção vetorial: hash do conteúdo, mtime,
+    tamanho e IDs dos trechos gravados. Permite reindexar apenas o que mudou.
+    """
+
+    def __init__(self, db_path, embedding_model, filename=MANIFEST_FILENAME, chunker=LEGACY_CHUNKER):
+        self.path = os.path.join(db_path, filename)
+        self.embedding_model = embedding_model
+        self.chunker = chunker
+        self.documents = {}
+        self.exists = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            return
+        if data.get("version") != MANIFEST_VERSION or data.get("embedding_model") != self.embedding_model:
+            # Manifesto de outra versão/modelo: os vetores existentes não são reaproveitáveis.
+            return
+        self.documents = data.get("documents", {})
+        self.exists = True
+        # Cada documento guarda o chunker que o dividiu; os de manifestos antigos herdam o do arquivo.
+        for entry in self.documents.values():
+            entry.setdefault("chunker", data.get("chunker", LEGACY_CHUNKER))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "embedding_model": self.embedding_model,
+                "documents": self.documents,
+            }, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        self.exists = True
+
+    def clear(self):
+        self.documents = {}
+
+    def get(self, source):
+        return self.documents.get(source)
+
+    def begin(self, source, sha256, mtime, size, chunk_ids=(), payload_digests=None):
+        """
+        Registra um documento em indexação. Fica marcado como incompleto até
+        `mark_complete`, para que uma interrupção no meio seja refeita depois.
+        `chunk_ids` são os trechos da versão anterior que ainda estão no índice.
+        """
+        self.documents[source] = {
+            "sha256": sha256,
+            "mtime": mtime,
+            "size": size,
+            "chunk_ids": list(chunk_ids),
+            "payloads": payload_digests or {},
+            "chunker": self.chunker,
+            "complete": False,
+        }
+
+    def add_chunk_ids(self, source, chunk_ids):
+        known = self.documents[source]["chunk_ids"]
+        present = set(known)
+        known.extend(cid for cid in chunk_ids if cid not in present)
+
+    def set_chunk_ids(self, source, chunk_ids, payload_digests=None):
+        self.documents[source]["chunk_ids"] = list(chunk_ids)
+        if payload_digests is not None:
+            self.documents[source]["payloads"] = payload_digests
+
+    def payload_digests_of(self, source):
+        """
+        {chunk_id: payload_digest} dos trechos gravados (vazio para manifestos antigos).
+        """
+        entry = self.documents.get(source)
+        return dict(entry.get("payloads", {})) if entry else {}
+
+    def mark_complete(self, source):
+        self.documents[source]["complete"] = True
+
+    def remove(self, source):
+        return self.documents.pop(source, None)
+
+    def chunk_ids_of(self, sources):
+        ids = []
+        for source in sources:
+            entry = self.documents.get(source)
+            if entry:
+                ids.extend(entry.get("chunk_ids", []))
+        return ids
+
+    def version(self):
+        """
+        Hash estável do conjunto de documentos indexados (nome + conteúdo).
+        Muda sempre que um documento é adicionado, alterado ou removido.
+        """
+        digest = hashlib.sha256(self.embedding_model.encode("utf-8"))
+        for source in sorted(self.documents):
+            entry = self.documents[source]
+            if entry.get("complete", True):
+                digest.update(f"{source}\0{entry['sha256']}\0{entry.get('chunker')}\0".encode("utf-8"))
+        return digest.hexdigest()
+
+    def plan(self, docs_path, pdf_files, rechunk=False):
+        """
+        Compara os PDFs da pasta com o manifesto. O hash só é recalculado
+        quando o mtime ou o tamanho do arquivo mudaram. Documentos divididos
+        por outro chunker continuam válidos para consulta (`plan.outdated`);
+        com `rechunk` eles entram como alterados e são redivididos.
+        """
+        plan = SyncPlan()
+        present = set()
+        for source in sorted(pdf_files):
+            present.add(source)
+            path = os.path.join(docs_path, source)
+            stat = os.stat(path)
+            entry = self.documents.get(source)
+            if entry and not entry.get("complete", True):
+                # Indexação interrompida: o arquivo é refeito, reaproveitando os trechos já gravados.
+                plan.changed.append((source, file_sha256(path), stat.st_mtime, stat.st_size))
+                continue
+            if entry and entry.get("chunker") != self.chunker:
+                if rechunk:
+                    plan.changed.append((source, file_sha256(path), stat.st_mtime, stat.st_size))
+                    continue
+                plan.outdated.append(source)
+            if entry and entry.get("mtime") == stat.st_mtime and entry.get("size") == stat.st_size:
+                plan.unchanged.append(source)
+                continue
+            sha256 = file_sha256(path)
+            if entry and entry.get("sha256") == sha256:
+                # Só o mtime mudou (ex: arquivo copiado de novo); os vetores continuam válidos.
+                entry["mtime"] = stat.st_mtime
+                entry["size"] = stat.st_size
+                plan.unchanged.append(source)
+            elif entry:
+                plan.changed.append((source, sha256, stat.st_mtime, stat.st_size))
+            else:
+                plan.new.append((source, sha256, stat.st_mtime, stat.st_size))
+        plan.removed = sorted(source for source in self.documents if source not in present)
+        return plan
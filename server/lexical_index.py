@@ -0,0 +1,203 @@
+import os
+import re
+import sys
+import json
+import sqlite3
+import threading
+
+# Termos com dígitos (artigos, números de relatório, datas) ou entre aspas indicam
+# uma busca exata, que o índice lexical responde melhor que os embeddings.
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+_PHRASE_RE = re.compile(r'"([^"]+)"')
+_DIGIT_RE = re.compile(r"\d")
+
+# Uma consulta só é exata se for quase só termos-chave: "art. 5", "Sentinela 14".
+# Além dos termos com dígitos, aceita até MAX_EXACT_CONTEXT_TERMS palavras de conteúdo.
+MAX_EXACT_CONTEXT_TERMS = 2
+_STOPWORDS = frozenset(
+    "a ao aos as at com como da das de do dos diz dizem e em fala falam na nas no nos o os ou "
+    "para pela pelo por qual quais que se sobre um uma onde quando mostra mostre consta".split()
+)
+
+_SQL_BATCH = 500
+
+
+def fts5_available():
+    try:
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE VIRTUAL TABLE t USING fts5(x)")
+        conn.close()
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def is_exact_lookup(query):
+    """
+    Consulta do tipo "art. 5", "Sentinela 14", "12/03/2021" ou com "frase entre aspas".
+    Uma pergunta em linguagem natural que só menciona um número ("O que diz a
+    Sentinela de junho de 2025 sobre ...") não é exata: vai para a busca híbrida.
+    """
+    if _PHRASE_RE.search(query):
+        return True
+    terms = _TERM_RE.findall(query.lower())
+    if not any(_DIGIT_RE.search(term) for term in terms):
+        return False
+    context = [term for term in terms if not _DIGIT_RE.search(term) and term not in _STOPWORDS]
+    return len(context) <= MAX_EXACT_CONTEXT_TERMS
+
+
+def _match_expression(query, exact):
+    """
+    Converte texto livre numa expressão MATCH do FTS5. Cada termo vai entre aspas,
+    o que neutraliza a sintaxe do FTS5 (AND, NOT, *, :) digitada pelo usuário.
+    Com `exact`, os termos-chave (frases entre aspas e termos com dígitos) são
+    obrigatórios; o restante da pergunta ("o que diz o") só influencia a ordem.
+    """
+    phrases = [f'"{phrase}"' for phrase in (p.replace('"', " ").strip() for p in _PHRASE_RE.findall(query)) if phrase]
+    terms = [term for term in _TERM_RE.findall(_PHRASE_RE.sub(" ", query).lower()) if len(term) > 1 or term.isdigit()]
+    parts = list(dict.fromkeys(phrases + [f'"{term}"' for term in terms]))
+    if not parts:
+        return None
+    ranked = " OR ".join(parts)
+    if not exact:
+        return ranked
+    required = list(dict.fromkeys(phrases + [f'"{term}"' for term in terms if _DIGIT_RE.search(term)]))
+    if not required:
+        return None
+    return f"({' AND '.join(required)}) AND ({ranked})"
+
+
+def reciprocal_rank_fusion(rankings, k=60, limit=None):
+    """
+    Combina listas ordenadas de (id, item) somando 1 / (k + posição) de cada lista.
+    Devolve [(id, item, score)] do maior para o menor score; o item vem da primeira lista em que o id aparece.
+    """
+    scores, items = {}, {}
+    for ranking in rankings:
+        for rank, (item_id, item) in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+            items.setdefault(item_id, item)
+    fused = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [(item_id, items[item_id], scores[item_id]) for item_id in fused]
+
+
+class LexicalIndex:
+    """
+    Índice invertido BM25 (SQLite FTS5) com os mesmos trechos e IDs do índice vetorial.
+    Guarda o payload completo, então uma busca só lexical não precisa do motor vetorial.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        # remove_diacritics: "relatorio" encontra "relatório".
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+            " id UNINDEXED, source UNINDEXED, content, payload UNINDEXED,"
+            " tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        # Colunas UNINDEXED do FTS5 não têm índice: "WHERE id IN" varreria a tabela inteira.
+        # O rowid de cada ID fica numa tabela comum, com chave primária.
+        created = self._conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'chunk_rows'"
+        ).fetchone()[0] == 0
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunk_rows (id TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        if created:
+            # Índice criado antes da tabela auxiliar: uma única varredura para preenchê-la.
+            self._conn.execute("INSERT OR REPLACE INTO chunk_rows (id, row) SELECT id, rowid FROM chunks")
+        self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM chunk_rows")
+            self._conn.commit()
+
+    def add(self, ids, payloads):
+        with self._lock:
+            self._delete(ids)
+            for cid, payload in zip(ids, payloads):
+                cursor = self._conn.execute(
+                    "INSERT INTO chunks (id, source, content, payload) VALUES (?, ?, ?, ?)",
+                    (cid, (payload.get("metadata") or {}).get("source"), payload.get("page_content", ""), json.dumps(payload)),
+                )
+                self._conn.execute("INSERT OR REPLACE INTO chunk_rows (id, row) VALUES (?, ?)", (cid, cursor.lastrowid))
+            self._conn.commit()
+
+    def _rows(self, ids):
+        ids = list(ids)
+        found = {}
+        for start in range(0, len(ids), _SQL_BATCH):
+            batch = ids[start:start + _SQL_BATCH]
+            found.update(self._conn.execute(
+                f"SELECT id, row FROM chunk_rows WHERE id IN ({', '.join('?' * len(batch))})", batch
+            ).fetchall())
+        return found
+
+    def _delete(self, ids):
+        rows = self._rows(ids)
+        found_ids, found_rows = list(rows), list(rows.values())
+        for start in range(0, len(found_rows), _SQL_BATCH):
+            batch = found_rows[start:start + _SQL_BATCH]
+            self._conn.execute(f"DELETE FROM chunks WHERE rowid IN ({', '.join('?' * len(batch))})", batch)
+            batch = found_ids[start:start + _SQL_BATCH]
+            self._conn.execute(f"DELETE FROM chunk_rows WHERE id IN ({', '.join('?' * len(batch))})", batch)
+
+    def set_payloads(self, ids, payloads):
+        # O texto não muda, só os metadados: nada a reindexar no FTS5.
+        with self._lock:
+            rows = self._rows(ids)
+            self._conn.executemany(
+                "UPDATE chunks SET payload = ? WHERE rowid = ?",
+                [(json.dumps(payload), rows[cid]) for cid, payload in zip(ids, payloads) if cid in rows],
+            )
+            self._conn.commit()
+
+    def delete(self, ids):
+        with self._lock:
+            self._delete(ids)
+            self._conn.commit()
+
+    def rebuild(self, engine):
+        """
+        Recria o índice a partir dos pontos do motor vetorial (índices criados antes do BM25).
+        """
+        sys.stderr.write("[CORE_LOGIC] Construindo indice lexical a partir do indice vetorial...\n")
+        self.clear()
+        for ids, _, payloads in engine.iter_points():
+            self.add(ids, payloads)
+
+    def search(self, query, k, source=None, exact=False):
+        """
+        Devolve [(id, score, payload)] ordenados por BM25 (score maior = melhor).
+        `exact` só devolve trechos com todos os termos-chave da consulta (ver is_exact_lookup).
+        """
+        expression = _match_expression(query, exact)
+        if expression is None:
+            return []
+        sql = "SELECT id, bm25(chunks), payload FROM chunks WHERE chunks MATCH ?"
+        params = [expression]
+        if source is not None:
+            sql += " AND source = ?"
+            params.append(source)
+        sql += " ORDER BY bm25(chunks) LIMIT ?"
+        params.append(k)
+        with self._lock:
+            try:
+                rows = self._conn.execute(sql, params).fetchall()
+            except sqlite3.OperationalError as e:
+                sys.stderr.write(f"[CORE_LOGIC_ERROR] Consulta lexical invalida ({expression}): {e}\n")
+                return []
+        # bm25() do FTS5 é negativo (menor = mais relevante).
+        return [(row[0], -row[1], json.loads(row[2])) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
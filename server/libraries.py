@@ -0,0 +1,202 @@
+import os
+import re
+import sys
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DEFAULT_LIBRARY = "default"
+LIBRARIES_DIRNAME = "bibliotecas"
+
+INDEX_NONE = "NONE"
+INDEX_RESTORING = "RESTORING"
+INDEX_BUILDING = "BUILDING"  # indexação em andamento; as perguntas usam o índice parcial
+INDEX_STALE = "STALE"
+INDEX_READY = "READY"
+INDEX_ERROR = "ERROR"
+
+# O nome vira nome de pasta: só letras, dígitos, "-" e "_".
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+
+def validate_name(name):
+    if not isinstance(name, str) or not _NAME_RE.match(name):
+        raise ValueError(
+            f"Nome de biblioteca invalido: {name!r}. Use ate 64 letras, digitos, '-' ou '_' (sem espacos)."
+        )
+    return name
+
+
+class Library:
+    """
+    Uma biblioteca de documentos: pasta de PDFs, coleção vetorial, índice lexical,
+    manifesto e cache de respostas próprios. Os índices ficam fechados até o
+    primeiro uso e podem ser fechados de novo pelo LibraryRegistry.
+    """
+
+    def __init__(self, name, docs_path, db_path, collection_name):
+        self.name = name
+        self.docs_path = docs_path
+        self.db_path = db_path
+        self.collection_name = collection_name
+        self.vector_index = None
+        self.lexical_index = None
+        self.manifest = None
+        self.answer_cache = None
+        self.index_status = INDEX_NONE
+        self.ingest_progress = None
+        self.ingest_stats = None
+        self.last_used = 0.0
+        self.users = 0  # requisições usando a biblioteca agora; uma biblioteca em uso nunca é fechada
+        # Serializa abertura, indexação e fechamento; as buscas não passam por ele.
+        self.lock = threading.RLock()
+
+    @property
+    def is_open(self):
+        return self.vector_index is not None
+
+    def list_pdf_files(self):
+        os.makedirs(self.docs_path, exist_ok=True)
+        return [f for f in os.listdir(self.docs_path) if f.lower().endswith(".pdf")]
+
+    def has_saved_index(self):
+        return os.path.isdir(self.db_path) and bool(os.listdir(self.db_path))
+
+    def resident_bytes(self):
+        """
+        Estimativa da memória ocupada pelos índices abertos (vetores residentes e cache de respostas).
+        """
+        size = 0
+        if self.vector_index is not None:
+            size += self.vector_index.resident_bytes()
+        if self.answer_cache is not None:
+            size += self.answer_cache.resident_bytes()
+        return size
+
+    def close(self):
+        # O índice continua salvo em disco: o estado (READY, STALE) vale para a próxima abertura.
+        vector_index, self.vector_index = self.vector_index, None
+        lexical_index, self.lexical_index = self.lexical_index, None
+        answer_cache, self.answer_cache = self.answer_cache, None
+        self.manifest = None
+        for resource in (vector_index, lexical_index, answer_cache):
+            if resource is not None:
+                resource.close()
+
+    def summary(self):
+        return {
+            "name": self.name,
+            "open": self.is_open,
+            "index_status": self.index_status,
+            "resident_mb": round(self.resident_bytes() / 2 ** 20, 1),
+            "last_used": round(self.last_used, 1) if self.last_used else None,
+        }
+
+
+class LibraryRegistry:
+    """
+    Bibliotecas conhecidas pelo processo, em ordem LRU. A biblioteca "default"
+    usa as pastas de sempre (documents e db_storage); as demais ficam em
+    bibliotecas/<nome>. Depois de cada uso, as bibliotecas abertas menos usadas
+    recentemente são fechadas até caber em `memory_limit_bytes` e `max_open`
+    (0 = sem limite); a última usada fica sempre aberta.
+    """
+
+    def __init__(self, data_dir, collection_name, memory_limit_bytes=0, max_open=0):
+        self.data_dir = data_dir
+        self.collection_name = collection_name
+        self.memory_limit_bytes = memory_limit_bytes
+        self.max_open = max_open
+        self.evictions = 0
+        self._libraries = OrderedDict()  # nome -> Library, da menos para a mais recentemente usada
+        self._lock = threading.Lock()
+
+    def _paths(self, name):
+        if name == DEFAULT_LIBRARY:
+            return (
+                os.path.join(self.data_dir, "documents"),
+                os.path.join(self.data_dir, "db_storage"),
+                self.collection_name,
+            )
+        root = os.path.join(self.data_dir, LIBRARIES_DIRNAME, name)
+        return os.path.join(root, "documents"), os.path.join(root, "db_storage"), f"{self.collection_name}_{name}"
+
+    def get(self, name=None):
+        """
+        Devolve a biblioteca `name` (None = "default"), sem abrir seus índices.
+        """
+        name = validate_name(name or DEFAULT_LIBRARY)
+        with self._lock:
+            library = self._libraries.get(name)
+            if library is None:
+                library = self._libraries[name] = Library(name, *self._paths(name))
+            return library
+
+    def names(self):
+        """
+        Bibliotecas em disco e em memória, "default" primeiro.
+        """
+        found = {DEFAULT_LIBRARY}
+        root = os.path.join(self.data_dir, LIBRARIES_DIRNAME)
+        if os.path.isdir(root):
+            found.update(name for name in os.listdir(root) if _NAME_RE.match(name) and os.path.isdir(os.path.join(root, name)))
+        with self._lock:
+            found.update(self._libraries)
+        return [DEFAULT_LIBRARY] + sorted(found - {DEFAULT_LIBRARY})
+
+    def loaded(self):
+        with self._lock:
+            return list(self._libraries.values())
+
+    @contextmanager
+    def use(self, name=None):
+        """
+        Marca a biblioteca como em uso durante o bloco (não pode ser fechada) e a
+        move para o fim da fila LRU. Ao sair, aplica os limites de memória.
+        """
+        library = self.get(name)
+        with self._lock:
+            library.users += 1
+            library.last_used = time.time()
+            self._libraries.move_to_end(library.name)
+        try:
+            yield library
+        finally:
+            with self._lock:
+                library.users -= 1
+            self.evict()
+
+    def evict(self):
+        # Fecha sob a trava do registro: ninguém começa a usar uma biblioteca enquanto ela é fechada.
+        with self._lock:
+            open_libraries = [library for library in self._libraries.values() if library.is_open]
+            sizes = {library.name: library.resident_bytes() for library in open_libraries}
+            total, remaining = sum(sizes.values()), len(open_libraries)
+            for library in open_libraries[:-1]:
+                over_memory = self.memory_limit_bytes and total > self.memory_limit_bytes
+                over_count = self.max_open and remaining > self.max_open
+                if not (over_memory or over_count):
+                    break
+                if library.users or library.index_status == INDEX_BUILDING:
+                    continue
+                with library.lock:
+                    library.close()
+                total -= sizes[library.name]
+                remaining -= 1
+                self.evictions += 1
+                sys.stderr.write(
+                    f"[CORE_LOGIC] Biblioteca '{library.name}' fechada por falta de uso recente "
+                    f"({sizes[library.name] / 2 ** 20:.1f} MB liberados; {remaining} aberta(s)).\n"
+                )
+
+    def stats(self):
+        with self._lock:
+            open_libraries = [library for library in self._libraries.values() if library.is_open]
+            return {
+                "open": len(open_libraries),
+                "resident_mb": round(sum(library.resident_bytes() for library in open_libraries) / 2 ** 20, 1),
+                "memory_limit_mb": round(self.memory_limit_bytes / 2 ** 20, 1) if self.memory_limit_bytes else None,
+                "max_open": self.max_open or None,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,220 @@
+import re
+import sys
+import time
+import random
+import hashlib
+import threading
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+import metrics
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value):
+    """
+    Durações dos cabeçalhos da OpenAI ("20ms", "1s", "6m0s", "1h2m3.5s") em segundos.
+    """
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def retry_delay(headers):
+    """
+    Espera indicada pela API (retry-after-ms, retry-after ou reset do limite), ou None.
+    """
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    resets = [parse_duration(headers.get(name)) for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    resets = [value for value in resets if value is not None]
+    return max(resets) if resets else None
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    # Em respostas com streaming o corpo é lido depois que o transporte retorna:
+    # a vaga do limitador só é devolvida quando o corpo for fechado.
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                release()
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """
+    Transporte httpx com limite de requisições simultâneas e novas tentativas
+    guiadas pelos cabeçalhos de rate limit. Quando a API informa que a cota
+    acabou (x-ratelimit-remaining-requests = 0), as próximas requisições esperam
+    o reset em vez de receberem 429.
+    """
+
+    def __init__(self, transport, max_concurrency=4, max_retries=4, backoff_base=0.5, max_backoff=60.0):
+        self._transport = transport
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self._cooldown_lock = threading.Lock()
+        self._cooldown_until = 0.0
+
+    def _wait_cooldown(self):
+        with self._cooldown_lock:
+            wait = self._cooldown_until - time.monotonic()
+        if wait > 0:
+            metrics.incr("llm_http.throttled_ms", int(wait * 1000))
+            time.sleep(wait)
+
+    def _note_limits(self, headers):
+        if headers.get("x-ratelimit-remaining-requests") == "0":
+            reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+            if reset:
+                with self._cooldown_lock:
+                    self._cooldown_until = max(self._cooldown_until, time.monotonic() + min(reset, self.max_backoff))
+
+    def handle_request(self, request):
+        attempt = 0
+        while True:
+            self._wait_cooldown()
+            self._slots.acquire()
+            start = time.perf_counter()
+            try:
+                response = self._transport.handle_request(request)
+            except BaseException:
+                self._slots.release()
+                raise
+            metrics.observe("llm_http.response_headers", time.perf_counter() - start, status=response.status_code)
+            self._note_limits(response.headers)
+            if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                response.stream = _ReleasingStream(response.stream, self._slots.release)
+                return response
+            response.read()
+            response.close()
+            self._slots.release()
+            delay = retry_delay(response.headers)
+            if delay is None:
+                delay = self.backoff_base * (2 ** attempt)
+            # Jitter evita que várias threads voltem todas no mesmo instante.
+            delay = min(self.max_backoff, delay) + random.uniform(0, self.backoff_base)
+            attempt += 1
+            metrics.incr("llm_http.retries")
+            sys.stderr.write(
+                f"[CORE_LOGIC] LLM respondeu {response.status_code}; nova tentativa {attempt}/{self.max_retries} em {delay:.1f}s.\n"
+            )
+            time.sleep(delay)
+
+    def close(self):
+        self._transport.close()
+
+
+class LLMClientPool:
+    """
+    Camada única de acesso ao LLM: um httpx.Client com keep-alive compartilhado pela
+    validação da chave, pelo agente, pelo modo direto e pela memória com resumo.
+    """
+
+    def __init__(self, base_url=None, max_connections=10, max_concurrency=4, max_retries=4,
+                 timeout=60.0, valid_key_ttl=24 * 3600, invalid_key_ttl=300):
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self.valid_key_ttl = valid_key_ttl
+        self.invalid_key_ttl = invalid_key_ttl
+        self._validations = {}  # sha256(chave) -> (válida, mensagem, expira_em)
+        self._models = {}
+        self._lock = threading.Lock()
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections, keepalive_expiry=120)
+        self.http_client = httpx.Client(
+            transport=RateLimitedTransport(httpx.HTTPTransport(limits=limits), max_concurrency, max_retries),
+            timeout=httpx.Timeout(timeout, connect=10.0),
+        )
+
+    @staticmethod
+    def _key_hash(api_key):
+        # A chave em si nunca fica em memória como índice do cache.
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    def validate_key(self, api_key):
+        """
+        Valida a chave com GET /models (sem gastar tokens). O resultado fica em cache
+        pelo hash da chave: válidas por `valid_key_ttl`, inválidas por `invalid_key_ttl`.
+        Erros de rede não entram no cache.
+        """
+        key_hash = self._key_hash(api_key)
+        now = time.time()
+        with self._lock:
+            cached = self._validations.get(key_hash)
+        if cached is not None and cached[2] > now:
+            metrics.incr("llm_client.key_validation_cache_hits")
+            return cached[0], cached[1]
+        metrics.incr("llm_client.key_validation_requests")
+        try:
+            with metrics.span("llm_client.validate_key"):
+                response = self.http_client.get(f"{self.base_url}/models", headers={"Authorization": f"Bearer {api_key}"})
+        except httpx.HTTPError as e:
+            return False, f"Erro ao validar a chave: {e}"
+        if response.status_code == 200:
+            result = (True, "Chave da API válida.", now + self.valid_key_ttl)
+        elif response.status_code in (401, 403):
+            result = (False, "Chave da API da OpenAI inválida ou expirada.", now + self.invalid_key_ttl)
+        else:
+            return False, f"Erro ao validar a chave: HTTP {response.status_code}"
+        with self._lock:
+            self._validations[key_hash] = result
+        return result[0], result[1]
+
+    def forget_key(self, api_key):
+        with self._lock:
+            self._validations.pop(self._key_hash(api_key), None)
+
+    def chat_model(self, model_name, api_key, streaming=False, temperature=0):
+        """
+        ChatOpenAI sobre o cliente HTTP compartilhado. As novas tentativas ficam no
+        transporte (que respeita os cabeçalhos de rate limit), não no SDK.
+        """
+        from langchain_openai import ChatOpenAI
+
+        key = (model_name, self._key_hash(api_key), streaming, temperature)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = ChatOpenAI(
+                    model_name=model_name, openai_api_key=api_key, temperature=temperature, streaming=streaming,
+                    openai_api_base=self.base_url, http_client=self.http_client, max_retries=0,
+                )
+                self._models[key] = model
+            return model
+
+    def close(self):
+        self.http_client.close()
@@ -0,0 +1,143 @@
+"""
+Verificação do llm_client contra um servidor HTTP local que imita a API da OpenAI
+(sem rede e sem chave de verdade):
+
+    python llm_client_check.py
+
+Confere a nova tentativa após 429 com retry-after, o cache da validação da chave
+(e a nova consulta quando o TTL vence) e a devolução da vaga do limitador quando
+o corpo de uma resposta com streaming é fechado. Sai com código 1 se algo falhar.
+"""
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_client import LLMClientPool
+
+VALID_KEY = "sk-valid"
+RETRY_AFTER_SECONDS = 0.3
+
+
+class _MockState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.models_hits = 0
+        self.flaky_hits = []  # instante de cada chamada a /flaky
+
+
+class _MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # O cliente fecha /stream sem ler o corpo inteiro: a conexão cai de propósito.
+        if not isinstance(sys.exc_info()[1], (ConnectionError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"{}", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.server.state
+        if self.path == "/v1/models":
+            with state.lock:
+                state.models_hits += 1
+            authorized = self.headers.get("Authorization") == f"Bearer {VALID_KEY}"
+            return self._send(200 if authorized else 401)
+        if self.path == "/v1/flaky":
+            with state.lock:
+                state.flaky_hits.append(time.monotonic())
+                first = len(state.flaky_hits) == 1
+            if first:
+                return self._send(429, headers={"retry-after": str(RETRY_AFTER_SECONDS)})
+            return self._send(200, b'{"ok": true}')
+        if self.path == "/v1/stream":
+            # Corpo longo: o cliente fecha a resposta sem ler tudo.
+            return self._send(200, b"x" * (1 << 20))
+        self._send(404)
+
+
+def _check_retry_after(pool, state):
+    start = time.monotonic()
+    response = pool.http_client.get(f"{pool.base_url}/flaky")
+    assert response.status_code == 200, f"esperava 200 depois da nova tentativa, veio {response.status_code}"
+    assert len(state.flaky_hits) == 2, f"esperava 2 chamadas a /flaky, houve {len(state.flaky_hits)}"
+    waited = state.flaky_hits[1] - state.flaky_hits[0]
+    assert waited >= RETRY_AFTER_SECONDS, f"nova tentativa em {waited:.2f}s, antes do retry-after ({RETRY_AFTER_SECONDS}s)"
+    return f"429 -> 200 em {time.monotonic() - start:.2f}s (espera de {waited:.2f}s)"
+
+
+def _check_validation_ttl(pool, state):
+    assert pool.validate_key(VALID_KEY)[0], "a chave valida foi recusada"
+    assert pool.validate_key(VALID_KEY)[0], "a chave valida foi recusada na segunda consulta"
+    assert state.models_hits == 1, f"esperava 1 consulta a /models com o cache, houve {state.models_hits}"
+    assert not pool.validate_key("sk-invalida")[0], "a chave invalida foi aceita"
+    assert state.models_hits == 2, f"esperava 2 consultas a /models, houve {state.models_hits}"
+    time.sleep(pool.valid_key_ttl + 0.1)
+    assert pool.validate_key(VALID_KEY)[0], "a chave valida foi recusada depois do TTL"
+    assert state.models_hits == 3, f"esperava nova consulta a /models depois do TTL, houve {state.models_hits}"
+    return f"{state.models_hits} consulta(s) a /models para 4 validacoes"
+
+
+def _check_stream_release(pool, state):
+    done = threading.Event()
+
+    def next_request():
+        pool.http_client.get(f"{pool.base_url}/models", headers={"Authorization": f"Bearer {VALID_KEY}"})
+        done.set()
+
+    with pool.http_client.stream("GET", f"{pool.base_url}/stream") as response:
+        next(response.iter_bytes())
+        waiter = threading.Thread(target=next_request, daemon=True)
+        waiter.start()
+        # Com uma única vaga, a próxima requisição espera o corpo aberto ser fechado.
+        assert not done.wait(0.3), "a vaga foi devolvida antes de o corpo da resposta ser fechado"
+    assert done.wait(5), "a vaga nao foi devolvida depois de fechar o corpo da resposta"
+    return "vaga devolvida ao fechar o corpo"
+
+
+CHECKS = [
+    ("429 com retry-after", _check_retry_after),
+    ("TTL da validacao da chave", _check_validation_ttl),
+    ("vaga liberada no streaming", _check_stream_release),
+]
+
+
+def main():
+    server = _MockServer(("127.0.0.1", 0), _MockHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    failures = 0
+    try:
+        for name, check in CHECKS:
+            server.state = _MockState()
+            pool = LLMClientPool(
+                base_url=f"http://127.0.0.1:{server.server_address[1]}/v1",
+                max_concurrency=1, max_retries=2, timeout=10.0, valid_key_ttl=0.5,
+            )
+            try:
+                print(f"OK      {name}: {check(pool, server.state)}")
+            except AssertionError as e:
+                failures += 1
+                print(f"FALHOU  {name}: {e}")
+            finally:
+                pool.close()
+    finally:
+        server.shutdown()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
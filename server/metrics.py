@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import math
+import time
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Amostras guardadas por histograma para os percentis (as mais recentes).
+RESERVOIR_SIZE = 2048
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_started = time.time()
+_span_ids = itertools.count(1)
+_local = threading.local()  # pilha de spans e trace_id da requisição da thread atual
+
+_trace_lock = threading.Lock()
+_trace_file = None
+
+
+def percentile(values, p):
+    """
+    Percentil p (0..100) pela posição mais próxima na amostra ordenada; None se vazia.
+    Usado pelos histogramas, pelos motores de busca e pelo benchmark.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = min(len(ordered), max(1, math.ceil(p / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=RESERVOIR_SIZE)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def snapshot(self):
+        ordered = sorted(self.samples)
+
+        def pick(p):
+            return round(percentile(ordered, p) * 1000, 2)
+
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 1),
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": pick(50) if ordered else None,
+            "p95_ms": pick(95) if ordered else None,
+            "p99_ms": pick(99) if ordered else None,
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+def configure_trace(path):
+    """
+    Liga (ou desliga, com path vazio) o arquivo de trace em JSON-lines: um span por linha.
+    """
+    global _trace_file
+    with _trace_lock:
+        if _trace_file is not None:
+            _trace_file.close()
+        _trace_file = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            _trace_file = open(path, "a", encoding="utf-8", buffering=1)
+            sys.stderr.write(f"[CORE_LOGIC] Trace de spans em {path}.\n")
+
+
+def set_trace_id(trace_id):
+    # Normalmente o request_id do protocolo: agrupa os spans de uma mesma requisição no trace.
+    _local.trace_id = trace_id
+
+
+def observe(name, seconds, **attrs):
+    """
+    Registra uma duração já medida (por exemplo, num processo do pool de extração).
+    """
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(seconds)
+    if _trace_file is not None:
+        _write_trace(name, time.time() - seconds, seconds, None, None, attrs)
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Mede o bloco e alimenta o histograma `name`. Spans aninhados registram o pai no trace.
+    Atributos podem ser completados dentro do bloco: `with span("x") as s: s["chunks"] = 10`.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    span_id = next(_span_ids)
+    parent = stack[-1] if stack else None
+    stack.append(span_id)
+    started_at = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        with _lock:
+            histogram = _histograms.get(name)
+            if histogram is None:
+                histogram = _histograms[name] = Histogram()
+            histogram.add(seconds)
+        if _trace_file is not None:
+            if error:
+                attrs["error"] = error
+            _write_trace(name, started_at, seconds, span_id, parent, attrs)
+
+
+def _write_trace(name, started_at, seconds, span_id, parent, attrs):
+    record = {
+        "ts": round(started_at, 6),
+        "name": name,
+        "ms": round(seconds * 1000, 3),
+        "trace_id": getattr(_local, "trace_id", None),
+        "span_id": span_id,
+        "parent_id": parent,
+        "thread": threading.current_thread().name,
+    }
+    if attrs:
+        record["attrs"] = attrs
+    line = json.dumps(record, default=str)
+    with _trace_lock:
+        if _trace_file is not None:
+            _trace_file.write(line + "\n")
+
+
+def histogram(name):
+    """
+    Resumo de um único histograma (None enquanto não houver medições).
+    """
+    with _lock:
+        histogram = _histograms.get(name)
+        return histogram.snapshot() if histogram is not None else None
+
+
+def snapshot(reset=False):
+    with _lock:
+        result = {
+            "uptime_seconds": round(time.time() - _started, 1),
+            "histograms": {name: h.snapshot() for name, h in sorted(_histograms.items())},
+            "counters": dict(sorted(_counters.items())),
+        }
+        if reset:
+            _histograms.clear()
+            _counters.clear()
+    return result
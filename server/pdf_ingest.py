@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from chunking import get_chunker
+
+
+def load_and_split(docs_path, source, chunking=None):
+    """
+    Extrai e divide um PDF, página a página. Roda tanto no processo principal
+    quanto em processos do pool, por isso as importações pesadas ficam aqui dentro.
+    `chunking` são os argumentos de `chunking.get_chunker` (o splitter é criado uma vez por processo).
+    Nunca levanta exceção: um PDF corrompido volta com `error` preenchido.
+    """
+    from langchain_community.document_loaders import PyPDFLoader
+
+    start = time.perf_counter()
+    result = {"source": source, "chunks": [], "pages": 0, "seconds": 0.0, "load_seconds": 0.0, "split_seconds": 0.0, "error": None}
+    load_seconds = split_seconds = 0.0
+    try:
+        text_splitter = get_chunker(**(chunking or {}))
+        chunks = []
+        # lazy_load lê uma página por vez: só os trechos do arquivo atual ficam em memória.
+        pages = PyPDFLoader(os.path.join(docs_path, source)).lazy_load()
+        while True:
+            # Leitura e divisão intercaladas, medidas em separado (o processo do pool não tem acesso às métricas).
+            mark = time.perf_counter()
+            page = next(pages, None)
+            load_seconds += time.perf_counter() - mark
+            if page is None:
+                break
+            page.metadata["source"] = source
+            mark = time.perf_counter()
+            chunks.extend(text_splitter.split_documents([page]))
+            split_seconds += time.perf_counter() - mark
+            result["pages"] += 1
+        result["chunks"] = chunks
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    result["load_seconds"] = round(load_seconds, 4)
+    result["split_seconds"] = round(split_seconds, 4)
+    return result
+
+
+def resolve_workers(workers, file_count):
+    """
+    0 (ou negativo) significa automático: um processo por núcleo, sem passar do número de arquivos.
+    """
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, file_count))
+
+
+def iter_extracted(docs_path, sources, workers=0, max_pending=None, chunking=None):
+    """
+    Gera o resultado de `load_and_split` para cada PDF, sempre na ordem de `sources`,
+    em paralelo num pool de processos quando houver mais de um worker.
+
+    No máximo `max_pending` arquivos ficam em andamento ou prontos à espera do
+    consumidor (padrão: 2 por worker). Se a indexação atrasar, a extração para.
+    """
+    workers = resolve_workers(workers, len(sources))
+    if workers == 1:
+        for source in sources:
+            yield load_and_split(docs_path, source, chunking)
+        return
+
+    max_pending = max_pending or workers * 2
+    sys.stderr.write(f"[CORE_LOGIC] Extraindo PDFs com {workers} processo(s).\n")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        queue = deque()
+        remaining = iter(sources)
+        for source in remaining:
+            queue.append(executor.submit(load_and_split, docs_path, source, chunking))
+            if len(queue) >= max_pending:
+                break
+        while queue:
+            # Consome na ordem de envio, o que mantém a saída determinística.
+            result = queue.popleft().result()
+            next_source = next(remaining, None)
+            if next_source is not None:
+                queue.append(executor.submit(load_and_split, docs_path, next_source, chunking))
+            yield result
@@ -0,0 +1,93 @@
+import sys
+import time
+import threading
+
+import numpy as np
+
+import metrics
+
+# Multilíngue (treinado no mMARCO, inclui português) e pequeno o bastante para CPU.
+DEFAULT_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+
+
+class CrossEncoderReranker:
+    """
+    Reordena os candidatos da busca com um cross-encoder (pergunta e trecho
+    lidos juntos), numa única chamada em lote. Fica só com os trechos acima de
+    `min_score`, entre `min_k` e `max_k`: o número de trechos enviados ao LLM
+    passa a depender da pergunta em vez de ser fixo. A latência de cada chamada
+    vai para o histograma "retrieval.rerank" do módulo metrics.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL, cache_folder=None, batch_size=32, max_length=512):
+        self.model_name = model_name
+        self.cache_folder = cache_folder
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._candidates = 0
+        self._kept = 0
+        self.calls = 0
+
+    def load(self):
+        with self._load_lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+
+                start = time.perf_counter()
+                model_kwargs = {"cache_folder": self.cache_folder} if self.cache_folder else {}
+                try:
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu", **model_kwargs)
+                except TypeError:
+                    # Versões antigas do sentence-transformers não aceitam cache_folder.
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+                sys.stderr.write(f"[CORE_LOGIC] Cross-encoder {self.model_name} pronto em {time.perf_counter() - start:.1f}s.\n")
+            return self._model
+
+    def score(self, query, texts):
+        """
+        Scores em 0..1 (sigmoide aplicada se o modelo devolver logits).
+        """
+        if not texts:
+            return np.zeros(0, dtype=np.float32)
+        model = self.load()
+        scores = np.asarray(
+            model.predict([(query, text) for text in texts], batch_size=self.batch_size, show_progress_bar=False),
+            dtype=np.float32,
+        ).reshape(-1)
+        if scores.min() < 0.0 or scores.max() > 1.0:
+            scores = 1.0 / (1.0 + np.exp(-scores))
+        return scores
+
+    def rerank(self, query, docs, min_score=0.3, min_k=1, max_k=8):
+        """
+        Devolve [(Document, score)] em ordem decrescente de score.
+        """
+        start = time.perf_counter()
+        with metrics.span("retrieval.rerank", candidates=len(docs)) as attrs:
+            scores = self.score(query, [doc.page_content for doc in docs])
+            order = np.argsort(-scores)
+            kept = [(docs[i], float(scores[i])) for i in order[:max_k] if scores[i] >= min_score]
+            if len(kept) < min_k:
+                kept = [(docs[i], float(scores[i])) for i in order[:min_k]]
+            attrs["kept"] = len(kept)
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self.calls += 1
+            self._candidates += len(docs)
+            self._kept += len(kept)
+        sys.stderr.write(f"[CORE_LOGIC] Rerank: {len(docs)} candidato(s) -> {len(kept)} trecho(s) em {elapsed:.0f} ms.\n")
+        return kept
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "model": self.model_name,
+                "loaded": self._model is not None,
+                "calls": self.calls,
+                "avg_candidates": round(self._candidates / self.calls, 1) if self.calls else 0.0,
+                "avg_kept": round(self._kept / self.calls, 1) if self.calls else 0.0,
+                "latency": metrics.histogram("retrieval.rerank"),
+            }
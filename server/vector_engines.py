@@ -0,0 +1,1001 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+import metrics
+
+# Motores disponíveis: "qdrant" (coleção local atual), "mmap" (busca exata em matriz
+# memory-mapped) e "hnsw" (busca aproximada; usa a mesma matriz como armazenamento).
+ENGINE_NAMES = ("qdrant", "mmap", "hnsw")
+
+_SQL_BATCH = 500
+
+QUANTIZATIONS = ("int8", "binary")
+
+# Contagem de bits por byte (para numpy < 2.0, que não tem np.bitwise_count).
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _bit_count(values):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT[values]
+
+
+def _normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class _ReadWriteLock:
+    """
+    Várias buscas ao mesmo tempo, escritas (upsert, delete, compactação) sozinhas.
+    Uma escrita à espera barra leituras novas, para não esperar para sempre sob
+    consultas contínuas. Leitura e escrita são reentrantes na mesma thread
+    (delete -> compact), e a thread que escreve também pode ler.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writer = None
+        self._depth = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        nested = getattr(self._local, "reads", 0) > 0 or self._writer == me
+        if not nested:
+            with self._cond:
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+                self._readers += 1
+        self._local.reads = getattr(self._local, "reads", 0) + 1
+        try:
+            yield
+        finally:
+            self._local.reads -= 1
+            if not nested:
+                with self._cond:
+                    self._readers -= 1
+                    if self._readers == 0:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                self._writers_waiting += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._writers_waiting -= 1
+                self._writer = me
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+class VectorEngine:
+    """
+    Interface comum dos motores de busca vetorial usados pelo AgentManager.
+    O payload de cada ponto segue o formato do LangChain: {"page_content", "metadata"}.
+    """
+
+    name = None
+
+    @property
+    def manifest_filename(self):
+        return f"manifest_{self.name}.json"
+
+    def exists(self):
+        raise NotImplementedError
+
+    def create(self, dimension):
+        """Cria (ou recria, vazio) o índice."""
+        raise NotImplementedError
+
+    def upsert(self, ids, vectors, payloads):
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def set_payloads(self, ids, payloads):
+        """Troca só o payload de pontos existentes (o vetor não muda)."""
+        raise NotImplementedError
+
+    def search(self, vector, k, source=None):
+        """Devolve [(id, score, payload)] por similaridade de cosseno decrescente."""
+        raise NotImplementedError
+
+    def search_batch(self, vectors, k, source=None):
+        """Uma lista de resultados de `search` por vetor. Os motores podem buscar todos de uma vez."""
+        return [self.search(vector, k, source) for vector in vectors]
+
+    def count(self):
+        raise NotImplementedError
+
+    def iter_points(self, batch_size=1024):
+        """Gera lotes (ids, vetores, payloads) com todos os pontos do índice."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def resident_bytes(self):
+        """Memória ocupada pelo índice aberto (estimativa usada no limite de bibliotecas abertas)."""
+        return 0
+
+    def stats(self):
+        return {"engine": self.name, "points": self.count()}
+
+
+class QdrantEngine(VectorEngine):
+    """
+    Coleção local do Qdrant (storage.sqlite em db_storage). Mantém o formato de
+    payload do LangChain, então coleções criadas por versões anteriores continuam válidas.
+    O modo local do Qdrant não tem locks próprios: buscas (threads das perguntas) e
+    escritas (thread da indexação) passam por um lock de leitura/escrita, como no motor mmap.
+    """
+
+    name = "qdrant"
+    manifest_filename = "manifest.json"
+
+    def __init__(self, db_path, collection_name):
+        from qdrant_client import QdrantClient
+
+        if os.path.isfile(db_path):
+            os.remove(db_path)
+        self.collection_name = collection_name
+        self.db_path = db_path
+        self.client = QdrantClient(path=db_path)
+        self._rw = _ReadWriteLock()
+
+    def exists(self):
+        with self._rw.read():
+            return self.collection_name in {c.name for c in self.client.get_collections().collections}
+
+    def create(self, dimension):
+        from qdrant_client.http import models as qdrant_models
+
+        with self._rw.write():
+            if self.exists():
+                self.client.delete_collection(self.collection_name)
+            self.client.create_collection(
+                collection_name=self.collection_name,
+                vectors_config=qdrant_models.VectorParams(size=dimension, distance=qdrant_models.Distance.COSINE),
+            )
+
+    def upsert(self, ids, vectors, payloads):
+        from qdrant_client.http import models as qdrant_models
+
+        points = [
+            qdrant_models.PointStruct(id=point_id, vector=list(map(float, vector)), payload=payload)
+            for point_id, vector, payload in zip(ids, vectors, payloads)
+        ]
+        with self._rw.write():
+            self.client.upsert(collection_name=self.collection_name, points=points)
+
+    def delete(self, ids):
+        from qdrant_client.http import models as qdrant_models
+
+        with self._rw.write():
+            self.client.delete(collection_name=self.collection_name, points_selector=qdrant_models.PointIdsList(points=list(ids)))
+
+    def set_payloads(self, ids, payloads):
+        with self._rw.write():
+            for point_id, payload in zip(ids, payloads):
+                self.client.overwrite_payload(collection_name=self.collection_name, payload=payload, points=[point_id])
+
+    def _source_filter(self, source):
+        from qdrant_client.http import models as qdrant_models
+
+        if source is None:
+            return None
+        return qdrant_models.Filter(must=[
+            qdrant_models.FieldCondition(key="metadata.source", match=qdrant_models.MatchValue(value=source))
+        ])
+
+    def search(self, vector, k, source=None):
+        with self._rw.read():
+            hits = self.client.search(
+                collection_name=self.collection_name, query_vector=list(map(float, vector)), limit=k,
+                query_filter=self._source_filter(source), with_payload=True,
+            )
+        return [(str(hit.id), float(hit.score), hit.payload) for hit in hits]
+
+    def search_batch(self, vectors, k, source=None):
+        from qdrant_client.http import models as qdrant_models
+
+        query_filter = self._source_filter(source)
+        requests = [
+            qdrant_models.SearchRequest(vector=list(map(float, vector)), limit=k, filter=query_filter, with_payload=True)
+            for vector in vectors
+        ]
+        if not requests:
+            return []
+        with self._rw.read():
+            batches = self.client.search_batch(collection_name=self.collection_name, requests=requests)
+        return [[(str(hit.id), float(hit.score), hit.payload) for hit in hits] for hits in batches]
+
+    def count(self):
+        with self._rw.read():
+            return self.client.count(collection_name=self.collection_name).count
+
+    def iter_points(self, batch_size=1024):
+        offset = None
+        while True:
+            with self._rw.read():
+                points, offset = self.client.scroll(
+                    collection_name=self.collection_name, limit=batch_size, offset=offset,
+                    with_payload=True, with_vectors=True,
+                )
+            if points:
+                yield [str(p.id) for p in points], [p.vector for p in points], [p.payload for p in points]
+            if offset is None:
+                break
+
+    def resident_bytes(self):
+        # O modo local do Qdrant carrega a coleção inteira (vetores e payloads) na memória.
+        collection_dir = os.path.join(self.db_path, "collection", self.collection_name)
+        size = 0
+        for root, _, files in os.walk(collection_dir):
+            size += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return size
+
+    def close(self):
+        with self._rw.write():
+            self.client.close()
+
+
+class MmapEngine(VectorEngine):
+    """
+    Busca exata: vetores normalizados numa matriz float32 memory-mapped
+    (vectors.f32) e top-k por produto escalar vetorizado + argpartition.
+    IDs, fontes e payloads ficam em meta.sqlite. Remoções marcam a linha como
+    morta; a matriz é compactada quando as linhas mortas passam de 30%.
+    Buscas seguram o lock de leitura do início ao fim (linhas candidatas e
+    payloads); escritas, que podem renumerar linhas, seguram o de escrita.
+    """
+
+    name = "mmap"
+    INITIAL_CAPACITY = 1024
+    SCORE_BLOCK_ROWS = 65536
+    QUERY_BATCH = 64
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        os.makedirs(index_dir, exist_ok=True)
+        self.vectors_path = os.path.join(index_dir, "vectors.f32")
+        self._lock = threading.RLock()
+        self._rw = _ReadWriteLock()
+        self._conn = sqlite3.connect(os.path.join(index_dir, "meta.sqlite"), check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS points ("
+            " row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, source TEXT, payload TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self.dimension = None
+        self.rows = 0
+        self._matrix = None
+        self._codes = np.zeros(0, dtype=np.int32)   # código da fonte por linha; -1 = linha livre/morta
+        self._source_codes = {}
+        self._id_to_row = {}
+        self._load()
+
+    # --- Persistência ---
+
+    def _info(self, key, default=None):
+        row = self._conn.execute("SELECT value FROM info WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_info(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _load(self):
+        dimension = self._info("dimension")
+        if dimension is None or not os.path.exists(self.vectors_path):
+            return
+        self.dimension = int(dimension)
+        self.rows = int(self._info("rows", 0))
+        capacity = os.path.getsize(self.vectors_path) // (4 * self.dimension)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+        self._codes = np.full(capacity, -1, dtype=np.int32)
+        for row, point_id, source in self._conn.execute("SELECT row, id, source FROM points"):
+            self._codes[row] = self._code_for(source)
+            self._id_to_row[point_id] = row
+
+    def _code_for(self, source):
+        code = self._source_codes.get(source)
+        if code is None:
+            code = self._source_codes[source] = len(self._source_codes)
+        return code
+
+    def _ensure_capacity(self, needed):
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(self.INITIAL_CAPACITY, capacity)
+        while new_capacity < needed:
+            new_capacity *= 2
+        if self._matrix is not None:
+            self._matrix.flush()
+            # No Windows um arquivo mapeado não pode mudar de tamanho: solta o mapa antes.
+            self._matrix = None
+        with open(self.vectors_path, "r+b" if os.path.exists(self.vectors_path) else "wb") as f:
+            f.truncate(new_capacity * self.dimension * 4)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(new_capacity, self.dimension))
+        codes = np.full(new_capacity, -1, dtype=np.int32)
+        codes[:len(self._codes)] = self._codes
+        self._codes = codes
+
+    # --- Interface ---
+
+    def exists(self):
+        return self.dimension is not None
+
+    def create(self, dimension):
+        with self._rw.write(), self._lock:
+            self._matrix = None
+            if os.path.exists(self.vectors_path):
+                os.remove(self.vectors_path)
+            self._conn.execute("DELETE FROM points")
+            self._conn.execute("DELETE FROM info")
+            self.dimension = int(dimension)
+            self.rows = 0
+            self._codes = np.zeros(0, dtype=np.int32)
+            self._source_codes = {}
+            self._id_to_row = {}
+            self._set_info("dimension", self.dimension)
+            self._set_info("rows", 0)
+            self._conn.commit()
+            self._ensure_capacity(self.INITIAL_CAPACITY)
+
+    def _append(self, ids, vectors, payloads):
+        """Grava as linhas novas e devolve (primeira linha, vetores normalizados)."""
+        vectors = _normalize_rows(vectors)
+        replaced = [point_id for point_id in ids if point_id in self._id_to_row]
+        if replaced:
+            self._delete_rows(replaced)
+        start = self.rows
+        self._ensure_capacity(start + len(ids))
+        self._matrix[start:start + len(ids)] = vectors
+        self._matrix.flush()
+        records = []
+        for offset, (point_id, payload) in enumerate(zip(ids, payloads)):
+            row = start + offset
+            source = (payload.get("metadata") or {}).get("source")
+            self._codes[row] = self._code_for(source)
+            self._id_to_row[point_id] = row
+            records.append((row, point_id, source, json.dumps(payload, ensure_ascii=False)))
+        self._conn.executemany("INSERT INTO points (row, id, source, payload) VALUES (?, ?, ?, ?)", records)
+        self.rows = start + len(ids)
+        self._set_info("rows", self.rows)
+        self._conn.commit()
+        return start, vectors
+
+    def upsert(self, ids, vectors, payloads):
+        with self._rw.write(), self._lock:
+            self._append(ids, vectors, payloads)
+
+    def _delete_rows(self, ids):
+        rows = [self._id_to_row.pop(point_id) for point_id in ids if point_id in self._id_to_row]
+        if rows:
+            self._codes[rows] = -1
+            for start in range(0, len(ids), _SQL_BATCH):
+                batch = list(ids[start:start + _SQL_BATCH])
+                self._conn.execute(f"DELETE FROM points WHERE id IN ({','.join('?' * len(batch))})", batch)
+        return rows
+
+    def delete(self, ids):
+        with self._rw.write(), self._lock:
+            self._delete_rows(list(ids))
+            self._conn.commit()
+            if self.rows > 1000 and len(self._id_to_row) < self.rows * 0.7:
+                self.compact()
+
+    def set_payloads(self, ids, payloads):
+        # A fonte faz parte do ID do trecho: o código da fonte de cada linha não muda.
+        with self._rw.write(), self._lock:
+            self._conn.executemany(
+                "UPDATE points SET payload = ? WHERE id = ?",
+                [(json.dumps(payload, ensure_ascii=False), point_id) for point_id, payload in zip(ids, payloads)],
+            )
+            self._conn.commit()
+
+    def compact(self):
+        """
+        Reescreve a matriz só com as linhas vivas, na mesma ordem.
+        """
+        with self._rw.write(), self._lock:
+            alive = np.flatnonzero(self._codes[:self.rows] >= 0)
+            sys.stderr.write(f"[CORE_LOGIC] Compactando indice {self.name}: {self.rows} -> {len(alive)} linha(s).\n")
+            vectors = np.array(self._matrix[alive])
+            tmp_path = self.vectors_path + ".tmp"
+            capacity = max(self.INITIAL_CAPACITY, len(alive))
+            compacted = np.memmap(tmp_path, dtype=np.float32, mode="w+", shape=(capacity, self.dimension))
+            compacted[:len(alive)] = vectors
+            compacted.flush()
+            del compacted
+            self._matrix = None
+            os.replace(tmp_path, self.vectors_path)
+            mapping = {int(old): new for new, old in enumerate(alive)}
+            self._conn.execute("UPDATE points SET row = -row - 1")
+            self._conn.executemany(
+                "UPDATE points SET row = ? WHERE row = ?", [(new, -old - 1) for old, new in mapping.items()]
+            )
+            self._set_info("rows", len(alive))
+            self._conn.commit()
+            self._id_to_row = {}
+            self._source_codes = {}
+            self._load()
+
+    def _candidate_rows(self, query, k, source):
+        """Top-k exato sobre a matriz inteira, em blocos para não carregar tudo de uma vez."""
+        with self._lock:
+            matrix, codes, rows = self._matrix, self._codes, self.rows
+            code = self._source_codes.get(source) if source is not None else None
+        if rows == 0 or (source is not None and code is None):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = np.empty(rows, dtype=np.float32)
+        for start in range(0, rows, self.SCORE_BLOCK_ROWS):
+            end = min(rows, start + self.SCORE_BLOCK_ROWS)
+            scores[start:end] = matrix[start:end] @ query
+        valid = codes[:rows] == code if code is not None else codes[:rows] >= 0
+        scores[~valid] = -np.inf
+        k = min(k, int(valid.sum()))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def _payloads(self, rows):
+        found = {}
+        rows = [int(r) for r in rows]
+        for start in range(0, len(rows), _SQL_BATCH):
+            batch = rows[start:start + _SQL_BATCH]
+            for row, point_id, payload in self._conn.execute(
+                f"SELECT row, id, payload FROM points WHERE row IN ({','.join('?' * len(batch))})", batch
+            ):
+                found[row] = (point_id, json.loads(payload))
+        return found
+
+    def _results(self, rows, scores):
+        with self._lock:
+            found = self._payloads(rows)
+        return [(found[int(r)][0], float(s), found[int(r)][1]) for r, s in zip(rows, scores) if int(r) in found]
+
+    def search(self, vector, k, source=None):
+        with self._rw.read():
+            rows, scores = self._candidate_rows(_normalize_rows(vector)[0], k, source)
+            return self._results(rows, scores)
+
+    def _candidate_rows_batch(self, queries, k, source):
+        """
+        Top-k exato de várias consultas numa passada pela matriz: cada bloco de linhas
+        é lido uma vez e multiplicado por todas as consultas (matriz x matriz).
+        """
+        with self._lock:
+            matrix, codes, rows = self._matrix, self._codes, self.rows
+            code = self._source_codes.get(source) if source is not None else None
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        if rows == 0 or (source is not None and code is None):
+            return [empty] * len(queries)
+        valid = codes[:rows] == code if code is not None else codes[:rows] >= 0
+        k = min(k, int(valid.sum()))
+        if k <= 0:
+            return [empty] * len(queries)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, rows, self.SCORE_BLOCK_ROWS):
+            end = min(rows, start + self.SCORE_BLOCK_ROWS)
+            scores = queries @ np.asarray(matrix[start:end]).T    # (consultas, linhas do bloco)
+            scores[:, ~valid[start:end]] = -np.inf
+            block_rows = np.broadcast_to(np.arange(start, end), scores.shape)
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                block_rows, scores = np.take_along_axis(block_rows, top, axis=1), np.take_along_axis(scores, top, axis=1)
+            # Top-k do bloco somado aos melhores até aqui; fica só o top-k de cada consulta.
+            best_rows = np.concatenate([best_rows, block_rows], axis=1)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            if best_scores.shape[1] > k:
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, top, axis=1)
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        results = []
+        for row_ids, row_scores in zip(best_rows, best_scores):
+            keep = np.isfinite(row_scores)
+            results.append((row_ids[keep], row_scores[keep]))
+        return results
+
+    def search_batch(self, vectors, k, source=None):
+        if len(vectors) == 0:
+            return []
+        queries = _normalize_rows(vectors)
+        with self._rw.read():
+            # Grupos de consultas limitam a matriz de scores de cada bloco (linhas x consultas).
+            candidates = []
+            for start in range(0, len(queries), self.QUERY_BATCH):
+                candidates.extend(self._candidate_rows_batch(queries[start:start + self.QUERY_BATCH], k, source))
+            # Payloads de todas as consultas numa única leitura do SQLite.
+            with self._lock:
+                found = self._payloads(np.unique(np.concatenate([rows for rows, _ in candidates])))
+        return [
+            [(found[int(r)][0], float(s), found[int(r)][1]) for r, s in zip(rows, scores) if int(r) in found]
+            for rows, scores in candidates
+        ]
+
+    def count(self):
+        return len(self._id_to_row)
+
+    def iter_points(self, batch_size=1024):
+        with self._lock:
+            rows = sorted(self._id_to_row.values())
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            with self._rw.read(), self._lock:
+                found = self._payloads(batch)
+                vectors = np.array(self._matrix[batch])
+            yield [found[r][0] for r in batch], vectors, [found[r][1] for r in batch]
+
+    def resident_bytes(self):
+        # Só códigos e mapas ficam na memória do processo; a matriz é paginada pelo sistema.
+        return self._codes.nbytes
+
+    def stats(self):
+        return {
+            "engine": self.name,
+            "points": self.count(),
+            "rows": self.rows,
+            "vectors_file_bytes": os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0,
+        }
+
+    def close(self):
+        with self._rw.write(), self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+            self._conn.close()
+
+
+class HnswEngine(MmapEngine):
+    """
+    Busca aproximada com um grafo HNSW (hnswlib) sobre as linhas da matriz
+    memory-mapped, que continua sendo o armazenamento durável dos vetores.
+    O grafo é salvo periodicamente; linhas gravadas depois do último salvamento
+    são reinseridas ao abrir. `ef_search` controla o equilíbrio recall x latência.
+    """
+
+    name = "hnsw"
+    SAVE_EVERY_ROWS = 20000
+
+    def __init__(self, index_dir, ef_search=64, m=16, ef_construction=200):
+        self.ef_search = ef_search
+        self.m = m
+        self.ef_construction = ef_construction
+        self.graph_path = os.path.join(index_dir, "hnsw.bin")
+        self._graph = None
+        self._unsaved_rows = 0
+        super().__init__(index_dir)
+
+    def _load(self):
+        super()._load()
+        if self.dimension is None:
+            return
+        import hnswlib
+
+        capacity = self._matrix.shape[0]
+        self._graph = hnswlib.Index(space="ip", dim=self.dimension)
+        graph_rows = int(self._info("graph_rows", 0))
+        if os.path.exists(self.graph_path) and graph_rows <= self.rows:
+            self._graph.load_index(self.graph_path, max_elements=capacity)
+        else:
+            self._graph.init_index(max_elements=capacity, ef_construction=self.ef_construction, M=self.m)
+            graph_rows = 0
+        # Reinsere o que foi gravado depois do último salvamento do grafo.
+        if graph_rows < self.rows:
+            missing = np.arange(graph_rows, self.rows)
+            self._graph.add_items(np.array(self._matrix[missing]), missing)
+        dead = np.flatnonzero(self._codes[:self.rows] < 0)
+        for row in dead:
+            try:
+                self._graph.mark_deleted(int(row))
+            except RuntimeError:
+                pass  # já marcada
+        if graph_rows < self.rows:
+            self._save_graph()
+
+    def _save_graph(self):
+        self._graph.save_index(self.graph_path)
+        self._set_info("graph_rows", self.rows)
+        self._conn.commit()
+        self._unsaved_rows = 0
+
+    def create(self, dimension):
+        with self._rw.write(), self._lock:
+            if os.path.exists(self.graph_path):
+                os.remove(self.graph_path)
+            super().create(dimension)
+            import hnswlib
+            self._graph = hnswlib.Index(space="ip", dim=self.dimension)
+            self._graph.init_index(max_elements=self._matrix.shape[0], ef_construction=self.ef_construction, M=self.m)
+            self._save_graph()
+
+    def upsert(self, ids, vectors, payloads):
+        # resize_index/add_items não podem rodar junto com knn_query: exclui as buscas.
+        with self._rw.write(), self._lock:
+            start, normalized = self._append(ids, vectors, payloads)
+            if self._graph.get_max_elements() < self._matrix.shape[0]:
+                self._graph.resize_index(self._matrix.shape[0])
+            self._graph.add_items(normalized, np.arange(start, start + len(ids)))
+            self._unsaved_rows += len(ids)
+            if self._unsaved_rows >= self.SAVE_EVERY_ROWS:
+                self._save_graph()
+
+    def _delete_rows(self, ids):
+        rows = super()._delete_rows(ids)
+        if self._graph is not None:
+            for row in rows:
+                try:
+                    self._graph.mark_deleted(int(row))
+                except RuntimeError:
+                    pass
+        return rows
+
+    def compact(self):
+        # A compactação renumera as linhas: o grafo é reconstruído a partir da matriz.
+        with self._rw.write(), self._lock:
+            if os.path.exists(self.graph_path):
+                os.remove(self.graph_path)
+            self._set_info("graph_rows", 0)
+            super().compact()
+
+    def search(self, vector, k, source=None):
+        query = _normalize_rows(vector)
+        with self._rw.read():
+            with self._lock:
+                graph, codes = self._graph, self._codes
+                alive = len(self._id_to_row)
+                code = self._source_codes.get(source) if source is not None else None
+            if alive == 0 or (source is not None and code is None):
+                return []
+            k = min(k, alive)
+            graph.set_ef(max(self.ef_search, k))
+            if code is None:
+                labels, distances = graph.knn_query(query, k=k)
+            else:
+                try:
+                    labels, distances = graph.knn_query(query, k=k, filter=lambda label: codes[label] == code)
+                except (TypeError, RuntimeError):
+                    # hnswlib sem suporte a filtro (ou poucos pontos da fonte): busca mais e filtra depois.
+                    labels, distances = graph.knn_query(query, k=min(alive, k * 20))
+                    keep = [i for i, label in enumerate(labels[0]) if codes[label] == code][:k]
+                    labels, distances = labels[:, keep], distances[:, keep]
+            # Espaço "ip" do hnswlib: distância = 1 - produto escalar.
+            return self._results(labels[0], 1.0 - distances[0])
+
+    def search_batch(self, vectors, k, source=None):
+        if source is not None or len(vectors) == 0:
+            # Com filtro de fonte, cada consulta pode precisar do caminho alternativo de search.
+            return VectorEngine.search_batch(self, vectors, k, source)
+        queries = _normalize_rows(vectors)
+        with self._rw.read():
+            with self._lock:
+                graph, alive = self._graph, len(self._id_to_row)
+            if alive == 0:
+                return [[] for _ in range(len(queries))]
+            k = min(k, alive)
+            graph.set_ef(max(self.ef_search, k))
+            # knn_query aceita a matriz de consultas inteira e distribui entre as threads do hnswlib.
+            labels, distances = graph.knn_query(queries, k=k)
+            with self._lock:
+                found = self._payloads(np.unique(labels))
+            return [
+                [(found[int(r)][0], float(1.0 - d), found[int(r)][1]) for r, d in zip(row_labels, row_distances) if int(r) in found]
+                for row_labels, row_distances in zip(labels, distances)
+            ]
+
+    def resident_bytes(self):
+        # O grafo guarda uma cópia de cada vetor mais 2*M vizinhos na camada base.
+        if self._graph is None:
+            return super().resident_bytes()
+        per_element = self.dimension * 4 + self.m * 2 * 4 + 16
+        return super().resident_bytes() + self._graph.get_max_elements() * per_element
+
+    def close(self):
+        with self._rw.write(), self._lock:
+            if self._graph is not None and self._unsaved_rows:
+                self._save_graph()
+            super().close()
+
+
+class QuantizedMmapEngine(MmapEngine):
+    """
+    Variante do motor mmap com primeira passada sobre vetores quantizados:
+    - "int8": quantização escalar por linha (1 byte por dimensão + 1 escala float32), ~4x menor;
+    - "binary": só o sinal de cada dimensão (1 bit), ~32x menor, comparado por distância de Hamming.
+    Os `k * oversample` melhores candidatos são reordenados com os vetores float32
+    completos, que ficam em disco (vectors.f32) e só são lidos para esses candidatos.
+    Os códigos são derivados da matriz completa, então ligar/desligar a quantização
+    reaproveita o mesmo índice e o mesmo manifesto do motor mmap.
+    """
+
+    name = "mmap"
+
+    def __init__(self, index_dir, quantization="int8", oversample=None):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Quantizacao desconhecida: {quantization}. Use um de: {', '.join(QUANTIZATIONS)}.")
+        self.quantization = quantization
+        self.oversample = oversample or (4 if quantization == "int8" else 10)
+        self.quantized_path = os.path.join(index_dir, f"vectors.{quantization}")
+        self.scales_path = os.path.join(index_dir, "scales.f32")
+        self._quantized = None
+        self._row_scales = None
+        super().__init__(index_dir)
+
+    def _width(self):
+        return self.dimension if self.quantization == "int8" else (self.dimension + 7) // 8
+
+    def _quantize(self, vectors):
+        if self.quantization == "int8":
+            scales = np.abs(vectors).max(axis=1)
+            scales[scales == 0] = 1.0
+            scales = (scales / 127.0).astype(np.float32)
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales
+        return np.packbits(vectors > 0, axis=1), None
+
+    def _open_quantized(self):
+        # Mantém os arquivos quantizados com a mesma capacidade (em linhas) da matriz completa.
+        capacity = self._matrix.shape[0]
+        files = [(self.quantized_path, np.int8 if self.quantization == "int8" else np.uint8, (capacity, self._width()))]
+        if self.quantization == "int8":
+            files.append((self.scales_path, np.float32, (capacity,)))
+        opened = []
+        self._quantized = self._row_scales = None
+        for path, dtype, shape in files:
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                f.truncate(size)
+            opened.append(np.memmap(path, dtype=dtype, mode="r+", shape=shape))
+        self._quantized = opened[0]
+        self._row_scales = opened[1] if len(opened) > 1 else None
+
+    def _write_quantized(self, start, vectors):
+        codes, scales = self._quantize(vectors)
+        self._quantized[start:start + len(vectors)] = codes
+        self._quantized.flush()
+        if scales is not None:
+            self._row_scales[start:start + len(vectors)] = scales
+            self._row_scales.flush()
+
+    def _load(self):
+        super()._load()
+        if self.dimension is None:
+            return
+        self._open_quantized()
+        if int(self._info(f"quantized_rows_{self.quantization}", -1)) != self.rows:
+            # Códigos ausentes ou desatualizados: recalcula a partir da matriz completa.
+            sys.stderr.write(f"[CORE_LOGIC] Quantizando {self.rows} vetor(es) ({self.quantization})...\n")
+            for start in range(0, self.rows, self.SCORE_BLOCK_ROWS):
+                end = min(self.rows, start + self.SCORE_BLOCK_ROWS)
+                self._write_quantized(start, np.array(self._matrix[start:end]))
+            self._set_info(f"quantized_rows_{self.quantization}", self.rows)
+            self._conn.commit()
+
+    def _ensure_capacity(self, needed):
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        super()._ensure_capacity(needed)
+        if self._matrix.shape[0] != capacity or self._quantized is None:
+            self._open_quantized()
+
+    def create(self, dimension):
+        with self._rw.write(), self._lock:
+            self._quantized = self._row_scales = None
+            for path in (self.quantized_path, self.scales_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            super().create(dimension)
+            self._set_info(f"quantized_rows_{self.quantization}", 0)
+            self._conn.commit()
+
+    def _append(self, ids, vectors, payloads):
+        start, normalized = super()._append(ids, vectors, payloads)
+        self._write_quantized(start, normalized)
+        self._set_info(f"quantized_rows_{self.quantization}", self.rows)
+        self._conn.commit()
+        return start, normalized
+
+    def compact(self):
+        with self._rw.write(), self._lock:
+            self._set_info(f"quantized_rows_{self.quantization}", -1)
+            super().compact()
+
+    def _candidate_rows(self, query, k, source):
+        with self._lock:
+            matrix, quantized, row_scales = self._matrix, self._quantized, self._row_scales
+            codes, rows = self._codes, self.rows
+            code = self._source_codes.get(source) if source is not None else None
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        if rows == 0 or (source is not None and code is None):
+            return empty
+
+        # 1ª passada: só os códigos quantizados são lidos.
+        approx = np.empty(rows, dtype=np.float32)
+        query_bits = np.packbits(query > 0) if self.quantization == "binary" else None
+        for start in range(0, rows, self.SCORE_BLOCK_ROWS):
+            end = min(rows, start + self.SCORE_BLOCK_ROWS)
+            if self.quantization == "int8":
+                approx[start:end] = (quantized[start:end].astype(np.float32) @ query) * row_scales[start:end]
+            else:
+                approx[start:end] = -_bit_count(quantized[start:end] ^ query_bits).sum(axis=1, dtype=np.int32)
+        valid = codes[:rows] == code if code is not None else codes[:rows] >= 0
+        approx[~valid] = -np.inf
+        candidates = min(k * self.oversample, int(valid.sum()))
+        if candidates <= 0:
+            return empty
+        shortlist = np.sort(np.argpartition(-approx, candidates - 1)[:candidates])
+
+        # 2ª passada: reordena os candidatos com os vetores float32 completos (lidos do disco).
+        exact = np.asarray(matrix[shortlist]) @ query
+        k = min(k, len(shortlist))
+        order = np.argsort(-exact)[:k]
+        return shortlist[order], exact[order]
+
+    def _candidate_rows_batch(self, queries, k, source):
+        # A 1ª passada já lê só os códigos compactos; cada consulta segue o caminho de search.
+        return [self._candidate_rows(query, k, source) for query in queries]
+
+    def resident_bytes(self):
+        size = self._quantized.nbytes if self._quantized is not None else 0
+        if self._row_scales is not None:
+            size += self._row_scales.nbytes
+        return size + self._codes.nbytes
+
+    def stats(self):
+        stats = super().stats()
+        full = self.rows * (self.dimension or 0) * 4
+        quantized = self.rows * ((self._width() if self.dimension else 0) + (4 if self.quantization == "int8" else 0))
+        stats.update({
+            "quantization": self.quantization,
+            "oversample": self.oversample,
+            "full_precision_bytes": full,
+            "quantized_bytes": quantized,
+            "compression_ratio": round(full / quantized, 1) if quantized else None,
+        })
+        return stats
+
+
+def open_engine(name, db_path, collection_name, ef_search=64, quantization=None, oversample=None):
+    """
+    Abre (sem criar) o motor `name` dentro de db_path.
+    """
+    if name == "qdrant":
+        return QdrantEngine(db_path, collection_name)
+    if name == "mmap" and quantization:
+        return QuantizedMmapEngine(os.path.join(db_path, "mmap_index"), quantization, oversample)
+    if name == "mmap":
+        return MmapEngine(os.path.join(db_path, "mmap_index"))
+    if name == "hnsw":
+        return HnswEngine(os.path.join(db_path, "hnsw_index"), ef_search=ef_search)
+    raise ValueError(f"Motor de busca vetorial desconhecido: {name}. Use um de: {', '.join(ENGINE_NAMES)}.")
+
+
+def copy_engine(source_engine, target_engine, batch_size=1024):
+    """
+    Copia todos os pontos de um motor para outro (ex: da coleção Qdrant para o mmap).
+    """
+    copied = 0
+    for ids, vectors, payloads in source_engine.iter_points(batch_size):
+        if not target_engine.exists():
+            target_engine.create(len(vectors[0]))
+        target_engine.upsert(ids, vectors, payloads)
+        copied += len(ids)
+    return copied
+
+
+def evaluate_engine(candidate, reference, query_vectors, k=5, source=None):
+    """
+    Mede recall@k e latência de `candidate` contra `reference` (a busca exata atual).
+    """
+    recalls, candidate_ms, reference_ms = [], [], []
+    for vector in query_vectors:
+        start = time.perf_counter()
+        expected = {point_id for point_id, _, _ in reference.search(vector, k, source)}
+        reference_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        found = {point_id for point_id, _, _ in candidate.search(vector, k, source)}
+        candidate_ms.append((time.perf_counter() - start) * 1000)
+        if expected:
+            recalls.append(len(found & expected) / len(expected))
+    return {
+        "engine": candidate.name,
+        "reference": reference.name,
+        "k": k,
+        "queries": len(query_vectors),
+        "recall_at_k": round(sum(recalls) / len(recalls), 4) if recalls else None,
+        "latency_ms": {"p50": round(metrics.percentile(candidate_ms, 50) or 0.0, 3), "p95": round(metrics.percentile(candidate_ms, 95) or 0.0, 3)},
+        "reference_latency_ms": {"p50": round(metrics.percentile(reference_ms, 50) or 0.0, 3), "p95": round(metrics.percentile(reference_ms, 95) or 0.0, 3)},
+    }
+
+
+def main():
+    """
+    Compara um motor novo com a coleção Qdrant atual:
+        python vector_engines.py --engine hnsw --queries 200
+    O motor é montado numa pasta temporária a partir dos pontos do Qdrant, e as
+    consultas são vetores da própria coleção com um pequeno ruído.
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Recall e latência dos motores de busca vetorial.")
+    parser.add_argument("--db", default=os.path.join(base_dir, "db_storage"))
+    parser.add_argument("--collection", default="manus_biblioteca_vetorial")
+    parser.add_argument("--engine", choices=["mmap", "hnsw"], default="hnsw")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--ef", type=int, default=64)
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default=None, help="Só para --engine mmap.")
+    parser.add_argument("--oversample", type=int, default=None)
+    parser.add_argument("--source", default=None, help="Filtra a busca por um documento (metadata.source).")
+    args = parser.parse_args()
+
+    import tempfile
+    reference = QdrantEngine(args.db, args.collection)
+    work_dir = tempfile.mkdtemp(prefix="il_engine_")
+    try:
+        if args.engine == "mmap" and args.quantization:
+            candidate = QuantizedMmapEngine(os.path.join(work_dir, "mmap_index"), args.quantization, args.oversample)
+        elif args.engine == "mmap":
+            candidate = MmapEngine(os.path.join(work_dir, "mmap_index"))
+        else:
+            candidate = HnswEngine(os.path.join(work_dir, "hnsw_index"), ef_search=args.ef)
+        start = time.perf_counter()
+        copied = copy_engine(reference, candidate)
+        build_seconds = time.perf_counter() - start
+
+        rng = np.random.default_rng(42)
+        sample = []
+        for _, vectors, _ in candidate.iter_points(batch_size=max(1, args.queries)):
+            sample.extend(np.asarray(vectors, dtype=np.float32))
+            if len(sample) >= args.queries * 10:
+                break
+        picks = rng.choice(len(sample), size=min(args.queries, len(sample)), replace=False) if sample else []
+        queries = [sample[i] + rng.normal(0, 0.02, size=len(sample[i])).astype(np.float32) for i in picks]
+
+        report = evaluate_engine(candidate, reference, queries, k=args.k, source=args.source)
+        report.update({"points": copied, "build_seconds": round(build_seconds, 2), "index": candidate.stats()})
+        print(json.dumps(report, indent=2))
+        candidate.close()
+    finally:
+        reference.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -34,6 +34,8 @@ export default function App() {
   const [statusMessage, setStatusMessage] = useState<string>('Aguardando ação...');
 
   const chatEndRef = useRef<HTMLDivElement>(null);
+  // Nova verificação de estado agendada enquanto o backend restaura o índice salvo.
+  const statusPollRef = useRef<number | null>(null);
 
   useEffect(() => {
     if (window.api) {
@@ -47,8 +49,28 @@ export default function App() {
         }
 
         switch (response.action) {
-          case 'verificar_estado_inicial':
-            if (response.result.status === 'NOT_READY') {
+          case 'verificar_estado_inicial': {
+            const result = response.result;
+            if (result.status === 'READY') {
+              // O backend reabriu o índice salvo na inicialização: chave e documentos já estão prontos.
+              const storedApiKey = localStorage.getItem('openai_api_key');
+              if (storedApiKey) {
+                setApiKey(storedApiKey);
+              }
+              setIsApiKeySet(true);
+              setIsReady(true);
+              setError(null);
+              setStatusMessage('Índice restaurado. Pronto para perguntas.');
+            } else if (result.index_status === 'RESTORING' || result.model_status === 'LOADING') {
+              // Restauração (ou aquecimento do modelo) em segundo plano: pergunta de novo até o estado assentar.
+              setStatusMessage('Restaurando o índice salvo...');
+              if (statusPollRef.current === null) {
+                statusPollRef.current = window.setTimeout(() => {
+                  statusPollRef.current = null;
+                  window.api.send('to-python', { action: 'verificar_estado_inicial' });
+                }, 1000);
+              }
+            } else if (result.status === 'NOT_READY') {
               const storedApiKey = localStorage.getItem('openai_api_key');
               if (storedApiKey) {
                 setApiKey(storedApiKey);
@@ -56,6 +78,7 @@ export default function App() {
               }
             }
             break;
+          }
           case 'salvar_e_validar_chave':
             if (response.result.success) {
               setIsApiKeySet(true);
@@ -84,10 +107,22 @@ export default function App() {
               setStatusMessage('Aguardando ação...');
             }
             break;
+          case 'progresso_indexacao': {
+            // Indexação em andamento: o carregamento continua e as perguntas já podem usar o índice parcial.
+            const progress = response.progress;
+            // Com o índice parcial consultável, o chat fica liberado enquanto a indexação segue.
+            setIsLoading(!progress.queryable);
+            const eta = progress.eta_seconds != null ? ` (~${Math.ceil(progress.eta_seconds)}s restantes)` : '';
+            setStatusMessage(`Indexando ${progress.files_done}/${progress.files_total} arquivo(s), ${progress.chunks_done} trecho(s)${eta}...`);
+            if (progress.queryable) {
+              setIsReady(true);
+            }
+            break;
+          }
           case 'carregar_documentos':
             if (response.result.success) {
               setIsReady(true);
-              setMessages([{ id: Date.now(), text: response.result.message, sender: 'bot' }]);
+              setMessages(prev => [...prev, { id: Date.now(), text: response.result.message, sender: 'bot' }]);
             } else {
               setError(response.result.message);
             }
@@ -101,7 +136,8 @@ export default function App() {
               const answerParts = data.answer.split('Fontes:');
               const botText = answerParts[0].trim();
               const sourcesText = answerParts.length > 1 ? answerParts[1].trim().split('\n').filter(s => s.trim() !== '') : undefined;
-              const botMessage: Message = { id: Date.now() + 1, text: botText, sender: 'bot', sources: sourcesText };
+              const partialNote = data.partial_index ? '\n\n(Resposta baseada em um índice parcial: a indexação ainda não terminou.)' : '';
+              const botMessage: Message = { id: Date.now() + 1, text: botText + partialNote, sender: 'bot', sources: sourcesText };
               setMessages(prev => [...prev, botMessage]);
             }
             break;
@@ -115,6 +151,13 @@ export default function App() {
       console.error("API do Electron não encontrada.");
       setError("Erro Crítico: A aplicação deve ser executada através do Electron.");
     }
+
+    return () => {
+      if (statusPollRef.current !== null) {
+        window.clearTimeout(statusPollRef.current);
+        statusPollRef.current = null;
+      }
+    };
   }, [apiKey]); // Depender de 'apiKey' é importante aqui
 
   useEffect(() => {